@@ -19,10 +19,16 @@ import PREDICT.addexceptions as ae
 import imagefeatures.get_features as gf
 import IOparser.config_io_CalcFeatures as config_io
 import IOparser.file_io as IO
+from IOparser.feature_store import FeatureStore
+from IOparser.volume_cache import VolumeCache
 import pandas as pd
 import SimpleITK as sitk
 import numpy as np
 import os
+import json
+import time
+import traceback
+import multiprocessing
 import dicom as pydicom
 
 # There is a small difference between the contour and image origin and spacing
@@ -73,6 +79,21 @@ def CalcFeatures(image, segmentation, parameters, output,
     # Load variables from the confilg file
     config = config_io.load_config(parameters)
 
+    calc_features(image, segmentation, config, output, metadata_file,
+                  semantics_file, verbose)
+
+
+def calc_features(image, segmentation, config, output, metadata_file=None,
+                  semantics_file=None, verbose=True, patient_ID=None):
+    '''
+    Calculate features from a ROI of an image using an already parsed
+    configuration. See the CalcFeatures function for a description of the
+    arguments, the only difference being that config should be the dictionary
+    returned by the config_io_CalcFeatures.load_config function.
+
+    If a feature store is configured, the features are also appended to
+    that store under patient_ID, which defaults to the basename of the output.
+    '''
     # Calculate the image features
     parameters = config['ImageFeatures']['parameters']
     image_type = config['ImageFeatures']['image_type']
@@ -80,19 +101,35 @@ def CalcFeatures(image, segmentation, parameters, output,
     panda_labels = ['image_type', 'parameters', 'feature_values',
                     'feature_labels']
 
-    print('Loading inputs.')
-    # Read the image data, metadata and semantics
-    image_data = load_images(image, image_type, metadata_file, semantics_file)
-
-    # Read the contour
+    # Read the contour first, so only the region of the image around the
+    # contour has to be read
     print('Load segmentation.')
     if type(segmentation) is list:
         segmentation = ''.join(segmentation)
 
     contour = sitk.ReadImage(segmentation)
 
+    print('Loading inputs.')
+    # Read the image data, metadata and semantics
+    volume_cache = None
+    if config['General'].get('VolumeCache'):
+        volume_cache = VolumeCache(config['General']['VolumeCache'],
+                                   config['General'].get('VolumeCacheSize'))
+
+    image_data = load_images(image, image_type, metadata_file, semantics_file,
+                             volume_cache, contour,
+                             config['ImageFeatures'].get('roi_margin'))
+
+    if image_data.get('region') is not None:
+        contour = sitk.RegionOfInterest(contour, image_data['region_size'],
+                                        image_data['region'])
+
     # FIXME: Bug in some of our own segmentations. Shouldnt occur in normal usage
-    szi = image_data['images'].GetSize()
+    # NOTE: DTI images are a list or only contain the masked voxels
+    if isinstance(image_data['images'], sitk.Image):
+        szi = image_data['images'].GetSize()
+    else:
+        szi = contour.GetSize()
     szs = contour.GetSize()
     if szi != szs:
         message = ('Shapes of image({}) and mask ({}) do not match!').format(str(szi), str(szs))
@@ -129,6 +166,15 @@ def CalcFeatures(image, segmentation, parameters, output,
     print('Saving image features')
     panda_data.to_hdf(output, 'image_features')
 
+    if config['General'].get('FeatureStore'):
+        if patient_ID is None:
+            patient_ID = os.path.splitext(os.path.basename(output))[0]
+
+        print(('Appending image features to feature store {}.').format(config['General']['FeatureStore']))
+        store = FeatureStore(config['General']['FeatureStore'])
+        store.append(patient_ID, feature_values, feature_labels,
+                     ','.join(image_type))
+
     # If required, print output feature values
     if verbose:
         print('Feature Values:')
@@ -136,8 +182,149 @@ def CalcFeatures(image, segmentation, parameters, output,
             print k, v
 
 
+def CalcFeaturesBatch(manifest, parameters, log=None, n_jobs=None,
+                      overwrite=True, verbose=False):
+    '''
+    Calculate features for a full cohort. The cohort is described by a
+    manifest, in which each entry refers to the image, segmentation, metadata,
+    semantics and output file of a single patient. The entries are processed
+    in a pool of worker processes, each of which runs the same extraction as
+    the CalcFeatures function. The configuration is parsed only once.
+
+    The output of each patient is written to disk as soon as it is finished.
+    Failures are recorded in the log and do not stop the other patients.
+
+    Parameters
+    ----------
+    manifest: string, mandatory
+            path referring to a .csv or .json file describing the cohort. See
+            the load_manifest function in IOparser/file_io for the format.
+
+    parameters: string, mandatory,
+            path referring to a .ini file containing the parameters
+            used for feature extraction. See the Github Wiki for the possible
+            fields and their description.
+
+    log: string, optional
+            path referring to the file to which the status of each patient is
+            written, one JSON dictionary per line. Defaults to the manifest
+            filename with _log.json appended.
+
+    n_jobs: integer, optional
+            Number of worker processes to use. Defaults to the Joblib_ncores
+            setting from the configuration.
+
+    overwrite: boolean, default True
+            If False, patients for which the output file already exists are
+            skipped, which allows resuming an interrupted cohort run.
+
+    verbose: boolean, default False
+            print final feature values and labels to command line or not.
+
+    Returns
+    ----------
+    status: list
+            Contains a dictionary per patient with the patient ID, output file,
+            status ('success', 'failed' or 'skipped'), runtime and, in case of
+            a failure, the error message and traceback.
+
+    '''
+    if type(manifest) is list:
+        manifest = ''.join(manifest)
+
+    if type(parameters) is list:
+        parameters = ''.join(parameters)
+
+    # Load variables from the config file only once for the full cohort
+    config = config_io.load_config(parameters)
+    cases = IO.load_manifest(manifest)
+
+    if log is None:
+        log = os.path.splitext(manifest)[0] + '_log.json'
+
+    if n_jobs is None:
+        n_jobs = config['General']['Joblib_ncores']
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = 1
+
+    # Divide the cores over the workers to prevent oversubscription when
+    # the feature computation itself is also parallelized
+    if config['General']['Joblib_ncores'] is not None:
+        config['General']['Joblib_ncores'] =\
+            max(1, config['General']['Joblib_ncores'] // n_jobs)
+
+    tasks = list()
+    status = list()
+    for case in cases:
+        if not overwrite and os.path.exists(case['output']):
+            status.append({'patient': case['patient'],
+                           'output': case['output'],
+                           'status': 'skipped'})
+        else:
+            tasks.append((case, config, verbose))
+
+    print(('Calculating features for {} patients using {} processes.').format(str(len(tasks)), str(n_jobs)))
+    pool = multiprocessing.Pool(processes=min(n_jobs, max(len(tasks), 1)))
+    try:
+        with open(log, 'a') as fp:
+            for case_status in status:
+                fp.write(json.dumps(case_status) + '\n')
+
+            # Write the status of each patient as soon as it is finished
+            for num, case_status in enumerate(pool.imap_unordered(_calc_features_case, tasks)):
+                fp.write(json.dumps(case_status) + '\n')
+                fp.flush()
+                status.append(case_status)
+                print(('[{}/{}] {}: {}.').format(str(num + 1), str(len(tasks)),
+                                                 case_status['patient'],
+                                                 case_status['status']))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    # Rewrite the feature store with larger chunks now all patients are in
+    store_file = config['General'].get('FeatureStore')
+    if store_file and FeatureStore.is_feature_store(store_file):
+        print(('Compacting feature store {}.').format(store_file))
+        FeatureStore(store_file).compact()
+
+    failed = [s['patient'] for s in status if s['status'] == 'failed']
+    if failed:
+        print(('[PREDICT Warning] Feature calculation failed for {} patients: {}. See {} for details.').format(str(len(failed)), ', '.join(failed), log))
+
+    return status
+
+
+def _calc_features_case(task):
+    '''
+    Worker function for CalcFeaturesBatch: compute the features for a single
+    manifest entry and catch any error, such that a single failing patient
+    does not interrupt the full cohort.
+    '''
+    case, config, verbose = task
+    case_status = {'patient': case['patient'], 'output': case['output']}
+    start = time.time()
+    try:
+        calc_features(case['image'], case['segmentation'], config,
+                      case['output'], case['metadata'], case['semantics'],
+                      verbose, case['patient'])
+        case_status['status'] = 'success'
+    except Exception as e:
+        case_status['status'] = 'failed'
+        case_status['error'] = repr(e)
+        case_status['traceback'] = traceback.format_exc()
+
+    case_status['runtime'] = time.time() - start
+    return case_status
+
+
 def load_images(image_file, image_type, metadata_file=None,
-                semantics_file=None):
+                semantics_file=None, volume_cache=None, mask=None,
+                margin=None):
     '''
     Load ITK images, the corresponding DICOM file for the metadata, a file
     containing the semantics and converts them to Python objects.
@@ -159,6 +346,24 @@ def load_images(image_file, image_type, metadata_file=None,
     semantics_file: string, optional
             path referring to a CSV file. Used to extract semantic features.
 
+    volume_cache: VolumeCache, optional
+            cache in which decoded DICOM series are stored, so later runs
+            on the same series do not decode it again. See the volume_cache
+            module in the IOparser folder.
+
+    mask: ITK Image, optional
+            mask of the ROI. If given together with a margin and the image
+            is a single image file, only the bounding box of the mask plus
+            the margin is read from the image. The index and size of this
+            region are returned as region and region_size in the image data.
+            For DTI, only the voxels within the mask are read, see
+            file_io.load_DTI_voxels.
+
+    margin: integer, optional
+            margin in voxels around the mask, see the roi_margin field of the
+            ImageFeatures config section. If None or negative, the full
+            image is read.
+
     '''
     # Convert the input arguments to strings if given as lists
     if type(image_file) is list:
@@ -172,16 +377,22 @@ def load_images(image_file, image_type, metadata_file=None,
 
     # Read the input image based on the filetype provided
     print('Load image and metadata file.')
+    region = None
+    region_size = None
     extension = os.path.splitext(image_file)
     if extension == '.dcm':
         # Single DICOM, so convert back to a list to use load_dicom
         image_file = [image_file]
         if 'MR' in image_type:
-            image, metadata = IO.load_dicom(image_file)
+            image, metadata = IO.load_dicom(image_file, cache=volume_cache)
         elif 'DTI' in image_type:
-            image, metadata = IO.load_DTI(image_file)
+            if mask is not None and 'DTI_post' not in image_type:
+                # Only keep the voxels within the mask of each b-value
+                image, metadata = IO.load_DTI_voxels(image_file, mask)
+            else:
+                image, metadata = IO.load_DTI(image_file)
         elif 'CT' in image_type:
-            image, metadata = IO.load_dicom(image_file)
+            image, metadata = IO.load_dicom(image_file, cache=volume_cache)
 
             # Convert intensity to Hounsfield units
             image = image*metadata.RescaleSlope +\
@@ -190,16 +401,24 @@ def load_images(image_file, image_type, metadata_file=None,
     elif not os.path.isfile(image_file):
         # Assume input is a DICOM folder
         if 'MR' in image_type:
-            image, metadata = IO.load_dicom(image_file)
+            image, metadata = IO.load_dicom(image_file, cache=volume_cache)
         elif 'DTI' in image_type:
-            image, metadata = IO.load_DTI(image_file)
+            if mask is not None and 'DTI_post' not in image_type:
+                # Only keep the voxels within the mask of each b-value
+                image, metadata = IO.load_DTI_voxels(image_file, mask)
+            else:
+                image, metadata = IO.load_DTI(image_file)
         elif 'CT' in image_type:
-            image, metadata = IO.load_dicom(image_file)
+            image, metadata = IO.load_dicom(image_file, cache=volume_cache)
 
     else:
         # Since input is only an image file, temporary set metadata to None
         metadata = None
-        image = sitk.ReadImage(image_file)
+
+        # Only read the region around the mask if the sizes match
+        if mask is not None and IO.read_image_size(image_file) == mask.GetSize():
+            region, region_size = IO.get_mask_region(mask, margin)
+        image = IO.read_image_region(image_file, region, region_size)
 
         if metadata_file is not None:
             metadata = pydicom.read_file(metadata_file)
@@ -236,5 +455,6 @@ def load_images(image_file, image_type, metadata_file=None,
     else:
         semantics = None
 
-    image_data = {'images': image, 'metadata': metadata, 'semantics': semantics, 'image_type': image_type}
+    image_data = {'images': image, 'metadata': metadata, 'semantics': semantics, 'image_type': image_type,
+                  'region': region, 'region_size': region_size}
     return image_data
@@ -33,6 +33,29 @@ def load_config(config_file_path):
     settings_dict['General']['Joblib_backend'] =\
         str(settings['PREDICTGeneral']['Joblib_backend'])
 
+    # Feature cache: disabled if no folder is given, size in megabytes
+    settings_dict['General']['FeatureCache'] =\
+        str(settings['PREDICTGeneral'].get('FeatureCache', fallback='')).strip()
+
+    settings_dict['General']['FeatureCacheSize'] =\
+        settings['PREDICTGeneral'].getfloat('FeatureCacheSize', fallback=1000)
+
+    # Volume cache for decoded DICOM series: disabled if no folder is given,
+    # size in megabytes
+    settings_dict['General']['VolumeCache'] =\
+        str(settings['PREDICTGeneral'].get('VolumeCache', fallback='')).strip()
+
+    settings_dict['General']['VolumeCacheSize'] =\
+        settings['PREDICTGeneral'].getfloat('VolumeCacheSize', fallback=10000)
+
+    # Cohort feature store to which the features are appended, if given
+    settings_dict['General']['FeatureStore'] =\
+        str(settings['PREDICTGeneral'].get('FeatureStore', fallback='')).strip()
+
+    # Tracing of the time and memory usage per feature group
+    settings_dict['General']['Trace'] =\
+        settings['PREDICTGeneral'].getboolean('Trace', fallback=False)
+
     # Extract image feature specific settings
     settings_dict['ImageFeatures']['image_type'] =\
         [str(item).strip() for item in
@@ -56,9 +79,24 @@ def load_config(config_file_path):
     settings_dict['ImageFeatures']['phase'] =\
         settings['ImageFeatures'].getboolean('phase')
 
+    # Margin in voxels around the ROI to which the image is cropped. Use a
+    # negative value to compute the features on the full image.
+    settings_dict['ImageFeatures']['roi_margin'] =\
+        settings['ImageFeatures'].getint('roi_margin', fallback=40)
+
     # Parameters for computing features
     settings_dict['ImageFeatures']['parameters'] = dict()
 
+    # Shape features per axial slice (2D) or from a surface mesh (3D)
+    settings_dict['ImageFeatures']['parameters']['shape'] = dict()
+    settings_dict['ImageFeatures']['parameters']['shape']['mode'] =\
+        str(settings['ImageFeatures'].get('shape_mode', fallback='2D')).strip()
+
+    # Orientation from the second order moments or an ellipsoid fit
+    settings_dict['ImageFeatures']['parameters']['orientation'] = dict()
+    settings_dict['ImageFeatures']['parameters']['orientation']['method'] =\
+        str(settings['ImageFeatures'].get('orientation_method', fallback='moments')).strip()
+
     # Gabor settings
     settings_dict['ImageFeatures']['parameters']['gabor_settings'] = dict()
 
@@ -137,6 +175,10 @@ def load_config(config_file_path):
     settings_dict['ImageFeatures']['parameters']['log']['sigma'] =\
         [int(g) for g in log_sigma]
 
+    # Filter each axial slice (2D) or the full volume using the spacing (3D)
+    settings_dict['ImageFeatures']['parameters']['log']['mode'] =\
+        str(settings['ImageFeatures'].get('log_mode', fallback='2D')).strip()
+
     # vessel features
     settings_dict['ImageFeatures']['parameters']['vessel'] = dict()
 
@@ -155,4 +197,9 @@ def load_config(config_file_path):
     settings_dict['ImageFeatures']['parameters']['vessel']['radius'] =\
         int(settings['ImageFeatures']['vessel_radius'])
 
+    # Compute the vesselness on the uint8 converted image as before, or on
+    # the rescaled image in float32
+    settings_dict['ImageFeatures']['parameters']['vessel']['dtype'] =\
+        str(settings['ImageFeatures'].get('vessel_dtype', fallback='uint8')).strip()
+
     return settings_dict
@@ -52,6 +52,10 @@ def load_config(config_file_path):
     settings_dict['General']['tempsave'] =\
         settings['PREDICTGeneral'].getboolean('tempsave')
 
+    # Cohort cache of the loaded feature files: disabled if no folder is given
+    settings_dict['General']['CohortCache'] =\
+        str(settings['PREDICTGeneral'].get('CohortCache', fallback='')).strip()
+
     settings_dict['Featsel']['Variance'] =\
         [str(item).strip() for item in
          settings['Featsel']['Variance'].split(',')]
@@ -129,6 +133,11 @@ def load_config(config_file_path):
         [str(item).strip() for item in
          settings['Genetics']['label_names'].split(',')]
 
+    # Regular expression to extract the patient ID from the feature files,
+    # if empty the patient IDs are matched to the filenames
+    settings_dict['Genetics']['patient_pattern'] =\
+        str(settings['Genetics'].get('patient_pattern', fallback='')).strip()
+
     # Settings for hyper optimization
     settings_dict['HyperOptimization']['scoring_method'] =\
         str(settings['HyperOptimization']['scoring_method'])
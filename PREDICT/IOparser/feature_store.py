@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2018 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import numpy as np
+import tables
+import PREDICT.addexceptions as ae
+
+# Name of the HDF5 group containing the feature store
+STORE_GROUP = 'feature_store'
+
+
+class PatientDescription(tables.IsDescription):
+    patient_ID = tables.StringCol(256, pos=0)
+    modality = tables.StringCol(64, pos=1)
+    timestamp = tables.Float64Col(pos=2)
+
+
+def _encode(string):
+    if isinstance(string, bytes):
+        return string
+    return str(string).encode('utf-8')
+
+
+def _decode(string):
+    if isinstance(string, bytes):
+        return string.decode('utf-8')
+    return str(string)
+
+
+class FileLock(object):
+    '''
+    Simple inter-process lock based on the exclusive creation of a lock file,
+    which also works on network file systems used by clusters.
+
+    Parameters
+    ----------
+    filename: string, mandatory
+            Path of the lock file.
+
+    timeout: float, default 600
+            Maximum time in seconds to wait for the lock.
+
+    '''
+    def __init__(self, filename, timeout=600, interval=0.05):
+        self.filename = filename
+        self.timeout = timeout
+        self.interval = interval
+
+    def __enter__(self):
+        start = time.time()
+        while True:
+            try:
+                fd = os.open(self.filename,
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode('utf-8'))
+                os.close(fd)
+                return self
+            except OSError:
+                if time.time() - start > self.timeout:
+                    message = ('Could not acquire lock {} within {} seconds. Remove the file if no other process is using it.').format(self.filename, str(self.timeout))
+                    raise ae.PREDICTIOError(message)
+                time.sleep(self.interval)
+
+    def __exit__(self, *args):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+class FeatureStore(object):
+    '''
+    Cohort feature store: a single HDF5 file containing the features of all
+    patients as a chunked and compressed matrix (patients x features), with
+    one shared feature label index and the patient ID and modality of each
+    row. Rows can be appended per patient by parallel processes, as each
+    append is protected by a lock file.
+
+    Parameters
+    ----------
+    filename: string, mandatory
+            Path to the HDF5 file of the feature store.
+
+    dtype: numpy dtype, default numpy.float64
+            Data type of the feature matrix, either float32 or float64. Only
+            used when the store is created.
+
+    complevel: integer, default 5
+            Compression level. Only used when the store is created.
+
+    chunkshape: tuple, default (1, 256)
+            Number of patients and features per chunk. Reading a limited
+            number of features only decompresses the chunks containing
+            those features. As chunks are written per patient, a chunk
+            containing multiple patients would be rewritten at each append,
+            which fragments the file. Hence, use a single patient per chunk
+            and use the compact function after all patients are appended.
+            Only used when the store is created.
+
+    '''
+    def __init__(self, filename, dtype=np.float64, complevel=5,
+                 chunkshape=(1, 256)):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.complevel = complevel
+        self.chunkshape = chunkshape
+        self.lock = FileLock(filename + '.lock')
+
+        if self.dtype not in [np.dtype(np.float32), np.dtype(np.float64)]:
+            raise ae.PREDICTTypeError(('Feature store dtype should be float32 or float64, not {}.').format(str(self.dtype)))
+
+    @staticmethod
+    def is_feature_store(filename):
+        '''
+        Check whether a file is a feature store, e.g. to distinguish it from
+        the HDF5 feature files of single patients.
+        '''
+        if not os.path.isfile(filename):
+            return False
+
+        try:
+            if not tables.is_hdf5_file(filename):
+                return False
+            with tables.open_file(filename, 'r') as h5file:
+                return ('/' + STORE_GROUP) in h5file
+        except (IOError, OSError, tables.HDF5ExtError):
+            return False
+
+    def _get_filters(self):
+        if tables.which_lib_version('blosc') is not None:
+            return tables.Filters(complevel=self.complevel, complib='blosc',
+                                  shuffle=True)
+        return tables.Filters(complevel=self.complevel, complib='zlib',
+                              shuffle=True)
+
+    def _create(self, h5file, feature_labels):
+        group = h5file.create_group('/', STORE_GROUP, 'PREDICT feature store')
+        n_features = len(feature_labels)
+        chunkshape = (self.chunkshape[0], max(1, min(self.chunkshape[1], n_features)))
+        if self.dtype == np.dtype(np.float32):
+            atom = tables.Float32Atom()
+        else:
+            atom = tables.Float64Atom()
+
+        h5file.create_earray(group, 'values', atom, shape=(0, n_features),
+                             filters=self._get_filters(),
+                             chunkshape=chunkshape,
+                             expectedrows=1000)
+        h5file.create_array(group, 'labels',
+                            np.asarray([_encode(l) for l in feature_labels]))
+        h5file.create_table(group, 'patients', PatientDescription,
+                            filters=self._get_filters())
+
+    def append(self, patient_ID, feature_values, feature_labels,
+               modality=''):
+        '''
+        Append the features of a single patient. The store is created by the
+        first append, which fixes the feature labels. Features of later
+        patients are matched on their labels: missing features are stored as
+        NaN, while unknown features raise an error.
+
+        Parameters
+        ----------
+        patient_ID: string, mandatory
+                ID of the patient.
+
+        feature_values: list, mandatory
+                Values of the features.
+
+        feature_labels: list, mandatory
+                Labels of the features, corresponding to the values.
+
+        modality: string, optional
+                Modality or image type from which the features are extracted.
+
+        '''
+        if len(feature_values) != len(feature_labels):
+            raise ae.PREDICTValueError('Label length does not fit feature length')
+
+        feature_values = np.asarray(feature_values, dtype=np.float64)
+        with self.lock:
+            with tables.open_file(self.filename, 'a') as h5file:
+                if ('/' + STORE_GROUP) not in h5file:
+                    self._create(h5file, feature_labels)
+
+                group = h5file.get_node('/', STORE_GROUP)
+                labels = [_decode(l) for l in group.labels.read()]
+                if list(feature_labels) == labels:
+                    row = feature_values
+                else:
+                    row = self._match_labels(feature_values, feature_labels,
+                                             labels)
+
+                group.values.append(row.reshape(1, -1))
+                entry = group.patients.row
+                entry['patient_ID'] = _encode(patient_ID)
+                entry['modality'] = _encode(modality)
+                entry['timestamp'] = time.time()
+                entry.append()
+                h5file.flush()
+
+    def append_rows(self, patient_IDs, feature_values, feature_labels,
+                    modality=''):
+        '''
+        Append the features of multiple patients at once, which share the
+        same feature labels. See the append function for the matching of
+        the labels.
+
+        Parameters
+        ----------
+        patient_IDs: list, mandatory
+                IDs of the patients.
+
+        feature_values: numpy array, mandatory
+                Matrix of shape (patients, features).
+
+        feature_labels: list, mandatory
+                Labels of the features, corresponding to the columns.
+
+        modality: string, optional
+                Modality or image type from which the features are extracted.
+
+        '''
+        feature_values = np.asarray(feature_values, dtype=np.float64)
+        if feature_values.shape != (len(patient_IDs), len(feature_labels)):
+            raise ae.PREDICTValueError('Shape of the feature values does not fit the number of patients and labels')
+
+        with self.lock:
+            with tables.open_file(self.filename, 'a') as h5file:
+                if ('/' + STORE_GROUP) not in h5file:
+                    self._create(h5file, feature_labels)
+
+                group = h5file.get_node('/', STORE_GROUP)
+                labels = [_decode(l) for l in group.labels.read()]
+                if list(feature_labels) == labels:
+                    rows = feature_values
+                else:
+                    rows = np.vstack([self._match_labels(v, feature_labels,
+                                                         labels)
+                                      for v in feature_values])
+
+                timestamp = time.time()
+                group.values.append(rows.reshape(-1, len(labels)))
+                group.patients.append([(_encode(p), _encode(modality), timestamp)
+                                       for p in patient_IDs])
+                h5file.flush()
+
+    def _match_labels(self, feature_values, feature_labels, labels):
+        index = dict([(l, i) for i, l in enumerate(labels)])
+        unknown = [l for l in feature_labels if l not in index]
+        if unknown:
+            message = ('{} features are not present in feature store {}, e.g. {}.').format(str(len(unknown)), self.filename, unknown[0])
+            raise ae.PREDICTValueError(message)
+
+        row = np.full(len(labels), np.nan)
+        row[[index[l] for l in feature_labels]] = feature_values
+        return row
+
+    def compact(self, chunkshape=(64, 256)):
+        '''
+        Rewrite the store with chunks containing multiple patients, which
+        reduces the file size and speeds up reading. Duplicate entries of a
+        patient are removed, keeping the last one. The data type of the
+        store is kept.
+        '''
+        tempname = self.filename + '.compact'
+        with self.lock:
+            with tables.open_file(self.filename, 'r') as h5file:
+                group = h5file.get_node('/', STORE_GROUP)
+                labels = [_decode(l) for l in group.labels.read()]
+                patients = group.patients.read()
+                rows = self._select_rows(patients)
+                values = group.values.read()[rows, :]
+                patients = patients[rows]
+
+                # Keep the dtype of the existing store
+                dtype = group.values.atom.dtype
+
+            store = FeatureStore(tempname, dtype, self.complevel, chunkshape)
+            with tables.open_file(tempname, 'w') as h5file:
+                store._create(h5file, labels)
+                group = h5file.get_node('/', STORE_GROUP)
+                group.values.append(values)
+                group.patients.append(patients)
+
+            os.rename(tempname, self.filename)
+
+    def get_labels(self):
+        '''
+        Return the feature labels of the store.
+        '''
+        with self.lock:
+            with tables.open_file(self.filename, 'r') as h5file:
+                group = h5file.get_node('/', STORE_GROUP)
+                return [_decode(l) for l in group.labels.read()]
+
+    def get_patients(self):
+        '''
+        Return the patient IDs and modalities of all rows in the store.
+        '''
+        with self.lock:
+            with tables.open_file(self.filename, 'r') as h5file:
+                group = h5file.get_node('/', STORE_GROUP)
+                patients = group.patients.read()
+
+        patient_IDs = [_decode(p) for p in patients['patient_ID']]
+        modalities = [_decode(m) for m in patients['modality']]
+        return patient_IDs, modalities
+
+    def get_modalities(self):
+        '''
+        Return the unique modalities in the store.
+        '''
+        _, modalities = self.get_patients()
+        return sorted(set(modalities))
+
+    def load(self, modality=None, patient_IDs=None, features=None):
+        '''
+        Load the feature matrix, or a part of it.
+
+        Parameters
+        ----------
+        modality: string, optional
+                Only load the rows of this modality. If the store contains a
+                single modality, all rows are loaded.
+
+        patient_IDs: list, optional
+                Only load the rows of these patients, in the given order.
+
+        features: list, optional
+                Labels of the features to load, in the given order. Only the
+                chunks containing these features are read.
+
+        Returns
+        ----------
+        values: numpy array
+                Feature matrix of shape (patients, features).
+
+        patient_IDs: list
+                ID of the patient of each row.
+
+        feature_labels: list
+                Label of each column.
+
+        '''
+        with self.lock:
+            with tables.open_file(self.filename, 'r') as h5file:
+                group = h5file.get_node('/', STORE_GROUP)
+                labels = [_decode(l) for l in group.labels.read()]
+                patients = group.patients.read()
+                rows = self._select_rows(patients, modality, patient_IDs)
+
+                if features is None:
+                    columns = None
+                    values = group.values.read()
+                else:
+                    index = dict([(l, i) for i, l in enumerate(labels)])
+                    unknown = [f for f in features if f not in index]
+                    if unknown:
+                        raise ae.PREDICTKeyError(('Features not present in feature store: {}.').format(unknown))
+
+                    columns = np.asarray([index[f] for f in features])
+                    order = np.argsort(columns)
+                    sorted_columns = columns[order]
+                    values = group.values[:, sorted_columns.tolist()]
+
+                    # Restore the requested order
+                    inverse = np.empty_like(order)
+                    inverse[order] = np.arange(order.size)
+                    values = values[:, inverse]
+                    labels = list(features)
+
+        values = values[rows, :]
+        selected_IDs = [_decode(patients['patient_ID'][r]) for r in rows]
+
+        return values, selected_IDs, labels
+
+    def _select_rows(self, patients, modality=None, patient_IDs=None):
+        all_IDs = [_decode(p) for p in patients['patient_ID']]
+        modalities = [_decode(m) for m in patients['modality']]
+
+        if modality is not None and len(set(modalities)) > 1:
+            if modality not in modalities:
+                raise ae.PREDICTKeyError(('Modality {} not present in feature store {}, which contains {}.').format(modality, self.filename, sorted(set(modalities))))
+            candidates = [i for i, m in enumerate(modalities) if m == modality]
+        else:
+            candidates = range(len(all_IDs))
+
+        # If a patient is appended multiple times, use the last entry
+        last = dict()
+        order = list()
+        for i in candidates:
+            if all_IDs[i] not in last:
+                order.append(all_IDs[i])
+            last[all_IDs[i]] = i
+
+        if patient_IDs is None:
+            return np.asarray([last[p] for p in order], dtype=int)
+
+        missing = [p for p in patient_IDs if p not in last]
+        if missing:
+            raise ae.PREDICTKeyError(('Patients not present in feature store: {}.').format(missing))
+
+        return np.asarray([last[p] for p in patient_IDs], dtype=int)
+
+    def get_image_features(self, modality=None, suffix=None):
+        '''
+        Load the features in the format used by the classification: a list
+        containing for each patient a tuple with the feature values and the
+        feature labels, together with the patient IDs.
+
+        Parameters
+        ----------
+        modality: string, optional
+                See the load function.
+
+        suffix: string, optional
+                Appended to each feature label, e.g. to denote the modality.
+
+        '''
+        values, patient_IDs, labels = self.load(modality)
+        if suffix is not None:
+            labels = [l + suffix for l in labels]
+
+        image_features = [(v, labels) for v in values.tolist()]
+        return image_features, patient_IDs
@@ -22,13 +22,22 @@ import re
 import pandas as pd
 from natsort import natsorted, ns
 import os
+import csv
+import json
+import hashlib
+import six
+from joblib import Parallel, delayed
 
 import SimpleITK as sitk
+import PREDICT.addexceptions as ae
 import PREDICT.helpers.sitk_helper as sitkh
+from PREDICT.helpers.roi_context import ROIContext
 import PREDICT.genetics.genetic_processing as gp
+from PREDICT.IOparser.feature_store import FeatureStore
 
 
-def load_data(featurefiles, patientinfo=None, label_names=None, modnames=[]):
+def load_data(featurefiles, patientinfo=None, label_names=None, modnames=[],
+              n_jobs=1, cohort_cache=None, pattern=None):
     ''' Read feature files and stack the features per patient in an array.
         Additionally, if a patient label file is supplied, the features from
         a patient will be matched to the labels.
@@ -40,6 +49,10 @@ def load_data(featurefiles, patientinfo=None, label_names=None, modnames=[]):
                 The argument should contain a list per modelity, e.g.
                 [[features_mod1_patient1, features_mod1_patient2, ...],
                  [features_mod2_patient1, features_mod2_patient2, ...]].
+                Alternatively, each modality can consist of a single feature
+                store, see the feature_store module, e.g. [[store_mod1],
+                [store_mod2]]. The features of all patients are then read at
+                once and matched on the patient IDs.
 
         patientinfo: string, optional
                 Path referring to the .txt file to be used to read patient
@@ -49,22 +62,36 @@ def load_data(featurefiles, patientinfo=None, label_names=None, modnames=[]):
                 List containing all the labels that should be extracted from
                 the patientinfo file.
 
+        modnames: list, optional
+                Names of the modalities, which are appended to the feature
+                labels. For feature stores, also used to select the rows of
+                that modality if the store contains multiple modalities.
+
+        n_jobs: integer, default 1
+                Number of processes used to read the feature files.
+
+        cohort_cache: string, optional
+                Folder in which the features of all patients are stored as a
+                feature store per modality after reading the feature files.
+                Later calls with the same, unmodified files read the stores
+                instead of the separate files.
+
+        pattern: string, optional
+                Regular expression to extract the patient ID from the feature
+                filenames, see genetic_processing.get_patient_keys.
+
     '''
-    image_features = list()
-    for i_patient in range(0, len(featurefiles[0])):
-        feature_values_temp = list()
-        feature_labels_temp = list()
-        for i_mod in range(0, len(featurefiles)):
-            feat_temp = pd.read_hdf(featurefiles[i_mod][i_patient])
-            feature_values_temp += feat_temp.feature_values
-            if not modnames:
-                # Create artificial names
-                feature_labels_temp += [f + '_M' + str(i_mod) for f in feat_temp.feature_labels]
-            else:
-                # Use the provides modality names
-                feature_labels_temp += [f + '_' + str(modnames[i_mod]) for f in feat_temp.feature_labels]
+    stores = [len(f) == 1 and FeatureStore.is_feature_store(f[0])
+              for f in featurefiles]
+    if any(stores):
+        if not all(stores):
+            raise ae.PREDICTIOError('Either all or none of the modalities should be a feature store.')
+
+        return load_data_store(featurefiles, patientinfo, label_names,
+                               modnames, pattern)
 
-        image_features.append((feature_values_temp, feature_labels_temp))
+    image_features = load_feature_files(featurefiles, modnames, n_jobs,
+                                        cohort_cache)
 
     # Get the mutation labels and patient IDs
     if patientinfo is not None:
@@ -74,7 +101,8 @@ def load_data(featurefiles, patientinfo=None, label_names=None, modnames=[]):
             gp.findmutationdata(patientinfo,
                                 label_names,
                                 pfiles,
-                                image_features)
+                                image_features,
+                                pattern)
 
         print("Mutation Labels:")
         print(mutation_data['mutation_label'])
@@ -86,7 +114,7 @@ def load_data(featurefiles, patientinfo=None, label_names=None, modnames=[]):
     else:
         # Use filenames as patient ID s
         patient_IDs = list()
-        for i in featurefiles:
+        for i in featurefiles[0]:
             patient_IDs.append(os.path.basename(i))
         mutation_data = dict()
         mutation_data['patient_IDs'] = patient_IDs
@@ -94,17 +122,565 @@ def load_data(featurefiles, patientinfo=None, label_names=None, modnames=[]):
     return mutation_data, image_features
 
 
-def load_dicom(dicom_folder):
+def read_feature_file(featurefile):
+    '''
+    Read the feature values and labels from a single .hdf5 feature file.
+    '''
+    feat_temp = pd.read_hdf(featurefile)
+    return (np.asarray(feat_temp.feature_values, dtype=np.float64),
+            list(feat_temp.feature_labels))
+
+
+def get_cohort_cache_files(cohort_cache, featurefiles, suffixes):
+    '''
+    Get the paths of the feature stores of a cohort cache, named after a hash
+    of the paths, modification times and sizes of the feature files, so a
+    modified file invalidates the cache.
+    '''
+    sha = hashlib.sha1()
+    for files, suffix in zip(featurefiles, suffixes):
+        sha.update(suffix.encode('utf-8'))
+        for featurefile in files:
+            stat = os.stat(featurefile)
+            sha.update(os.path.abspath(featurefile).encode('utf-8'))
+            sha.update(str(stat.st_mtime).encode('utf-8'))
+            sha.update(str(stat.st_size).encode('utf-8'))
+
+    key = sha.hexdigest()
+    return [os.path.join(cohort_cache, ('cohort_{}_M{}.hdf5').format(key, str(i_mod)))
+            for i_mod in range(len(featurefiles))]
+
+
+def load_feature_files(featurefiles, modnames=[], n_jobs=1,
+                       cohort_cache=None):
+    '''
+    Read the feature files of all patients and modalities, see load_data for
+    the parameters. The files are read concurrently and the features of each
+    modality are stored in a single preallocated matrix.
+
+    Returns
+    ----------
+    image_features: list
+            Contains for each patient a tuple with the feature values and the
+            feature labels of all modalities. If the labels of a modality are
+            equal for all patients, the patients share the same label list.
+
+    '''
+    n_patients = len(featurefiles[0])
+    if any([len(f) != n_patients for f in featurefiles]):
+        raise ae.PREDICTValueError('The number of feature files should be equal for all modalities.')
+
+    if not modnames:
+        # Create artificial names
+        suffixes = ['_M' + str(i_mod) for i_mod in range(len(featurefiles))]
+    else:
+        # Use the provides modality names
+        suffixes = ['_' + str(m) for m in modnames]
+
+    cache_files = None
+    if cohort_cache:
+        if not os.path.exists(cohort_cache):
+            try:
+                os.makedirs(cohort_cache)
+            except OSError:
+                # Created in the meantime by another process
+                pass
+
+        cache_files = get_cohort_cache_files(cohort_cache, featurefiles,
+                                             suffixes)
+        if all([FeatureStore.is_feature_store(f) for f in cache_files]):
+            print(('Loading features from cohort cache {}.').format(cohort_cache))
+            values = list()
+            labels = list()
+            for cache_file, suffix in zip(cache_files, suffixes):
+                values_mod, _, labels_mod = FeatureStore(cache_file).load()
+                values.append(values_mod)
+                labels += [l + suffix for l in labels_mod]
+
+            values = np.hstack(values)
+            return [(v, labels) for v in values.tolist()]
+
+    # Read all files concurrently. HDF5 is not thread safe, so use processes
+    all_files = [f for files in featurefiles for f in files]
+    if n_jobs is None or n_jobs == 1 or len(all_files) < 2:
+        results = [read_feature_file(f) for f in all_files]
+    else:
+        results = Parallel(n_jobs=n_jobs)(delayed(read_feature_file)(f) for f in all_files)
+
+    # Stack the features of each modality in a matrix if the labels are equal
+    modalities = list()
+    for i_mod in range(len(featurefiles)):
+        results_mod = results[i_mod * n_patients:(i_mod + 1) * n_patients]
+        labels_mod = results_mod[0][1]
+        if any([r[1] != labels_mod for r in results_mod]):
+            modalities.append(None)
+            continue
+
+        values_mod = np.empty((n_patients, len(labels_mod)), dtype=np.float64)
+        for i_patient, (values_patient, _) in enumerate(results_mod):
+            values_mod[i_patient, :] = values_patient
+        modalities.append((values_mod, labels_mod))
+
+    if any([m is None for m in modalities]):
+        # The feature labels differ between patients, so use a list per patient
+        if cohort_cache:
+            print('[PREDICT Warning] Feature labels differ between patients, not using the cohort cache.')
+
+        image_features = list()
+        for i_patient in range(n_patients):
+            feature_values_temp = list()
+            feature_labels_temp = list()
+            for i_mod in range(len(featurefiles)):
+                values_patient, labels_patient = results[i_mod * n_patients + i_patient]
+                feature_values_temp += values_patient.tolist()
+                feature_labels_temp += [f + suffixes[i_mod] for f in labels_patient]
+            image_features.append((feature_values_temp, feature_labels_temp))
+
+        return image_features
+
+    if cache_files is not None:
+        print(('Writing features to cohort cache {}.').format(cohort_cache))
+        for cache_file, (values_mod, labels_mod) in zip(cache_files, modalities):
+            # Write to a temporary file first, so parallel runs never see
+            # partially written stores
+            tempname = ('{}.{}.tmp').format(cache_file, str(os.getpid()))
+            store = FeatureStore(tempname)
+            store.append_rows([str(i) for i in range(n_patients)], values_mod,
+                              labels_mod)
+            os.rename(tempname, cache_file)
+
+    values = np.hstack([m[0] for m in modalities])
+    labels = list()
+    for (_, labels_mod), suffix in zip(modalities, suffixes):
+        labels += [l + suffix for l in labels_mod]
+
+    return [(v, labels) for v in values.tolist()]
+
+
+def load_data_store(featurefiles, patientinfo=None, label_names=None,
+                    modnames=[], pattern=None):
+    '''
+    Read the features of all patients from a feature store per modality.
+    See load_data for the parameters. Patients are matched between the
+    modalities on their ID, in the order of the first modality.
+    '''
+    values = list()
+    labels = list()
+    patient_IDs = None
+    for i_mod, files in enumerate(featurefiles):
+        store = FeatureStore(files[0])
+        if not modnames:
+            modality = None
+            suffix = '_M' + str(i_mod)
+        else:
+            modality = str(modnames[i_mod])
+            suffix = '_' + modality
+
+        if patient_IDs is None:
+            values_mod, patient_IDs, labels_mod = store.load(modality)
+        else:
+            values_mod, _, labels_mod = store.load(modality, patient_IDs)
+
+        values.append(values_mod)
+        labels += [l + suffix for l in labels_mod]
+
+    values = np.hstack(values)
+    print(('Loaded {} features of {} patients from feature store.').format(str(values.shape[1]), str(values.shape[0])))
+
+    # All patients share the same list of labels
+    image_features = [(v, labels) for v in values.tolist()]
+
+    if patientinfo is not None:
+        # Match the patient IDs from the store to the labels
+        mutation_data, image_features =\
+            gp.findmutationdata(patientinfo,
+                                label_names,
+                                patient_IDs,
+                                image_features,
+                                pattern)
+
+        print("Mutation Labels:")
+        print(mutation_data['mutation_label'])
+        print('Total of ' + str(mutation_data['patient_IDs'].shape[0]) +
+              ' patients')
+        pos = np.sum(mutation_data['mutation_label'])
+        neg = mutation_data['patient_IDs'].shape[0] - pos
+        print(('{} positives, {} negatives').format(pos, neg))
+    else:
+        mutation_data = dict()
+        mutation_data['patient_IDs'] = patient_IDs
+
+    return mutation_data, image_features
+
+
+def load_manifest(manifest_file):
+    '''
+    Read a cohort manifest, describing per patient which files should be used
+    for the feature extraction.
+
+    Parameters
+    ----------
+    manifest_file: string, mandatory
+            Path referring to a .csv or .json manifest. A .csv file should
+            contain a header with at least the columns image, segmentation
+            and output. The columns metadata, semantics and patient are
+            optional. A .json file should contain a list of dictionaries with
+            the same keys. If no patient is given, the basename of the output
+            file is used as patient ID.
+
+    Returns
+    ----------
+    cases: list
+            Contains a dictionary for each patient with the keys patient,
+            image, segmentation, metadata, semantics and output. Missing
+            optional fields are None.
+
+    '''
+    _, extension = os.path.splitext(manifest_file)
+    if extension == '.csv':
+        with open(manifest_file, 'r') as fp:
+            entries = [row for row in csv.DictReader(fp)]
+    elif extension == '.json':
+        with open(manifest_file, 'r') as fp:
+            entries = json.load(fp)
+    else:
+        raise ae.PREDICTIOError(extension + ' is not a valid manifest file extension.')
+
+    cases = list()
+    for num, entry in enumerate(entries):
+        case = dict()
+        for key in ['image', 'segmentation', 'output']:
+            if not entry.get(key):
+                message = ('Entry {} of manifest {} has no {}.').format(str(num), manifest_file, key)
+                raise ae.PREDICTKeyError(message)
+            case[key] = str(entry[key]).strip()
+
+        for key in ['metadata', 'semantics', 'patient']:
+            if entry.get(key):
+                case[key] = str(entry[key]).strip()
+            else:
+                case[key] = None
+
+        if case['patient'] is None:
+            case['patient'] = os.path.splitext(os.path.basename(case['output']))[0]
+
+        cases.append(case)
+
+    return cases
+
+
+# Number of threads used to read the headers and pixel data of DICOM files
+DICOM_N_JOBS = 8
+
+# Integer types which GDCM uses for rescaled pixel data, smallest first
+RESCALE_DTYPES = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32]
+
+
+def read_dicom_header(dicom_file):
+    '''
+    Read the header of a DICOM file without the pixel data. Returns None if
+    the file is not a valid DICOM file.
+    '''
+    try:
+        return pydicom.read_file(dicom_file, stop_before_pixels=True)
+    except (pydicom.errors.InvalidDicomError, IOError, OSError):
+        return None
+
+
+def scan_dicom_headers(dicom_files, n_jobs=DICOM_N_JOBS):
+    '''
+    Read the headers of DICOM files in parallel threads, as this is mostly
+    I/O bound. Returns a list with the header of each file, or None for files
+    which are not DICOM.
+    '''
+    if len(dicom_files) < 2 or n_jobs == 1:
+        return [read_dicom_header(f) for f in dicom_files]
+
+    return Parallel(n_jobs=n_jobs, backend='threading')(delayed(read_dicom_header)(f) for f in dicom_files)
+
+
+def get_slice_orientation(header):
+    '''
+    Return the normalized row direction, column direction and slice normal.
+    '''
+    orientation = np.asarray(header.ImageOrientationPatient, dtype=np.float64)
+    row = orientation[0:3] / np.linalg.norm(orientation[0:3])
+    column = orientation[3:6] / np.linalg.norm(orientation[3:6])
+    normal = np.cross(row, column)
+    return row, column, normal / np.linalg.norm(normal)
+
+
+def get_series(dicom_files, headers):
+    '''
+    Group DICOM files on their SeriesInstanceUID and sort the files of each
+    series on their position along the slice normal. Files without the
+    required geometry tags are ignored.
+
+    Returns
+    ----------
+    series: dictionary
+            Contains per SeriesInstanceUID a list of (file, header) tuples.
+
+    '''
+    series = dict()
+    for dicom_file, header in zip(dicom_files, headers):
+        if header is None:
+            continue
+
+        required = ['SeriesInstanceUID', 'ImagePositionPatient',
+                    'ImageOrientationPatient', 'PixelSpacing', 'Rows',
+                    'Columns']
+        if not all([hasattr(header, tag) for tag in required]):
+            continue
+
+        uid = str(header.SeriesInstanceUID)
+        series.setdefault(uid, list()).append((dicom_file, header))
+
+    for uid, files in series.items():
+        _, _, normal = get_slice_orientation(files[0][1])
+
+        def sort_key(entry):
+            position = np.asarray(entry[1].ImagePositionPatient,
+                                  dtype=np.float64)
+            instance = getattr(entry[1], 'InstanceNumber', None)
+            instance = int(instance) if instance not in [None, ''] else 0
+            return (float(np.dot(position, normal)), instance, entry[0])
+
+        series[uid] = sorted(files, key=sort_key)
+
+    return series
+
+
+def get_rescale(header):
+    slope = float(getattr(header, 'RescaleSlope', 1) or 1)
+    intercept = float(getattr(header, 'RescaleIntercept', 0) or 0)
+    return slope, intercept
+
+
+def get_rescale_dtype(headers, raw_dtype):
+    '''
+    Determine the data type of the rescaled pixel data in the same way as
+    GDCM, so the images are equal to those of the SimpleITK series reader:
+    the raw type if no rescaling is needed, the smallest integer type
+    fitting the rescaled range for integer slopes and intercepts, and float64
+    otherwise.
+    '''
+    rescales = set([get_rescale(h) for h in headers])
+    if rescales == set([(1.0, 0.0)]):
+        return np.dtype(raw_dtype)
+
+    header = headers[0]
+    bits = int(getattr(header, 'BitsStored', np.dtype(raw_dtype).itemsize * 8))
+    if int(getattr(header, 'PixelRepresentation', 0)) == 1:
+        raw_range = (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+    else:
+        raw_range = (0, 2 ** bits - 1)
+
+    minimum = None
+    maximum = None
+    for slope, intercept in rescales:
+        if slope != int(slope) or intercept != int(intercept):
+            return np.dtype(np.float64)
+        values = [slope * r + intercept for r in raw_range]
+        minimum = min(values) if minimum is None else min(minimum, min(values))
+        maximum = max(values) if maximum is None else max(maximum, max(values))
+
+    for dtype in RESCALE_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= minimum and maximum <= info.max:
+            return np.dtype(dtype)
+
+    return np.dtype(np.float64)
+
+
+def read_dicom_volume(dicom_files, headers, rescale=True, n_jobs=DICOM_N_JOBS):
+    '''
+    Decode the pixel data of DICOM slices in parallel threads straight into
+    a single preallocated volume, in the x, y, z order of
+    sitk_helper.GetArrayFromImage.
+
+    Parameters
+    ----------
+    dicom_files: list, mandatory
+            Paths to the DICOM files, in slice order.
+
+    headers: list, mandatory
+            Headers of the DICOM files, see scan_dicom_headers.
+
+    rescale: boolean, default True
+            If True, the RescaleSlope and RescaleIntercept of each slice are
+            applied.
+
+    n_jobs: integer, default DICOM_N_JOBS
+            Number of threads used.
+
+    Returns
+    ----------
+    volume: numpy array
+            Array of shape (columns, rows, slices).
+
+    '''
+    first = pydicom.read_file(dicom_files[0]).pixel_array
+    if rescale:
+        dtype = get_rescale_dtype(headers, first.dtype)
+    else:
+        dtype = first.dtype
+
+    volume = np.empty((first.shape[1], first.shape[0], len(dicom_files)),
+                      dtype=dtype)
+
+    def read_slice(index, pixels=None):
+        if pixels is None:
+            pixels = pydicom.read_file(dicom_files[index]).pixel_array
+
+        if pixels.shape != first.shape:
+            raise ae.PREDICTValueError(('DICOM file {} has shape {}, while the series has shape {}.').format(dicom_files[index], pixels.shape, first.shape))
+
+        if rescale:
+            slope, intercept = get_rescale(headers[index])
+            if (slope, intercept) != (1.0, 0.0):
+                pixels = pixels * slope + intercept
+
+        volume[:, :, index] = np.transpose(pixels)
+
+    read_slice(0, first)
+    if len(dicom_files) > 1:
+        if n_jobs == 1:
+            for index in range(1, len(dicom_files)):
+                read_slice(index)
+        else:
+            Parallel(n_jobs=n_jobs, backend='threading')(delayed(read_slice)(index) for index in range(1, len(dicom_files)))
+
+    return volume
+
+
+def get_series_geometry(headers):
+    '''
+    Compute the spacing, origin and direction of a sorted DICOM series.
+    '''
+    header = headers[0]
+    row, column, normal = get_slice_orientation(header)
+    pixel_spacing = [float(s) for s in header.PixelSpacing]
+
+    if len(headers) > 1:
+        positions = np.asarray([h.ImagePositionPatient for h in headers],
+                               dtype=np.float64)
+        distances = np.dot(positions, normal)
+        slice_spacing = (distances[-1] - distances[0]) / (len(headers) - 1)
+    else:
+        slice_spacing = float(getattr(header, 'SliceThickness', 1) or 1)
+
+    if slice_spacing <= 0:
+        slice_spacing = 1.0
+
+    spacing = (pixel_spacing[1], pixel_spacing[0], float(slice_spacing))
+    origin = tuple([float(p) for p in header.ImagePositionPatient])
+    direction = np.column_stack([row, column, normal])
+
+    return spacing, origin, tuple(direction.flatten().tolist())
+
+
+def get_dicom_files(dicom_folder):
+    if type(dicom_folder) is list:
+        return dicom_folder
+
+    dicom_files = [os.path.join(dicom_folder, f) for f in os.listdir(dicom_folder)]
+    return natsorted([f for f in dicom_files if os.path.isfile(f)],
+                     alg=ns.IGNORECASE)
+
+
+def load_dicom_sitk(dicom_folder):
     dicom_reader = sitk.ImageSeriesReader()
     dicom_file_names = dicom_reader.GetGDCMSeriesFileNames(dicom_folder)
     dicom_reader.SetFileNames(dicom_file_names)
     dicom_image = dicom_reader.Execute()
 
-    image_metadata = pydicom.read_file(dicom_file_names[0])
+    image_metadata = pydicom.read_file(dicom_file_names[0],
+                                       stop_before_pixels=True)
 
     return dicom_image, image_metadata
 
 
+def load_dicom(dicom_folder, n_jobs=DICOM_N_JOBS, cache=None):
+    '''
+    Load a DICOM series. The headers are read in parallel without the pixel
+    data and grouped on their series, after which the pixel data is decoded
+    in parallel into a single volume. If the folder contains multiple series,
+    the one with the most slices is loaded. If the headers lack the geometry
+    tags or pydicom cannot decode the pixel data, e.g. for compressed
+    transfer syntaxes, the SimpleITK series reader is used instead.
+
+    Parameters
+    ----------
+    dicom_folder: string or list, mandatory
+            Path to a folder containing the DICOM files, or a list of DICOM
+            files.
+
+    n_jobs: integer, default DICOM_N_JOBS
+            Number of threads used to read the files.
+
+    cache: VolumeCache, optional
+            If given, the decoded series is loaded from or stored in this
+            cache, see the volume_cache module. Only the headers are read if
+            the series is present in the cache.
+
+    Returns
+    ----------
+    dicom_image: ITK Image
+            Image of the series, with the rescale slope and intercept applied.
+
+    image_metadata: pydicom Dataset
+            Header of the first slice, without the pixel data.
+
+    '''
+    dicom_files = get_dicom_files(dicom_folder)
+    headers = scan_dicom_headers(dicom_files, n_jobs)
+    series = get_series(dicom_files, headers)
+
+    if type(dicom_folder) is list:
+        series_folder = os.path.dirname(dicom_folder[0])
+    else:
+        series_folder = dicom_folder
+
+    if not series:
+        # No geometry information in the headers, let GDCM figure it out
+        return load_dicom_sitk(series_folder)
+
+    uids = sorted(series.keys(), key=lambda u: -len(series[u]))
+    if len(uids) > 1:
+        print(('[PREDICT Warning] Found {} DICOM series in {}, loading series {} with {} slices.').format(str(len(uids)), str(dicom_folder), uids[0], str(len(series[uids[0]]))))
+
+    files = [f for f, _ in series[uids[0]]]
+    headers = [h for _, h in series[uids[0]]]
+
+    if cache is not None:
+        key = cache.get_key(uids[0], files)
+        dicom_image = cache.load(key)
+        if dicom_image is not None:
+            return dicom_image, headers[0]
+
+    try:
+        volume = read_dicom_volume(files, headers, rescale=True, n_jobs=n_jobs)
+    except (NotImplementedError, AttributeError, ValueError,
+            RuntimeError) as e:
+        # Pixel data pydicom cannot decode, e.g. JPEG compressed, let GDCM
+        # decode the series
+        print(('[PREDICT Warning] Could not decode {} with pydicom ({}), using the SimpleITK reader.').format(str(series_folder), str(e)))
+        return load_dicom_sitk(series_folder)
+
+    spacing, origin, direction = get_series_geometry(headers)
+
+    if cache is not None:
+        cache.save(key, volume, spacing, origin, direction, uids[0])
+
+    dicom_image = sitkh.GetImageFromArray(volume)
+    dicom_image.SetSpacing(spacing)
+    dicom_image.SetOrigin(origin)
+    dicom_image.SetDirection(direction)
+
+    return dicom_image, headers[0]
+
+
 def get_b_value(dicom_file):
     # Of course there is no standard on how to the b-value of DTI is stored
     # So different ways of reading it, based on manufacturer
@@ -113,10 +689,13 @@ def get_b_value(dicom_file):
         # GE stores it under 'Slop_int_6' in tag 0043,1039
         # Sometimes stored as string, sometimes as array, handle differences
         b_tag = dicom_file[0x43, 0x1039].value
-        if isinstance(b_tag, basestring):
+        if isinstance(b_tag, bytes):
+            b_tag = b_tag.decode('ascii', 'ignore')
+        if isinstance(b_tag, six.string_types):
             matchObj = re.match('(\d+)', b_tag)
             b_value = float(matchObj.group(1))
-        elif isinstance(b_tag, list):
+        else:
+            # Multi-valued tags are a list or a pydicom MultiValue
             b_value = b_tag[0]
     else:
         print('Unknown manufacturer!' + manufacturer)
@@ -143,73 +722,245 @@ def get_gradient(dicom_file):
     return gradient_data
 
 
-def load_DTI(dicom_folder):
+def get_DTI_blocks(dicom_headers):
+    '''
+    Split the sorted DICOM files of a DTI acquisition into blocks of a
+    single b-value. Returns the first and last index plus one of each block.
+    '''
+    positions = get_positions(dicom_headers)
+
+    # Find the unique position to know where new series starts
+    unique_positions = np.atleast_1d(np.squeeze(np.argwhere(np.all(positions == positions[0],
+                                                                   axis=1))))
+
+    ends = list(unique_positions[1:]) + [len(dicom_headers)]
+    return [(int(s), int(e)) for s, e in zip(unique_positions, ends)]
+
+
+def load_DTI(dicom_folder, n_jobs=DICOM_N_JOBS):
     # DTI are also dicom, but loaded a bit differently
     # Unfortunately we can't use SimpleITK to read private tags, so need
     # pydicom.....
 
-    dicom_images = get_DTI_dicoms(dicom_folder)
-    positions = get_positions(dicom_images)
-
-    # Find the unique position to know where new series starts
-    unique_positions = np.squeeze(np.argwhere(np.all(positions == positions[0],
-                                                     axis=1)))
+    dicom_files, dicom_headers = get_DTI_dicoms(dicom_folder, n_jobs)
 
     unique_images = list()
     b_values = list()
     gradient_data = list()
-    for i_index, i_position in enumerate(unique_positions):
+    for start, end in get_DTI_blocks(dicom_headers):
         # Get b_value from first dicom in sequence
-        b_values.append(get_b_value(dicom_images[i_position]))
-        gradient_data.append(get_gradient(dicom_images[i_position]))
-
-        if i_index < len(unique_positions) - 1:
-            temp_image_data = np.asarray([o.pixel_array for o in
-                                         dicom_images[i_position:
-                                          unique_positions[i_index+1]]])
-        else:  # At the end of the array
-            temp_image_data = np.asarray([o.pixel_array for o in
-                                         dicom_images[i_position:]])
-
-        # Transpose to get in same frame as sitk images
-        temp_image_data = np.transpose(temp_image_data, [2, 1, 0])
+        b_values.append(get_b_value(dicom_headers[start]))
+        gradient_data.append(get_gradient(dicom_headers[start]))
+
+        # Read the pixel data in the same frame as sitk images
+        temp_image_data = read_dicom_volume(dicom_files[start:end],
+                                            dicom_headers[start:end],
+                                            rescale=False, n_jobs=n_jobs)
         # Save it as ITK image, to keep everything in same format
         temp_image_data = sitkh.GetImageFromArray(temp_image_data)
         # temp_image_data = sitk.Normalize(temp_image_data)
         unique_images.append(temp_image_data)
 
-    meta_data = {'b_values': b_values, 'dicom_meta_data': dicom_images[0],
+    meta_data = {'b_values': b_values, 'dicom_meta_data': dicom_headers[0],
                  'gradient_data': gradient_data}
 
     return unique_images, meta_data
 
 
-def load_DTI_post(dicom_folder, patient_ID):
-    # Going to load the 3 eigenvalues
+def load_DTI_voxels(dicom_folder, mask, n_jobs=DICOM_N_JOBS):
+    '''
+    Streaming alternative to load_DTI, which reads one b-value block at a
+    time and only keeps the voxels within the mask. Only the slices
+    containing the mask are decoded. Hence, the memory usage is proportional
+    to the size of the ROI times the number of b-values instead of the full
+    series.
+
+    Parameters
+    ----------
+    dicom_folder: string or list, mandatory
+            Path to a folder containing the DICOM files, or a list of DICOM
+            files.
+
+    mask: ITK Image or numpy array, mandatory
+            Mask of the ROI, with the same size as a single b-value volume.
+
+    n_jobs: integer, default DICOM_N_JOBS
+            Number of threads used to read the files.
+
+    Returns
+    ----------
+    voxels: numpy array
+            Array of shape (b-values, mask voxels) with the masked voxels of
+            each b-value volume, in the order of the flattened mask of
+            sitk_helper.GetArrayFromImage. This array can be used as the
+            image of dti_features.get_dti_features.
+
+    meta_data: dictionary
+            Contains the b-values, the header of the first file and the
+            gradient data, see load_DTI.
+
+    '''
+    if isinstance(mask, sitk.Image):
+        mask = sitkh.GetArrayFromImage(mask)
+    mask = mask.astype(np.bool)
+
+    # Only the slices containing the mask are needed
+    slices = np.flatnonzero(np.any(mask, axis=(0, 1)))
+    slice_mask = mask[:, :, slices]
+
+    dicom_files, dicom_headers = get_DTI_dicoms(dicom_folder, n_jobs)
+    blocks = get_DTI_blocks(dicom_headers)
+
+    voxels = None
+    b_values = list()
+    gradient_data = list()
+    for i_block, (start, end) in enumerate(blocks):
+        # Get b_value from first dicom in sequence
+        b_values.append(get_b_value(dicom_headers[start]))
+        gradient_data.append(get_gradient(dicom_headers[start]))
+
+        shape = (int(dicom_headers[start].Columns),
+                 int(dicom_headers[start].Rows), end - start)
+        if shape != mask.shape:
+            raise ae.PREDICTValueError(('Shape of DTI volume {} ({}) does not match the mask ({}).').format(str(i_block), str(shape), str(mask.shape)))
+
+        if slices.size == 0:
+            block_voxels = np.zeros(0)
+        else:
+            files = [dicom_files[start + i] for i in slices]
+            headers = [dicom_headers[start + i] for i in slices]
+            block_voxels = read_dicom_volume(files, headers, rescale=False,
+                                             n_jobs=n_jobs)[slice_mask]
+
+        if voxels is None:
+            voxels = np.empty((len(blocks), block_voxels.size),
+                              dtype=block_voxels.dtype)
+        voxels[i_block, :] = block_voxels
+
+    meta_data = {'b_values': b_values, 'dicom_meta_data': dicom_headers[0],
+                 'gradient_data': gradient_data}
+
+    return voxels, meta_data
+
+
+def get_mask_region(mask, margin):
+    '''
+    Get the region of an image which is needed for the feature extraction:
+    the bounding box of the mask plus a margin, see ROIContext.get_bbox.
+
+    Parameters
+    ----------
+    mask: ITK Image, mandatory
+            Mask of the ROI.
+
+    margin: integer, mandatory
+            Margin in voxels around the bounding box. If None or negative,
+            the full image is needed.
+
+    Returns
+    ----------
+    index, size: tuple
+            Index of the first voxel and size of the region in the x, y, z
+            order of ITK, or None if the full image is needed.
+
+    '''
+    if margin is None or margin < 0:
+        return None, None
+
+    mask_array = sitkh.GetArrayFromImage(mask)
+    if not np.any(mask_array):
+        return None, None
+
+    bbox = ROIContext.get_bbox(mask_array, margin)
+    index = tuple([int(s.start) for s in bbox])
+    size = tuple([int(s.stop - s.start) for s in bbox])
+    if size == mask.GetSize():
+        return None, None
+
+    return index, size
+
+
+def read_image_region(image_file, index=None, size=None):
+    '''
+    Read only a region of an image file. For file formats which support
+    streaming, e.g. uncompressed .nii and .mhd/.raw, ITK only reads the
+    requested region from disk. The geometry of the region is preserved, so
+    its origin is the physical position of the first voxel of the region.
+
+    Parameters
+    ----------
+    image_file: string, mandatory
+            Path to an image file in a format compatible with ITK.
+
+    index, size: tuple, optional
+            Index of the first voxel and size of the region, see
+            get_mask_region. If not given, the full image is read.
+
+    '''
+    if index is None:
+        return sitk.ReadImage(image_file)
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(image_file)
+    if not hasattr(reader, 'SetExtractIndex'):
+        # Older SimpleITK versions cannot read a region
+        return sitk.RegionOfInterest(sitk.ReadImage(image_file), size, index)
+
+    reader.SetExtractIndex(index)
+    reader.SetExtractSize(size)
+    return reader.Execute()
+
+
+def read_image_size(image_file):
+    '''
+    Read the size of an image from the header only.
+    '''
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(image_file)
+    if not hasattr(reader, 'ReadImageInformation'):
+        return sitk.ReadImage(image_file).GetSize()
+
+    reader.ReadImageInformation()
+    return reader.GetSize()
+
+
+def load_DTI_post(dicom_folder, patient_ID, index=None, size=None):
+    # Going to load the 3 eigenvalues, optionally only a region of them
     L1_file = os.path.join(dicom_folder, patient_ID + '_DTI_post_L1.nii.gz')
     L2_file = os.path.join(dicom_folder, patient_ID + '_DTI_post_L2.nii.gz')
     L3_file = os.path.join(dicom_folder, patient_ID + '_DTI_post_L3.nii.gz')
 
-    L1_image = sitk.ReadImage(L1_file)
-    L2_image = sitk.ReadImage(L2_file)
-    L3_image = sitk.ReadImage(L3_file)
+    L1_image = read_image_region(L1_file, index, size)
+    L2_image = read_image_region(L2_file, index, size)
+    L3_image = read_image_region(L3_file, index, size)
 
     DTI_post_images = [L1_image, L2_image, L3_image]
 
     return DTI_post_images, None
 
-def get_DTI_dicoms(input_dir):
 
+def get_DTI_dicoms(input_dir, n_jobs=DICOM_N_JOBS):
+    '''
+    Return the sorted DICOM files in a folder and their headers. The pixel
+    data is not read, see read_dicom_volume.
+    '''
     # We need to sort them in a certain way, otherwise 10 will come before 100.
     # This will screw up the order of the images, fixed in this way.
-    dicom_files = glob.glob(input_dir+'/*.dcm')
+    if type(input_dir) is list:
+        dicom_files = input_dir
+    else:
+        dicom_files = glob.glob(input_dir+'/*.dcm')
     dicom_files = natsorted(dicom_files, alg=ns.IGNORECASE)
 
-    dicoms = list()
-    for i_dicom in dicom_files:
-        dicoms.append(pydicom.read_file(i_dicom))
+    dicom_headers = scan_dicom_headers(dicom_files, n_jobs)
+    valid = [i for i, h in enumerate(dicom_headers) if h is not None]
+    if len(valid) < len(dicom_files):
+        print(('[PREDICT Warning] Skipping {} files in {} which are not DICOM.').format(str(len(dicom_files) - len(valid)), str(input_dir)))
+
+    dicom_files = [dicom_files[i] for i in valid]
+    dicom_headers = [dicom_headers[i] for i in valid]
 
-    return dicoms
+    return dicom_files, dicom_headers
 
 
 def get_positions(dicoms):
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2018 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import glob
+import hashlib
+import tempfile
+import numpy as np
+import PREDICT.helpers.sitk_helper as sitkh
+from PREDICT.imagefeatures.feature_cache import get_version
+
+
+class VolumeCache(object):
+    '''
+    Persistent on-disk cache of decoded DICOM series. Each series is stored
+    as a raw array, which is opened as a memory map, and a JSON sidecar with
+    the data type, shape, spacing, origin and direction. The entries are
+    named after a hash of the SeriesInstanceUID, the paths, modification
+    times and sizes of the files of the series and the PREDICT version, so
+    a modified or added file invalidates the entry.
+
+    The cache saves the reading and decoding of the DICOM files, not memory:
+    load copies the memory map into an ITK Image. Use load_array to access
+    the voxels without loading them.
+
+    When the total size of the cache exceeds max_size, the least recently
+    used entries are removed.
+
+    Parameters
+    ----------
+    cache_dir: string, mandatory
+            Folder in which the decoded volumes are stored.
+
+    max_size: float, default 10000
+            Maximum size of the cache in megabytes. If None, the size is not
+            limited.
+
+    '''
+    def __init__(self, cache_dir, max_size=10000):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.version = get_version()
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # Created in the meantime by another process
+                pass
+
+    def get_key(self, series_uid, dicom_files, rescale=True):
+        sha = hashlib.sha1()
+        sha.update(str(series_uid).encode('utf-8'))
+        for dicom_file in dicom_files:
+            stat = os.stat(dicom_file)
+            sha.update(os.path.abspath(dicom_file).encode('utf-8'))
+            sha.update(str(stat.st_mtime).encode('utf-8'))
+            sha.update(str(stat.st_size).encode('utf-8'))
+        sha.update(str(rescale).encode('utf-8'))
+        sha.update(self.version.encode('utf-8'))
+        return sha.hexdigest()
+
+    def get_filenames(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.raw', base + '.json'
+
+    def load_array(self, key):
+        '''
+        Open a cached volume as a read-only memory map. Returns None and the
+        geometry if not present.
+        '''
+        raw_file, json_file = self.get_filenames(key)
+        try:
+            with open(json_file, 'r') as fp:
+                sidecar = json.load(fp)
+            volume = np.memmap(raw_file, dtype=np.dtype(str(sidecar['dtype'])),
+                               mode='r', shape=tuple(sidecar['shape']))
+        except (IOError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None, None
+
+        # Mark as recently used
+        for filename in [raw_file, json_file]:
+            try:
+                os.utime(filename, None)
+            except OSError:
+                pass
+
+        self.hits += 1
+        return volume, sidecar
+
+    def load(self, key):
+        '''
+        Load a cached volume as an ITK Image. Returns None if not present.
+        The voxels are copied from the memory map into the image, so the
+        image takes as much memory as a decoded series.
+        '''
+        volume, sidecar = self.load_array(key)
+        if volume is None:
+            return None
+
+        image = sitkh.GetImageFromArray(volume)
+        image.SetSpacing(tuple(sidecar['spacing']))
+        image.SetOrigin(tuple(sidecar['origin']))
+        image.SetDirection(tuple(sidecar['direction']))
+        return image
+
+    def save(self, key, volume, spacing, origin, direction, series_uid=''):
+        '''
+        Save a decoded volume, in the x, y, z order of
+        sitk_helper.GetArrayFromImage, to the cache. Both files are first
+        written to temporary files and then moved, the sidecar last, so
+        parallel workers never see partially written entries.
+        '''
+        raw_file, json_file = self.get_filenames(key)
+        volume = np.ascontiguousarray(volume)
+
+        fd, tempname = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            volume.tofile(fp)
+        os.rename(tempname, raw_file)
+
+        sidecar = {'series_uid': str(series_uid),
+                   'version': self.version,
+                   'dtype': volume.dtype.str,
+                   'shape': list(volume.shape),
+                   'spacing': [float(s) for s in spacing],
+                   'origin': [float(o) for o in origin],
+                   'direction': [float(d) for d in direction]}
+
+        fd, tempname = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(sidecar, fp)
+        os.rename(tempname, json_file)
+
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache is smaller
+        than the maximum size.
+        '''
+        if self.max_size is None:
+            return
+
+        entries = list()
+        total_size = 0
+        for json_file in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            raw_file = os.path.splitext(json_file)[0] + '.raw'
+            try:
+                stat = os.stat(json_file)
+                size = stat.st_size + os.stat(raw_file).st_size
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, size, json_file, raw_file))
+            total_size += size
+
+        max_size = self.max_size * 1024 * 1024
+        for _, size, json_file, raw_file in sorted(entries):
+            if total_size <= max_size:
+                break
+            # Remove the sidecar first, which invalidates the entry
+            for filename in [json_file, raw_file]:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            total_size -= size
+
+    def print_report(self):
+        print(('Volume cache: {} hits, {} misses.').format(str(self.hits), str(self.misses)))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2018 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import scipy.ndimage as ndi
+import PREDICT.helpers.sitk_helper as sitkh
+import PREDICT.addexceptions as ae
+
+# Phantom definitions: image size in voxels (x, y, z), voxel spacing in mm
+# and radii of the ellipsoidal mask in mm.
+PHANTOMS = {'tiny': {'shape': (128, 128, 32),
+                     'spacing': (0.8, 0.8, 3.0),
+                     'radii': (4.0, 3.0, 4.5)},
+            'tumour': {'shape': (256, 256, 48),
+                       'spacing': (0.8, 0.8, 3.0),
+                       'radii': (25.0, 22.0, 25.0)},
+            'organ': {'shape': (256, 256, 64),
+                      'spacing': (1.2, 1.2, 3.0),
+                      'radii': (90.0, 65.0, 75.0)}}
+
+MODALITIES = ['CT', 'MR']
+
+
+def get_mask(shape, spacing, radii, center=None):
+    '''
+    Create an ellipsoidal mask with the given radii in mm.
+    '''
+    if center is None:
+        center = [(s - 1) / 2.0 for s in shape]
+
+    x, y, z = np.ogrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    distance = ((x - center[0]) * spacing[0] / radii[0])**2 +\
+        ((y - center[1]) * spacing[1] / radii[1])**2 +\
+        ((z - center[2]) * spacing[2] / radii[2])**2
+
+    return distance <= 1.0
+
+
+def get_phantom_arrays(size='tumour', modality='CT', seed=0):
+    '''
+    Create the arrays of a synthetic phantom: a smooth background with a
+    textured ellipsoidal lesion. The texture is created by smoothing random
+    noise, so all texture features are non-trivial.
+
+    Returns the image array, the mask array and the voxel spacing, in the
+    x, y, z order of sitk_helper.GetArrayFromImage.
+    '''
+    if size not in PHANTOMS.keys():
+        raise ae.PREDICTKeyError(('Unknown phantom size {}, should be one of {}.').format(size, sorted(PHANTOMS.keys())))
+
+    if modality not in MODALITIES:
+        raise ae.PREDICTKeyError(('Unknown phantom modality {}, should be one of {}.').format(modality, MODALITIES))
+
+    definition = PHANTOMS[size]
+    shape = definition['shape']
+    spacing = definition['spacing']
+
+    random_state = np.random.RandomState(seed)
+    mask = get_mask(shape, spacing, definition['radii'])
+
+    # Smooth background and lesion texture
+    background = ndi.gaussian_filter(random_state.standard_normal(shape), 8)
+    texture = ndi.gaussian_filter(random_state.standard_normal(shape), 1.5)
+    background = background / (np.abs(background).max() + 1e-12)
+    texture = texture / (np.abs(texture).max() + 1e-12)
+    noise = random_state.standard_normal(shape)
+
+    if modality == 'CT':
+        # Soft tissue around 40 HU, enhancing lesion
+        image = 40 + 20 * background + 10 * noise
+        image[mask] += 60 + 40 * texture[mask]
+        image = np.round(image).astype(np.int16)
+    else:
+        # Positive MR intensities with Rician like noise
+        image = 300 + 100 * background
+        image[mask] += 200 + 150 * texture[mask]
+        image = np.sqrt((image + 20 * noise)**2 +
+                        (20 * random_state.standard_normal(shape))**2)
+        image = image.astype(np.float32)
+
+    return image, mask.astype(np.uint8), spacing
+
+
+def get_phantom(size='tumour', modality='CT', seed=0):
+    '''
+    Create a synthetic phantom as ITK images.
+
+    Parameters
+    ----------
+    size: string, default 'tumour'
+            Size of the phantom: 'tiny' for a small lesion, 'tumour' for a
+            5 cm tumour or 'organ' for a whole organ mask.
+
+    modality: string, default 'CT'
+            Either 'CT' or 'MR'.
+
+    seed: integer, default 0
+            Seed for the random number generator.
+
+    Returns
+    ----------
+    image: ITK Image
+            Image of the phantom.
+
+    mask: ITK Image
+            Mask of the lesion.
+
+    '''
+    image, mask, spacing = get_phantom_arrays(size, modality, seed)
+
+    image = sitkh.GetImageFromArray(image)
+    image.SetSpacing(spacing)
+    mask = sitkh.GetImageFromArray(mask)
+    mask.SetSpacing(spacing)
+
+    return image, mask
+
+
+def get_dti_phantom(size='tumour', b_values=(0, 500, 1000), seed=0):
+    '''
+    Create a synthetic diffusion weighted phantom, in which the lesion has
+    a lower ADC than the background.
+
+    Returns a list with an ITK Image per b-value, the mask and the metadata
+    containing the b-values.
+    '''
+    _, mask, spacing = get_phantom_arrays(size, 'MR', seed)
+    random_state = np.random.RandomState(seed + 1)
+    shape = mask.shape
+
+    ADC = 2.0e-3 + 2.0e-4 * random_state.standard_normal(shape)
+    ADC[mask > 0] = 1.0e-3 + 1.0e-4 * random_state.standard_normal(int(np.sum(mask)))
+    ADC = np.clip(ADC, 1e-5, None)
+
+    images = list()
+    for b in b_values:
+        signal = 1000.0 * np.exp(-b * ADC)
+        signal += 10 * random_state.standard_normal(shape)
+        image = sitkh.GetImageFromArray(signal.astype(np.float32))
+        image.SetSpacing(spacing)
+        images.append(image)
+
+    mask = sitkh.GetImageFromArray(mask)
+    mask.SetSpacing(spacing)
+
+    return images, mask, {'b_values': list(b_values)}
+
+
+def get_dti_post_phantom(size='tumour', seed=0):
+    '''
+    Create a synthetic phantom of the three eigenvalue images of a diffusion
+    tensor fit.
+    '''
+    _, mask, spacing = get_phantom_arrays(size, 'MR', seed)
+    random_state = np.random.RandomState(seed + 2)
+    shape = mask.shape
+
+    images = list()
+    for mean in [1.7e-3, 1.2e-3, 0.8e-3]:
+        eigenvalue = mean + 1.0e-4 * random_state.standard_normal(shape)
+        image = sitkh.GetImageFromArray(eigenvalue.astype(np.float32))
+        image.SetSpacing(spacing)
+        images.append(image)
+
+    mask = sitkh.GetImageFromArray(mask)
+    mask.SetSpacing(spacing)
+
+    return images, mask, None
+
+
+def get_feature_matrix(n_patients=60, n_features=200, seed=0):
+    '''
+    Create a synthetic feature matrix with binary labels, in the format used
+    by the SearchCV objects: for each patient a tuple with the feature values
+    and the feature labels.
+    '''
+    random_state = np.random.RandomState(seed)
+    labels = np.arange(n_patients) % 2
+    values = random_state.standard_normal((n_patients, n_features))
+
+    # Make a few features informative
+    values[:, 0:10] += labels[:, np.newaxis] * 0.8
+
+    feature_labels = [('hf_feature_{}').format(i) for i in range(n_features)]
+    X = [(list(v), feature_labels) for v in values]
+
+    return X, labels
@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2018 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import argparse
+import platform
+import numpy as np
+
+import PREDICT.benchmark.phantoms as phantoms
+from PREDICT.helpers.roi_context import ROIContext
+from PREDICT.imagefeatures.feature_cache import get_version
+import PREDICT.imagefeatures.histogram_features as hf
+import PREDICT.imagefeatures.texture_features as tf
+import PREDICT.imagefeatures.shape_features as sf
+import PREDICT.imagefeatures.orientation_features as of
+import PREDICT.imagefeatures.coliage_features as cf
+import PREDICT.imagefeatures.dti_features as dtif
+import PREDICT.imagefeatures.log_features as logf
+import PREDICT.imagefeatures.vessel_features as vesf
+import PREDICT.imagefeatures.phase_features as phasef
+import PREDICT.addexceptions as ae
+
+# Folder containing the reference outputs of the benchmarks
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'reference')
+
+# Parameters equal to the defaults of the CalcFeatures config
+PARAMETERS = {'gabor_settings': {'gabor_frequencies': [0.05, 0.2, 0.5],
+                                 'gabor_angles': list(np.radians([0, 45, 90, 135]))},
+              'GLCM': {'levels': 16,
+                       'angles': [0, np.pi/4, np.pi/2, 3*np.pi/4],
+                       'distances': [1, 3]},
+              'LBP': {'radius': [3, 8, 15],
+                      'N_points': [12, 24, 36]},
+              'phase': {'minwavelength': [3],
+                        'nscale': [5]},
+              'log': {'sigma': [1, 5, 10]},
+              'vessel': {'scale_range': [1, 10],
+                         'scale_step': [2],
+                         'radius': 5}}
+
+# Synthetic cohorts for the SearchCV benchmark: patients and features
+COHORTS = {'tiny': (40, 50),
+           'tumour': (100, 200),
+           'organ': (200, 1000)}
+
+ALL_SIZES = ['tiny', 'tumour', 'organ']
+
+
+def _texture(group):
+    def function(case):
+        tasks = tf.get_texture_tasks(case['image'], case['mask'], PARAMETERS,
+                                     group, n_jobs=1, backend='threading')
+        _, _, texture_function, args, kwargs = tasks[0]
+        return texture_function(*args, **kwargs)
+    return function
+
+
+def _searchcv_fit(case):
+    from scipy.stats import uniform
+    from sklearn.svm import SVC
+    from sklearn.model_selection import StratifiedShuffleSplit
+    from PREDICT.processing.SearchCV import RandomizedSearchCVJoblib
+
+    cv = StratifiedShuffleSplit(n_splits=3, test_size=0.2, random_state=0)
+    param_distributions = {'Featsel_Variance': ['True'],
+                           'FeatureScaling': ['z_score'],
+                           'C': uniform(loc=0.1, scale=10),
+                           'kernel': ['linear']}
+    search = RandomizedSearchCVJoblib(SVC(probability=True),
+                                      param_distributions=param_distributions,
+                                      n_iter=10, scoring='f1_weighted',
+                                      n_jobs=1, verbose=0, cv=cv,
+                                      random_state=0)
+    search.fit(case['X'], case['y'])
+    return [search.best_score_], ['best_score']
+
+
+# Relative tolerance of the benchmarks whose outputs on the float32 MR
+# phantom differ from the reference within float32 precision
+FLOAT32_RTOL = 1e-4
+
+# Each benchmark has a name, the function to time, the type of input and
+# the phantom sizes it is run on. The functions take a case as input, which
+# is a dictionary with the prepared inputs, and return the feature values
+# and labels. Optionally, a benchmark has a larger rtol of its own.
+BENCHMARKS = [
+    {'name': 'shape', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: sf.get_shape_features(c['shape_mask'])},
+    {'name': 'shape_3D', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: sf.get_shape_features(c['roi_mask'], mode='3D', spacing=c['spacing'])},
+    {'name': 'orientation', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: of.get_orientation_features(np.transpose(c['shape_mask']))},
+    {'name': 'orientation_ellipsoid', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: of.get_orientation_features(np.transpose(c['shape_mask']), method='ellipsoid')},
+    {'name': 'histogram', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: hf.get_histogram_features(c['masked_voxels'], 50),
+     'rtol': FLOAT32_RTOL},
+    {'name': 'texture_Gabor', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': _texture('Gabor'), 'rtol': FLOAT32_RTOL},
+    {'name': 'texture_GLCM', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': _texture('GLCM')},
+    {'name': 'texture_GLCMMS', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': _texture('GLCMMS')},
+    {'name': 'texture_GLRLM', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': _texture('GLRLM')},
+    {'name': 'texture_GLSZM', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': _texture('GLSZM')},
+    {'name': 'texture_NGTDM', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': _texture('NGTDM')},
+    {'name': 'texture_LBP', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': _texture('LBP')},
+    {'name': 'log', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: logf.get_log_features(c['image'], c['mask'], PARAMETERS['log'])},
+    {'name': 'log_3D', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: logf.get_log_features(c['roi_image'], c['roi_mask'], dict(PARAMETERS['log'], mode='3D'), c['spacing'])},
+    {'name': 'vessel', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: vesf.get_vessel_features(c['image'], c['mask'], PARAMETERS['vessel'])},
+    {'name': 'phase', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: phasef.get_phase_features(c['image'], c['mask'], PARAMETERS['phase'])},
+    {'name': 'coliage', 'input': 'image', 'sizes': ALL_SIZES,
+     'function': lambda c: cf.get_coliage_features(c['image'], c['mask'])},
+    {'name': 'DTI', 'input': 'dti', 'sizes': ALL_SIZES,
+     'function': lambda c: dtif.get_dti_features(c['images'], c['mask'], c['metadata'])},
+    {'name': 'DTI_post', 'input': 'dti_post', 'sizes': ALL_SIZES,
+     'function': lambda c: dtif.get_dti_post_features(c['images'], c['mask'], c['metadata'])},
+    {'name': 'SearchCV_fit', 'input': 'features', 'sizes': ALL_SIZES,
+     'function': _searchcv_fit}
+]
+
+
+def get_case(input_type, size, modality, seed=0):
+    '''
+    Prepare the inputs of a benchmark, in the same way as in
+    get_features.get_image_features.
+    '''
+    if input_type == 'image':
+        image, mask = phantoms.get_phantom(size, modality, seed)
+        roi = ROIContext(image, mask)
+        return {'image': roi.masked_slices_image,
+                'mask': roi.masked_slices_mask,
+                'roi_image': roi.image,
+                'roi_mask': roi.mask.astype(np.bool),
+                'spacing': roi.spacing,
+                'masked_voxels': roi.masked_voxels,
+                'shape_mask': roi.shape_mask}
+    elif input_type == 'dti':
+        images, mask, metadata = phantoms.get_dti_phantom(size, seed=seed)
+        return {'images': images, 'mask': mask, 'metadata': metadata}
+    elif input_type == 'dti_post':
+        images, mask, metadata = phantoms.get_dti_post_phantom(size, seed=seed)
+        return {'images': images, 'mask': mask, 'metadata': metadata}
+    elif input_type == 'features':
+        n_patients, n_features = COHORTS[size]
+        X, y = phantoms.get_feature_matrix(n_patients, n_features, seed)
+        return {'X': X, 'y': y}
+    else:
+        raise ae.PREDICTKeyError(('Unknown benchmark input {}.').format(input_type))
+
+
+def get_reference_filename(reference_dir, name, size, modality):
+    return os.path.join(reference_dir,
+                        ('{}_{}_{}.json').format(name, size, modality))
+
+
+def compare_reference(values, labels, reference_file, rtol=1e-6, atol=1e-9):
+    '''
+    Compare feature values and labels with a reference output. Returns
+    whether the outputs are equivalent and the maximum absolute difference,
+    or None for both if there is no reference.
+    '''
+    if not os.path.exists(reference_file):
+        return None, None
+
+    with open(reference_file, 'r') as fp:
+        reference = json.load(fp)
+
+    if list(labels) != reference['feature_labels']:
+        return False, None
+
+    values = np.asarray(values, dtype=np.float64)
+    reference_values = np.asarray(reference['feature_values'], dtype=np.float64)
+    equivalent = bool(np.allclose(values, reference_values, rtol=rtol,
+                                  atol=atol, equal_nan=True))
+
+    difference = np.abs(values - reference_values)
+    difference = difference[~np.isnan(difference)]
+    max_difference = float(np.max(difference)) if difference.size > 0 else 0.0
+
+    return equivalent, max_difference
+
+
+def write_reference(values, labels, reference_file):
+    reference_dir = os.path.dirname(reference_file)
+    if not os.path.exists(reference_dir):
+        os.makedirs(reference_dir)
+
+    with open(reference_file, 'w') as fp:
+        json.dump({'feature_values': [float(v) for v in values],
+                   'feature_labels': [str(l) for l in labels]}, fp, indent=1)
+
+
+def run_benchmarks(output=None, sizes=None, modalities=None, names=None,
+                   repeats=1, reference_dir=REFERENCE_DIR,
+                   update_reference=False, rtol=1e-6, atol=1e-9,
+                   verbose=True):
+    '''
+    Time the feature extraction functions on synthetic phantoms and compare
+    their outputs with the reference outputs.
+
+    Parameters
+    ----------
+    output: string, optional
+            Path to a JSON file to which the results are written.
+
+    sizes: list, optional
+            Phantom sizes to use, see phantoms.PHANTOMS. Default is all.
+
+    modalities: list, optional
+            Phantom modalities to use for the image features, see
+            phantoms.MODALITIES. Default is CT only.
+
+    names: list, optional
+            Names of the benchmarks to run. Default is all.
+
+    repeats: integer, default 1
+            Number of times each benchmark is timed.
+
+    reference_dir: string, default REFERENCE_DIR
+            Folder containing the reference outputs.
+
+    update_reference: boolean, default False
+            If True, the reference outputs are overwritten by the current
+            outputs instead of compared.
+
+    rtol, atol: float
+            Relative and absolute tolerance for the comparison. Benchmarks
+            with a larger rtol of their own use that one instead.
+
+    Returns
+    ----------
+    results: dictionary
+            Contains the version, platform and for each benchmark the
+            timings and result of the comparison.
+
+    '''
+    if sizes is None:
+        sizes = ALL_SIZES
+
+    if modalities is None:
+        modalities = ['CT']
+
+    benchmarks = BENCHMARKS
+    if names is not None:
+        unknown = set(names) - set([b['name'] for b in BENCHMARKS])
+        if unknown:
+            raise ae.PREDICTKeyError(('Unknown benchmarks: {}.').format(sorted(unknown)))
+        benchmarks = [b for b in BENCHMARKS if b['name'] in names]
+
+    results = {'version': get_version(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'benchmarks': list()}
+
+    for size in sizes:
+        for input_type in ['image', 'dti', 'dti_post', 'features']:
+            current = [b for b in benchmarks if b['input'] == input_type and
+                       size in b['sizes']]
+            if not current:
+                continue
+
+            # Only the image features depend on the modality
+            input_modalities = modalities if input_type == 'image' else [input_type]
+            for modality in input_modalities:
+                case = get_case(input_type, size, modality)
+                for benchmark in current:
+                    result = run_benchmark(benchmark, case, size, modality,
+                                           repeats, reference_dir,
+                                           update_reference, rtol, atol)
+                    results['benchmarks'].append(result)
+                    if verbose:
+                        print_result(result)
+
+    if output is not None:
+        with open(output, 'w') as fp:
+            json.dump(results, fp, indent=1)
+
+    return results
+
+
+def run_benchmark(benchmark, case, size, modality, repeats=1,
+                  reference_dir=REFERENCE_DIR, update_reference=False,
+                  rtol=1e-6, atol=1e-9):
+    times = list()
+    for _ in range(repeats):
+        start = time.time()
+        values, labels = benchmark['function'](case)
+        times.append(time.time() - start)
+
+    reference_file = get_reference_filename(reference_dir, benchmark['name'],
+                                            size, modality)
+    if update_reference:
+        write_reference(values, labels, reference_file)
+        equivalent, max_difference = True, 0.0
+    else:
+        rtol = max(rtol, benchmark.get('rtol', rtol))
+        equivalent, max_difference = compare_reference(values, labels,
+                                                       reference_file,
+                                                       rtol, atol)
+
+    return {'name': benchmark['name'],
+            'size': size,
+            'modality': modality,
+            'repeats': repeats,
+            'time_min': min(times),
+            'time_mean': float(np.mean(times)),
+            'n_features': len(values),
+            'equivalent': equivalent,
+            'max_difference': max_difference}
+
+
+def print_result(result):
+    if result['equivalent'] is None:
+        status = 'no reference'
+    elif result['equivalent']:
+        status = 'equivalent'
+    else:
+        status = ('DIFFERENT (max difference {})').format(result['max_difference'])
+
+    print(('{:<16} {:<7} {:<9} {:>10.3f} s  {}').format(result['name'],
+                                                       result['size'],
+                                                       result['modality'],
+                                                       result['time_min'],
+                                                       status))
+
+
+def compare_benchmarks(old_results, new_results, threshold=1.2):
+    '''
+    Compare two benchmark result files, e.g. of two commits. Returns a list
+    of the benchmarks which are slower than threshold times the old time, or
+    of which the output is not equivalent to the reference anymore.
+    '''
+    with open(old_results, 'r') as fp:
+        old = json.load(fp)
+    with open(new_results, 'r') as fp:
+        new = json.load(fp)
+
+    old_times = dict()
+    for result in old['benchmarks']:
+        key = (result['name'], result['size'], result['modality'])
+        old_times[key] = result['time_min']
+
+    regressions = list()
+    for result in new['benchmarks']:
+        key = (result['name'], result['size'], result['modality'])
+        old_time = old_times.get(key)
+        slower = old_time is not None and result['time_min'] > threshold * old_time
+        if slower or result['equivalent'] is False:
+            regressions.append({'name': result['name'],
+                                'size': result['size'],
+                                'modality': result['modality'],
+                                'old_time': old_time,
+                                'new_time': result['time_min'],
+                                'equivalent': result['equivalent']})
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PREDICT feature extraction on synthetic phantoms')
+    parser.add_argument('-output', '--output', metavar='output',
+                        dest='output', type=str, required=False,
+                        help='Output file for the results (JSON)')
+    parser.add_argument('-sizes', '--sizes', metavar='sizes',
+                        nargs='+', dest='sizes', type=str, required=False,
+                        help='Phantom sizes: tiny, tumour and/or organ')
+    parser.add_argument('-modalities', '--modalities', metavar='modalities',
+                        nargs='+', dest='modalities', type=str, required=False,
+                        help='Phantom modalities: CT and/or MR')
+    parser.add_argument('-benchmarks', '--benchmarks', metavar='benchmarks',
+                        nargs='+', dest='names', type=str, required=False,
+                        help='Names of the benchmarks to run')
+    parser.add_argument('-repeats', '--repeats', metavar='repeats',
+                        dest='repeats', type=int, default=1,
+                        help='Number of repeats per benchmark')
+    parser.add_argument('-reference', '--reference', metavar='reference',
+                        dest='reference', type=str, default=REFERENCE_DIR,
+                        help='Folder containing the reference outputs')
+    parser.add_argument('-update-reference', '--update-reference',
+                        dest='update_reference', action='store_true',
+                        help='Overwrite the reference outputs')
+    parser.add_argument('-compare', '--compare', metavar='compare',
+                        dest='compare', type=str, required=False,
+                        help='Results (JSON) of a previous run to compare the timings with')
+    args = parser.parse_args()
+
+    run_benchmarks(output=args.output, sizes=args.sizes,
+                   modalities=args.modalities, names=args.names,
+                   repeats=args.repeats, reference_dir=args.reference,
+                   update_reference=args.update_reference)
+
+    if args.compare is not None:
+        if args.output is None:
+            raise ae.PREDICTIOError('An output file is required to compare the results.')
+
+        regressions = compare_benchmarks(args.compare, args.output)
+        for regression in regressions:
+            print(('[PREDICT Warning] Regression in {} ({}, {}): {} s -> {} s, equivalent: {}.').format(regression['name'], regression['size'], regression['modality'], regression['old_time'], regression['new_time'], regression['equivalent']))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 import numpy as np
 import os
+import re
 import configparser
 import PREDICT.addexceptions as ae
 
@@ -161,8 +162,104 @@ def load_genetic_XNAT(genetic_info):
     return mutation_names, patient_ID, mutation_status
 
 
+def get_patient_keys(filename, pattern=None):
+    """
+    Get the keys under which a feature file can be matched to a patient ID.
+
+    Args:
+        filename (string): path of the feature file, or a patient ID
+        pattern (string or compiled regex, optional): regular expression
+         extracting the patient ID from the filename. If it contains a group
+         named patient, that group is used, otherwise the first group or the
+         full match. If None, the filename itself, its basename without
+         extensions and each run of consecutive alphanumeric tokens within
+         a component of the path are used, e.g. Patient1 for both
+         features_Patient1_0.hdf5 and Patient1/features.hdf5.
+
+    Returns:
+        keys (list): the keys of the file, which is empty if the pattern
+         does not match
+    """
+    filename = str(filename)
+    if pattern is not None:
+        if not hasattr(pattern, 'search'):
+            pattern = re.compile(pattern)
+        match = pattern.search(filename)
+        if match is None:
+            return list()
+        if 'patient' in pattern.groupindex:
+            return [match.group('patient')]
+        elif pattern.groups > 0:
+            return [match.group(1)]
+        return [match.group(0)]
+
+    basename = os.path.basename(filename)
+    keys = [filename, basename]
+    while os.path.splitext(basename)[1]:
+        basename = os.path.splitext(basename)[0]
+        keys.append(basename)
+
+    # Runs of tokens separated by non-alphanumeric characters, so an ID only
+    # matches complete tokens: Patient1 does not match Patient10
+    components = os.path.normpath(filename).split(os.sep)
+    components[-1] = os.path.splitext(components[-1])[0]
+    for component in components:
+        tokens = [m.span() for m in re.finditer(r'[^\W_]+', component)]
+        for i_start, (start, _) in enumerate(tokens):
+            for _, end in tokens[i_start:]:
+                keys.append(component[start:end])
+
+    return keys
+
+
+def match_patients(patient_IDs, filenames, pattern=None):
+    """
+    Match patient IDs to feature files through an index of the files.
+
+    Args:
+        patient_IDs (list): IDs of the patients
+        filenames (list): names of the patient feature files
+        pattern (string, optional): see get_patient_keys. If None, patients
+         which are not found in the index are matched to all files
+         containing the patient ID, as in previous versions. As this
+         searches all filenames for each of these patients, a warning is
+         given when it is used.
+
+    Returns:
+        matches (list): for each patient, the indices of the matching files
+    """
+    if pattern is not None and not hasattr(pattern, 'search'):
+        pattern = re.compile(pattern)
+
+    index = dict()
+    for i_feat, feat in enumerate(filenames):
+        for key in get_patient_keys(feat, pattern):
+            files = index.setdefault(key, list())
+            if not files or files[-1] != i_feat:
+                files.append(i_feat)
+
+    matches = list()
+    not_indexed = list()
+    for i_patient in patient_IDs:
+        i_patient = str(i_patient)
+        if i_patient in index:
+            matches.append(index[i_patient])
+        elif pattern is None:
+            # Fall back on a search of the patient ID in the filenames
+            matches.append([i_feat for i_feat, feat in enumerate(filenames)
+                            if i_patient in str(feat)])
+            not_indexed.append(i_patient)
+        else:
+            matches.append(list())
+
+    if not_indexed:
+        print(('[PREDICT Warning] {} patients, e.g. {}, are not a token of the feature filenames and are searched in all filenames, which is slow for large cohorts. Use the patient_pattern field in the Genetics config section to extract the patient IDs from the filenames.').format(str(len(not_indexed)), not_indexed[0]))
+
+    return matches
+
+
 def findmutationdata(patientinfo, mutation_type, filenames,
-                     image_features_temp=None):
+                     image_features_temp=None, pattern=None):
     """
     Load the label data and match to the unage features.
 
@@ -171,6 +268,8 @@ def findmutationdata(patientinfo, mutation_type, filenames,
         mutation_type (string): name of the label read out from patientinfo
         filenames (list): names of the patient feature files, used for matching
         image_features (np.array or list): array of the features
+        pattern (string, optional): regular expression to extract the
+         patient ID from the filenames, see get_patient_keys
 
     Returns:
         mutation_data (dict): contains patient ids, their labels and the mutation name
@@ -178,27 +277,25 @@ def findmutationdata(patientinfo, mutation_type, filenames,
     # Get the mutation labels and patient IDs
     mutation_data_temp = load_mutation_status(patientinfo, mutation_type)
     mutation_data = dict()
-    patient_IDs = list()
-    mutation_label = list()
-    for i_len in range(len(mutation_data_temp['mutation_label'])):
-        mutation_label.append(list())
+
+    # Match the patients to the files through an index of the filenames
+    matches = match_patients(mutation_data_temp['patient_IDs'], filenames,
+                             pattern)
+    patient_index = [i_num for i_num, files in enumerate(matches)
+                     for _ in files]
+    feature_index = [i_feat for files in matches for i_feat in files]
+
+    patient_IDs = [mutation_data_temp['patient_IDs'][i_num] for i_num in patient_index]
 
     image_features = list()
-    for i_num, i_patient in enumerate(mutation_data_temp['patient_IDs']):
-        for i_feat, feat in enumerate(filenames):
-            if i_patient in str(feat):
-                patient_IDs.append(i_patient)
-                if image_features_temp is not None:
-                    image_features.append(image_features_temp[i_feat])
-                for i_len in range(len(mutation_data_temp['mutation_label'])):
-                    mutation_label[i_len].append(mutation_data_temp['mutation_label'][i_len][i_num])
-
-    # if image_features_temp is not None:
-    #     image_features = np.asarray(image_features)
+    if image_features_temp is not None:
+        image_features = [image_features_temp[i_feat] for i_feat in feature_index]
 
     # Convert to arrays
-    for i_len in range(len(mutation_label)):
-        mutation_label[i_len] = np.asarray(mutation_label[i_len])
+    mutation_label = list()
+    for i_len in range(len(mutation_data_temp['mutation_label'])):
+        labels = np.asarray(mutation_data_temp['mutation_label'][i_len])
+        mutation_label.append(labels[np.asarray(patient_index, dtype=int)])
 
     mutation_data['patient_IDs'] = np.asarray(patient_IDs)
     mutation_data['mutation_label'] = np.asarray(mutation_label)
@@ -16,11 +16,9 @@
 # limitations under the License.
 
 import SimpleITK as sitk
-import sitk_helper as sitkh
+import PREDICT.helpers.sitk_helper as sitkh
 import numpy as np
-
-# CONSTANTS
-TURN_LEFT, TURN_RIGHT, TURN_NONE = (1, -1, 0)
+from scipy.spatial import ConvexHull
 
 
 def get_contour_boundary(contour):
@@ -40,21 +38,32 @@ def sort_points(points):
     return points
 
 
+def index_to_physical_points(image, index):
+    """
+    Convert an array of ITK indices of shape (dimensions, N) to physical
+    points of shape (N, dimensions), as TransformContinuousIndexToPhysicalPoint
+    does for a single index. The origin, spacing and direction of the image
+    are applied as a single matrix multiplication.
+    """
+    dimension = image.GetDimension()
+    direction = np.reshape(image.GetDirection(), (dimension, dimension))
+    matrix = direction * np.asarray(image.GetSpacing())[np.newaxis, :]
+    origin = np.asarray(image.GetOrigin())
+
+    index = np.asarray(index, dtype=np.float64).reshape(dimension, -1)
+    return np.dot(matrix, index).T + origin
+
+
 def get_contour_boundary_points(contour):
-    """Get boundary coordinates from contour"""
+    """Get boundary coordinates from contour, either 2D or 3D"""
     # First convert the contour image to array
     contour_boundary = get_contour_boundary(contour)
     contour_boundary_array = sitkh.GetArrayFromImage(contour_boundary)
     boundary_index = np.asarray(np.nonzero(contour_boundary_array))
 
-    boundary_points = list()
-    for i in range(boundary_index.shape[1]):
-        # Convert index to actual coordinates
-        boundary_points.append(
-            contour_boundary.TransformContinuousIndexToPhysicalPoint(
-                [boundary_index[0, i], boundary_index[1, i]]))
-
-    boundary_points = np.asarray(boundary_points)
+    # Convert index to actual coordinates
+    boundary_points = index_to_physical_points(contour_boundary,
+                                               boundary_index)
 
     boundary_points = sort_points(boundary_points)
     # Add last point to ensure fully connected contour
@@ -97,40 +106,133 @@ def get_not_voi_voxels(contour, image):
     return voi_array, voi_array_nz
 
 
-def cmp(a, b):
-    "Built in in python 2, but defined for python 3"
-    return (a > b) - (a < b)
+def get_boundary_array(mask):
+    """
+    Labels pixels on edge of boundary of a 2D numpy mask. Equal to
+    get_contour_boundary: a pixel is on the boundary if one of its eight
+    neighbours is background, pixels outside the array are not background.
+    """
+    mask = mask.astype(np.bool)
+    padded = np.pad(mask, 1, mode='constant', constant_values=True)
+    rows, cols = mask.shape
 
+    interior = mask.copy()
+    for dx in range(0, 3):
+        for dy in range(0, 3):
+            interior &= padded[dx:dx + rows, dy:dy + cols]
 
-def turn(p, q, r):
-    return cmp((q[0] - p[0])*(r[1] - p[1]) - (r[0] - p[0])*(q[1] - p[1]), 0)
+    return mask & ~interior
 
 
-def _keep_left(hull, r):
-    while len(hull) > 1 and turn(hull[-2], hull[-1], r) != TURN_LEFT:
-            hull.pop()
-    if not len(hull) or hull[-1] != r:
-        hull.append(r)
-    return hull
+def _close_contour(boundary_points):
+    boundary_points = sort_points(boundary_points)
+    # Add last point to ensure fully connected contour
+    return np.append(boundary_points, boundary_points[0:1], 0)
+
+
+def get_boundary_points_batch(labeled, labels=None):
+    """
+    Get the sorted boundary coordinates of many blobs in a 2D labeled array
+    at once, with unit spacing. The boundary of each blob is equal to that of
+    get_contour_boundary_points on a mask of that blob, i.e. a pixel is on
+    the boundary if one of its eight neighbours has another label.
+
+    Parameters
+    ----------
+    labeled: numpy array, mandatory
+            2D array with a label per pixel. Label 0 is treated as any other
+            label.
+
+    labels: list, optional
+            Labels of the blobs of which the boundary is returned. By default
+            all labels present in the array.
+
+    Returns
+    ----------
+    boundaries: list
+            For each label an array with the boundary points in clockwise
+            order, in which the first point is repeated at the end, or None
+            if the label is not present.
+
+    """
+    labeled = np.asarray(labeled)
+    if labels is None:
+        labels = np.unique(labeled).tolist()
+
+    # Neighbours outside the array have the label of the pixel itself
+    padded = np.pad(labeled, 1, mode='edge')
+    rows, cols = labeled.shape
+    boundary = np.zeros(labeled.shape, dtype=np.bool)
+    for dx in range(0, 3):
+        for dy in range(0, 3):
+            boundary |= padded[dx:dx + rows, dy:dy + cols] != labeled
+
+    # Group the boundary pixels per label, keeping the row major order
+    boundary_index = np.asarray(np.nonzero(boundary))
+    boundary_labels = labeled[boundary]
+    order = np.argsort(boundary_labels, kind='mergesort')
+    sorted_labels = boundary_labels[order]
+
+    boundaries = list()
+    for blob_label in labels:
+        start, stop = np.searchsorted(sorted_labels, blob_label, 'left'),\
+            np.searchsorted(sorted_labels, blob_label, 'right')
+        if start == stop:
+            boundaries.append(None)
+            continue
+
+        points = np.transpose(boundary_index[:, order[start:stop]])
+        boundaries.append(_close_contour(points.astype(np.float64)))
+
+    return boundaries
+
+
+def hull_cycle(points):
+    """
+    Returns the points on the convex hull in counter clockwise order,
+    starting at the lexicographically smallest point and without collinear
+    points, i.e. in the order of a Graham scan. Degenerate point sets give
+    their extreme points. For 3D points, the hull of the first two
+    coordinates is used.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.shape[0] == 0:
+        return points
+
+    unique = np.unique(points, axis=0)
+    if unique.shape[0] < 3:
+        return unique
+
+    # All points collinear: only the extremes remain
+    direction = unique[-1, 0:2] - unique[0, 0:2]
+    cross = direction[0] * (unique[:, 1] - unique[0, 1]) -\
+        direction[1] * (unique[:, 0] - unique[0, 0])
+    if not np.any(cross):
+        return unique[[0, -1], :]
+
+    # Vertices of a 2D hull are in counter clockwise order
+    vertices = unique[ConvexHull(unique[:, 0:2]).vertices]
+    start = np.lexsort(vertices.T[::-1])[0]
+    return np.roll(vertices, -start, axis=0)
+
+
+def _unique_rows(total):
+    # Remove duplicate points. NOTE: sort_points does not order points at the
+    # same angle, so the order of the set is kept for reproducible features
+    return np.vstack(list({tuple(row) for row in total.tolist()}))
 
 
 def convex_hull_points(points):
-    # Graham scan
-    """Returns points on convex hull of an array of points in CCW order.
-    Uses Graham Scan"""
-    points = sorted(points.tolist())
-    l = reduce(_keep_left, points, [])
-    u = reduce(_keep_left, reversed(points), [])
-    total = l.extend(u[i] for i in xrange(1, len(u) - 1)) or l
-    total = np.asarray(total)
-    total = np.vstack({tuple(row) for row in total})
+    """Returns points on convex hull of an array of points in CCW order."""
+    total = hull_cycle(points)
+    total = _unique_rows(total)
     total = sort_points(total)
     total = np.append(total, total[0:1], 0)
     return total
 
 
 def convex_hull(contour):
-    """Returns points on convex hull for contour, uses Graham Scan """
+    """Returns points on convex hull for contour """
     points = get_contour_boundary_points(contour)
     total = convex_hull_points(points)
     return total
@@ -139,8 +241,8 @@ def convex_hull(contour):
 def local_convex_hull_points(points, N_min, N_max):
     """Find local convex points, can be used for smoothing boundary"""
     N_points = points.shape[0]
-    points = points.tolist()
-    points = sorted(points)
+    order = np.lexsort(points.T[::-1])
+    points = points[order, :]
     total = list()
 
     if N_points < N_min:
@@ -166,12 +268,9 @@ def local_convex_hull_points(points, N_min, N_max):
             temp_points = points[i*N_points_segment:-1]
         else:
             temp_points = points[i*N_points_segment:(i+1)*N_points_segment]
-        l = reduce(_keep_left, temp_points, [])
-        u = reduce(_keep_left, reversed(temp_points), [])
-        l.extend(u[i] for i in xrange(1, len(u) - 1)) or l
-        total.extend(l)
-    total = np.asarray(total)
-    total = np.vstack({tuple(row) for row in total})
+        total.append(hull_cycle(temp_points))
+    total = np.concatenate(total)
+    total = _unique_rows(total)
     total = sort_points(total)
     total = np.append(total, total[0:1], 0)
 
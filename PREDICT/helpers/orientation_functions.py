@@ -18,32 +18,57 @@
 import numpy as np
 
 
+def _sector_means(data, sectors, N_sectors):
+    """
+    Mean of the points per sector, for the sectors containing points, in the
+    order of the sector index. Points with a negative sector are ignored.
+    """
+    valid = sectors >= 0
+    sectors = sectors[valid]
+    data = data[valid]
+
+    counts = np.bincount(sectors, minlength=N_sectors)
+    sums = np.array([np.bincount(sectors, weights=data[:, i],
+                                 minlength=N_sectors)
+                     for i in range(data.shape[1])]).T
+
+    occupied = counts > 0
+    return sums[occupied] / counts[occupied, np.newaxis]
+
+
+def _digitize(values, bins):
+    """
+    Index of the bin containing each value, in which bin i contains the values
+    bins[i] <= value < bins[i + 1]. Values outside the bins give -1.
+    """
+    index = np.digitize(values, bins) - 1
+    index[(index < 0) | (index >= len(bins) - 1)] = -1
+    return index
+
+
 def data_regularize(data, type="spheric", divs = 10):
+    """
+    Regularize a point cloud by replacing the points in each sector of a
+    cubic or spherical grid by their mean.
+    """
+    data = np.asarray(data, dtype=np.float64)
     limits = np.array([
         [min(data[:,0]), max(data[:,0])],
         [min(data[:,1]), max(data[:,1])],
         [min(data[:,2]), max(data[:,2])]])
 
-    regularized = []
-
     if type=="cubic":
 
         X = np.linspace(*limits[0], num = divs)
         Y = np.linspace(*limits[1], num = divs)
         Z = np.linspace(*limits[2], num = divs)
 
-        for i in xrange(divs-1):
-            for j in xrange(divs-1):
-                for k in xrange(divs-1):
-                    points_in_sector = []
-                    for point in data:
-                        if (point[0] >= X[i] and point[0] < X[i+1] and
-                            point[1] >= Y[j] and point[1] < Y[j+1] and
-                            point[2] >= Z[k] and point[2] < Z[k+1]) :
+        index = [_digitize(data[:, i], bins) for i, bins in enumerate([X, Y, Z])]
+        N = divs - 1
+        sectors = (index[0] * N + index[1]) * N + index[2]
+        sectors[(index[0] < 0) | (index[1] < 0) | (index[2] < 0)] = -1
 
-                            points_in_sector.append(point)
-                    if len(points_in_sector) > 0:
-                        regularized.append(np.mean(np.array(points_in_sector), axis=0))
+        return _sector_means(data, sectors, N**3)
 
     elif type=="spheric" :
         divs_u = divs
@@ -57,27 +82,23 @@ def data_regularize(data, type="spheric", divs = 10):
 
         #spherical coordinates around center
         r_s = np.sqrt(d_c[:,0]**2. + d_c[:,1]**2. + d_c[:,2]**2.)
-        d_s = np.array([
-            r_s,
-            np.arccos(d_c[:,2] / r_s),
-            np.arctan2(d_c[:,1], d_c[:,0])]).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d_s = np.array([
+                r_s,
+                np.arccos(d_c[:,2] / r_s),
+                np.arctan2(d_c[:,1], d_c[:,0])]).T
 
         u = np.linspace(0, np.pi, num = divs_u)
         v = np.linspace(-np.pi, np.pi, num = divs_v)
 
-        for i in xrange(divs_u - 1):
-            for j in xrange(divs_v - 1):
-                points_in_sector = []
-                for k , point in enumerate(d_s):
-                    if (point[1] >= u[i] and point[1] < u[i+1] and
-                        point[2] >= v[j] and point[2] < v[j+1]) :
-
-                        points_in_sector.append(data[k])
+        index_u = _digitize(d_s[:, 1], u)
+        index_v = _digitize(d_s[:, 2], v)
+        sectors = index_u * (divs_v - 1) + index_v
+        sectors[(index_u < 0) | (index_v < 0)] = -1
 
-                if len(points_in_sector) > 0:
-                    regularized.append(np.mean(np.array(points_in_sector), axis=0))
+        return _sector_means(data, sectors, (divs_u - 1) * (divs_v - 1))
 
-    return np.array(regularized)
+    return np.array([])
 
 
 # https://github.com/minillinim/ellipsoid
@@ -92,8 +113,8 @@ def ellipsoid_plot(center, radii, rotation, ax, plotAxes=False, cageColor='b', c
     y = radii[1] * np.outer(np.sin(u), np.sin(v))
     z = radii[2] * np.outer(np.ones_like(u), np.cos(v))
     # rotate accordingly
-    for i in xrange(len(x)):
-        for j in xrange(len(x)):
+    for i in range(len(x)):
+        for j in range(len(x)):
             [x[i,j],y[i,j],z[i,j]] = np.dot([x[i,j],y[i,j],z[i,j]], rotation) + center
 
     if plotAxes:
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2018 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import argparse
+import threading
+import contextlib
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def get_cpu_time():
+    '''
+    Return the user plus system CPU time of the current process in seconds.
+    Note that this includes the CPU time of all threads of the process.
+    '''
+    times = os.times()
+    return times[0] + times[1]
+
+
+def get_peak_rss():
+    '''
+    Return the peak resident set size (RSS) of the current process in
+    megabytes, or None if this cannot be determined. Note that this is the
+    high-water mark over the lifetime of the process, not the current usage.
+    '''
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    if os.uname()[0] == 'Darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def count_voxels(args):
+    '''
+    Return the number of voxels of the first numpy array in the arguments,
+    i.e. the number of voxels which are processed by a feature group.
+    '''
+    for arg in args:
+        if isinstance(arg, np.ndarray):
+            return int(arg.size)
+    return None
+
+
+def get_rss_increase(start_rss):
+    '''
+    Return how much the peak RSS of the process increased since start_rss,
+    in megabytes, or None if this cannot be determined.
+    '''
+    peak_rss = get_peak_rss()
+    if peak_rss is None or start_rss is None:
+        return None
+    return peak_rss - start_rss
+
+
+def make_event(name, category, start_wall, start_cpu, start_rss,
+               voxels=None):
+    '''
+    Create an event in the Chrome trace format, see
+    https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+
+    The memory usage is recorded as peak_rss_increase: the amount in
+    megabytes by which the event raised the peak RSS of the process, given
+    the peak RSS start_rss at the start of the event. This is zero if the
+    event used less memory than was used before in the same process, so it
+    is a lower bound of the memory used by the event. Events running
+    concurrently in threads of the same process share this peak.
+    '''
+    end_wall = time.time()
+    event = {'name': name,
+             'cat': category,
+             'ph': 'X',
+             'ts': int(start_wall * 1e6),
+             'dur': int((end_wall - start_wall) * 1e6),
+             'pid': os.getpid(),
+             'tid': threading.current_thread().ident,
+             'args': {'wall_time': end_wall - start_wall,
+                      'cpu_time': get_cpu_time() - start_cpu,
+                      'peak_rss_increase': get_rss_increase(start_rss),
+                      'voxels': voxels}}
+    return event
+
+
+def trace_call(name, function, args=(), kwargs=None, category='feature',
+               voxels=None):
+    '''
+    Call a function and measure the wall time, CPU time and the increase of
+    the peak memory usage, see make_event. Returns both the output of the
+    function and the trace event, so it can be used in worker processes of
+    which the events are gathered afterwards.
+    '''
+    if kwargs is None:
+        kwargs = dict()
+
+    if voxels is None:
+        voxels = count_voxels(args)
+
+    start_wall = time.time()
+    start_cpu = get_cpu_time()
+    start_rss = get_peak_rss()
+    output = function(*args, **kwargs)
+    event = make_event(name, category, start_wall, start_cpu, start_rss,
+                       voxels)
+    return output, event
+
+
+class Tracer(object):
+    '''
+    Collect trace events of the feature extraction, which can be written to
+    a file in the Chrome trace format and inspected in chrome://tracing.
+
+    Parameters
+    ----------
+    enabled: boolean, default True
+            If False, no events are recorded and nothing is written.
+
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = list()
+
+    @contextlib.contextmanager
+    def trace(self, name, category='feature', voxels=None):
+        '''
+        Context manager recording an event for the enclosed code.
+        '''
+        if not self.enabled:
+            yield
+            return
+
+        start_wall = time.time()
+        start_cpu = get_cpu_time()
+        start_rss = get_peak_rss()
+        try:
+            yield
+        finally:
+            self.add(make_event(name, category, start_wall, start_cpu,
+                                start_rss, voxels))
+
+    def call(self, name, function, args=(), kwargs=None, category='feature',
+             voxels=None):
+        '''
+        Call a function and record an event for it.
+        '''
+        if not self.enabled:
+            if kwargs is None:
+                kwargs = dict()
+            return function(*args, **kwargs)
+
+        output, event = trace_call(name, function, args, kwargs, category,
+                                   voxels)
+        self.add(event)
+        return output
+
+    def add(self, event):
+        if self.enabled and event is not None:
+            self.events.append(event)
+
+    def write(self, filename):
+        '''
+        Write the events to a JSON file in the Chrome trace format.
+        '''
+        if not self.enabled:
+            return
+
+        with open(filename, 'w') as fp:
+            json.dump({'traceEvents': self.events,
+                       'displayTimeUnit': 'ms'}, fp, indent=1)
+
+
+def load_trace(filename):
+    '''
+    Load the events from a trace file.
+    '''
+    with open(filename, 'r') as fp:
+        data = json.load(fp)
+
+    if isinstance(data, dict):
+        return data['traceEvents']
+    return data
+
+
+def summarize_traces(trace_files, output=None):
+    '''
+    Summarize the traces of a cohort per event name, i.e. per feature group.
+
+    Parameters
+    ----------
+    trace_files: list, mandatory
+            Paths to the trace files, e.g. one per patient.
+
+    output: string, optional
+            Path to a JSON file to which the summary is written.
+
+    Returns
+    ----------
+    summary: dictionary
+            Contains per event name the number of calls, the total and mean
+            wall and CPU time in seconds, the maximum increase of the peak
+            RSS in megabytes (see make_event) and the total number of voxels.
+
+    '''
+    summary = dict()
+    for trace_file in trace_files:
+        for event in load_trace(trace_file):
+            args = event.get('args', dict())
+            name = event['name']
+            if name not in summary.keys():
+                summary[name] = {'category': event.get('cat'),
+                                 'count': 0,
+                                 'wall_time': 0.0,
+                                 'cpu_time': 0.0,
+                                 'peak_rss_increase': None,
+                                 'voxels': 0}
+
+            entry = summary[name]
+            entry['count'] += 1
+            entry['wall_time'] += args.get('wall_time', event.get('dur', 0) / 1e6)
+            entry['cpu_time'] += args.get('cpu_time') or 0.0
+            if args.get('peak_rss_increase') is not None:
+                entry['peak_rss_increase'] = max(entry['peak_rss_increase'] or 0.0,
+                                                 args['peak_rss_increase'])
+            entry['voxels'] += args.get('voxels') or 0
+
+    for entry in summary.values():
+        entry['wall_time_mean'] = entry['wall_time'] / entry['count']
+        entry['cpu_time_mean'] = entry['cpu_time'] / entry['count']
+
+    if output is not None:
+        with open(output, 'w') as fp:
+            json.dump(summary, fp, indent=1, sort_keys=True)
+
+    return summary
+
+
+def print_summary(summary):
+    names = sorted(summary.keys(), key=lambda n: -summary[n]['wall_time'])
+    print(('{:<30} {:>6} {:>12} {:>12} {:>12}').format('Name', 'Count',
+                                                        'Wall [s]',
+                                                        'CPU [s]',
+                                                        'dRSS [MB]'))
+    for name in names:
+        entry = summary[name]
+        peak_rss = entry['peak_rss_increase'] if entry['peak_rss_increase'] is not None else float('nan')
+        print(('{:<30} {:>6} {:>12.3f} {:>12.3f} {:>12.1f}').format(name,
+                                                                 entry['count'],
+                                                                 entry['wall_time'],
+                                                                 entry['cpu_time'],
+                                                                 peak_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize feature extraction traces')
+    parser.add_argument('-traces', '--traces', metavar='traces',
+                        nargs='+', dest='traces', type=str, required=True,
+                        help='Trace files (JSON)')
+    parser.add_argument('-output', '--output', metavar='output',
+                        dest='output', type=str, required=False,
+                        help='Output file for the summary (JSON)')
+    args = parser.parse_args()
+
+    summary = summarize_traces(args.traces, args.output)
+    print_summary(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2018 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import SimpleITK as sitk
+import PREDICT.helpers.sitk_helper as sitkh
+import PREDICT.helpers.image_helper as ih
+
+# Default margin in voxels around the ROI, which should be large enough to
+# cover the support of the filters used in the feature extraction.
+ROI_MARGIN = 40
+
+
+class ROIContext(object):
+    '''
+    Context of a single ROI, which crops the image and mask once to the
+    bounding box of the mask plus a margin and holds the derived arrays which
+    are shared by the feature extraction modules.
+
+    All arrays are in the x, y, z order of sitk_helper.GetArrayFromImage.
+
+    Parameters
+    ----------
+    image: ITK Image or numpy array, optional
+            Image from which the features are extracted. Can be None, e.g.
+            for DTI images, in which case only the mask is cropped.
+
+    mask: ITK Image or numpy array, mandatory
+            ROI to be used for feature extraction.
+
+    margin: integer, default ROI_MARGIN
+            Margin in voxels which is added to the bounding box of the mask
+            in each dimension, to provide support for the filters. If None or
+            negative, the full image is used.
+
+    offset: tuple, optional
+            If the image and mask are a region of a larger image, e.g. read
+            with file_io.read_image_region, the index of the first voxel of
+            that region in the larger image.
+
+    Attributes
+    ----------
+    image: numpy array
+            Cropped image.
+
+    mask: numpy array
+            Cropped mask, with the original values.
+
+    bbox: tuple
+            Slices of the cropped region in the full arrays.
+
+    masked_voxels: numpy array
+            1D array of the image voxels within the mask.
+
+    indices: numpy array
+            Flat indices of the mask voxels in the cropped arrays.
+
+    mask_slices: numpy array
+            Boolean array denoting which axial slices of the cropped arrays
+            contain non-zero mask voxels.
+
+    slice_range: tuple
+            First and last index of the axial slices containing mask voxels.
+
+    masked_slices_image, masked_slices_mask: numpy array
+            Cropped image and boolean mask, restricted to the axial slices
+            containing mask voxels.
+
+    shape_mask: numpy array
+            Mask restricted to the axial slices used for the shape features.
+
+    '''
+    def __init__(self, image, mask, margin=ROI_MARGIN, offset=None):
+        self.spacing = None
+        if isinstance(mask, sitk.Image):
+            self.spacing = mask.GetSpacing()
+            mask = sitkh.GetArrayFromImage(mask)
+
+        if isinstance(image, sitk.Image):
+            self.spacing = image.GetSpacing()
+            image = sitkh.GetArrayFromImage(image)
+
+        self.full_shape = mask.shape
+        self.margin = margin
+        self.offset = offset
+        self.bbox = self.get_bbox(mask, margin)
+
+        self.mask = mask[self.bbox]
+        mask_bool = self.mask.astype(np.bool)
+        self.indices = np.flatnonzero(mask_bool)
+
+        if image is not None:
+            self.image = image[self.bbox]
+            self.masked_voxels = self.image.ravel()[self.indices]
+        else:
+            self.image = None
+            self.masked_voxels = None
+
+        # Axial slices containing the mask
+        self.mask_slices = np.any(mask_bool, axis=(0, 1))
+        slice_indices = np.flatnonzero(self.mask_slices)
+        if slice_indices.size > 0:
+            self.slice_range = (slice_indices[0], slice_indices[-1])
+        else:
+            self.slice_range = (0, self.mask.shape[2] - 1)
+
+        if self.image is not None:
+            self.masked_slices_image, self.masked_slices_mask =\
+                ih.get_masked_slices_image(self.image, self.mask)
+        else:
+            self.masked_slices_image = None
+            self.masked_slices_mask = mask_bool[:, :, self.mask_slices]
+
+        # NOTE: to stay consistent with ih.get_masked_slices_mask, the last
+        # slice is excluded if the mask spans multiple slices.
+        first, last = self.slice_range
+        if first == last:
+            self.shape_mask = self.mask[:, :, first:first + 1]
+        else:
+            self.shape_mask = self.mask[:, :, first:last]
+
+    @staticmethod
+    def get_bbox(mask, margin=ROI_MARGIN):
+        '''
+        Get the bounding box of the non-zero elements in the mask plus a
+        margin, clipped to the size of the mask, as a tuple of slices.
+        '''
+        full = tuple([slice(0, s) for s in mask.shape])
+        if margin is None or margin < 0:
+            return full
+
+        nonzeros = np.nonzero(mask)
+        if nonzeros[0].size == 0:
+            print("[PREDICT Warning] Empty mask, using the full image.")
+            return full
+
+        bbox = list()
+        for axis, size in enumerate(mask.shape):
+            start = max(int(np.min(nonzeros[axis])) - margin, 0)
+            stop = min(int(np.max(nonzeros[axis])) + margin + 1, size)
+            bbox.append(slice(start, stop))
+
+        return tuple(bbox)
+
+    def get_origin(self):
+        '''
+        Get the index of the first voxel of the cropped region in the full
+        arrays, or in the larger image if an offset is given.
+        '''
+        if self.offset is None:
+            return tuple([s.start for s in self.bbox])
+
+        return tuple([s.start + o for s, o in zip(self.bbox, self.offset)])
@@ -16,11 +16,111 @@
 # limitations under the License.
 
 import numpy as np
-import itertools
-from skimage.feature import greycomatrix
-from scipy.stats import entropy
-import SimpleITK as sitk
-import os
+import scipy.ndimage as ndi
+from numpy.lib.stride_tricks import as_strided
+
+
+def get_dominant_orientations(gradient_x, gradient_y, window_size):
+    '''
+    Compute the dominant gradient orientation in a window around each pixel
+    of each axial slice, i.e. the orientation of the first principal
+    component of the gradient vectors in the window. This is the orientation
+    of the dominant eigenvector of the structure tensor, which is computed
+    in closed form from the window averages of the gradient products.
+
+    Boundary pixels are replicated, so the gradients should be cropped to
+    the region of interest.
+
+    Returns the orientations in radians, in the range [-pi/2, pi/2].
+    '''
+    size = (window_size, window_size, 1)
+    J_xx = ndi.uniform_filter(gradient_x * gradient_x, size, mode='nearest')
+    J_yy = ndi.uniform_filter(gradient_y * gradient_y, size, mode='nearest')
+    J_xy = ndi.uniform_filter(gradient_x * gradient_y, size, mode='nearest')
+
+    return 0.5 * np.arctan2(2 * J_xy, J_xx - J_yy)
+
+
+def discretize_orientations(theta, omega=64):
+    '''
+    Rescale the orientations of each axial slice linearly to the range
+    [0, omega - 1] and round them to integers.
+    '''
+    theta_min = np.min(theta, axis=(0, 1), keepdims=True)
+    theta_range = np.max(theta, axis=(0, 1), keepdims=True) - theta_min
+    theta_range[theta_range == 0] = np.inf
+
+    theta = (theta - theta_min) * (omega - 1) / theta_range
+    return np.round(theta).astype(np.int64)
+
+
+def _round_away(value):
+    # Round half away from zero, as done by greycomatrix
+    return int(np.sign(value) * np.floor(np.abs(value) + 0.5))
+
+
+def get_local_entropies(theta, window_size, distance, angle, omega=64):
+    '''
+    Compute the entropy of the co-occurrence matrix of the discretized
+    orientations in a window around each pixel of a 2D slice.
+
+    The window of a pixel x spans x - window_size / 2 up to, but not
+    including, x + window_size / 2 in each dimension, clipped to the slice.
+    Co-occurrences are counted at the offset given by the distance and angle
+    as in greycomatrix. Windows without co-occurrences get an entropy of
+    zero.
+    '''
+    half = window_size // 2
+    d_row = _round_away(np.sin(angle) * distance)
+    d_col = _round_away(np.cos(angle) * distance)
+    N_rows, N_cols = theta.shape
+
+    # Pad with a sentinel, so clipping the windows to the slice is
+    # equivalent to ignoring pairs with a sentinel pixel
+    pad = half + max(abs(d_row), abs(d_col))
+    padded = np.full([N_rows + 2 * pad, N_cols + 2 * pad], -1, dtype=np.int64)
+    padded[pad:pad + N_rows, pad:pad + N_cols] = theta
+
+    # Co-occurrence code of each pixel and the pixel at the offset
+    first = padded[max(0, -d_row):padded.shape[0] - max(0, d_row),
+                   max(0, -d_col):padded.shape[1] - max(0, d_col)]
+    second = padded[max(0, d_row):padded.shape[0] + min(0, d_row),
+                    max(0, d_col):padded.shape[1] + min(0, d_col)]
+    codes = np.where((first >= 0) & (second >= 0), first * omega + second, -1)
+
+    # Position of the pixel pairs within a window which lie fully inside it
+    window = 2 * half
+    rows = (max(0, -d_row), min(window, window - d_row))
+    cols = (max(0, -d_col), min(window, window - d_col))
+    if rows[1] <= rows[0] or cols[1] <= cols[0]:
+        return np.zeros(theta.shape)
+
+    # Start of the window of each pixel in the code array
+    start_row = pad - half - max(0, -d_row) + rows[0]
+    start_col = pad - half - max(0, -d_col) + cols[0]
+    codes = np.ascontiguousarray(codes[start_row:, start_col:])
+    pairs_shape = (rows[1] - rows[0], cols[1] - cols[0])
+    windows = as_strided(codes,
+                         shape=(N_rows, N_cols) + pairs_shape,
+                         strides=codes.strides + codes.strides)
+    windows = windows.reshape(N_rows * N_cols, -1)
+
+    # Count the co-occurrences per window
+    N_windows = windows.shape[0]
+    keys = np.arange(N_windows)[:, np.newaxis] * omega**2 + windows
+    keys = keys[windows >= 0]
+    unique_keys, counts = np.unique(keys, return_counts=True)
+    window_index = unique_keys // omega**2
+
+    # Entropy of the normalized counts: log(n) - sum(c log c) / n
+    n = np.bincount(window_index, weights=counts, minlength=N_windows)
+    clogc = np.bincount(window_index, weights=counts * np.log(counts),
+                        minlength=N_windows)
+    entropies = np.zeros(N_windows)
+    nonzero = n > 0
+    entropies[nonzero] = np.log(n[nonzero]) - clogc[nonzero] / n[nonzero]
+
+    return entropies.reshape(N_rows, N_cols)
 
 
 def get_coliage_features(image, mask):
@@ -31,14 +131,9 @@ def get_coliage_features(image, mask):
     Gradient Orientations (CoLlAGe): A
     new radiomics descriptor, Nature Scientific Reports.
 
+    The dominant orientations are computed once per window size for all
+    pixels, as they do not depend on the number of histogram bins.
     '''
-    # Make sure numpy uses only a single core in the svd
-    os.environ["MKL_NUM_THREADS"] = '1'
-    os.environ["NUMEXPR_NUM_THREADS"] = '1'
-    os.environ["OMP_NUM_THREADS"] = '1'
-    os.environ["OPENBLAS_NUM_THREADS"] = '1'
-    os.environ["GOTO_NUM_THREADS"] = '1'
-
     coliage_features = list()
     coliage_labels = list()
 
@@ -46,17 +141,15 @@ def get_coliage_features(image, mask):
 
     # TODO: Move to WORC
     # Should be optimized on training: from Prasanna et al. 2016
-    nbins = [10, 20, 30]
-    window_size = [7, 11]
+    # The features are ordered as in previous versions, which iterated over
+    # dictionaries keyed on these settings as strings on Python 2. Features
+    # are stacked by position, so this order should not change.
+    nbins = [10, 30, 20]
+    window_size = [11, 7]
     omega = 64
     wsize = 1
     dist = 2
 
-    # Compute gradients
-    gradients = np.gradient(image)
-    gradient_x = gradients[0]
-    gradient_y = gradients[1]
-
     # Determine ROI around mask
     nonzeros = np.nonzero(mask)
     xmin = np.min(nonzeros[0])
@@ -64,93 +157,33 @@ def get_coliage_features(image, mask):
     ymin = np.min(nonzeros[1])
     ymax = np.max(nonzeros[1])
 
-    # Preallocate E
+    # Compute in plane gradients, with a margin for the central differences
+    xstart = max(xmin - 1, 0)
+    ystart = max(ymin - 1, 0)
+    image_ROI = image[xstart:xmax + 2, ystart:ymax + 2, :].astype(np.float64)
+    gradient_x, gradient_y = np.gradient(image_ROI, axis=(0, 1))
+    ROI = (slice(xmin - xstart, xmax - xstart + 1),
+           slice(ymin - ystart, ymax - ystart + 1))
+    gradient_x = gradient_x[ROI]
+    gradient_y = gradient_y[ROI]
+
     E = dict()
+    for N in window_size:
+        print(("Processing wsize {}.").format(str(N)))
+        theta = get_dominant_orientations(gradient_x, gradient_y, N)
+
+        # Exclude the last row and column of the ROI
+        theta = theta[0:xmax - xmin, 0:ymax - ymin, :]
+        theta = discretize_orientations(theta, omega)
+
+        E[N] = np.concatenate([get_local_entropies(theta[:, :, i_slice], N,
+                                                   N // dist, N // wsize,
+                                                   omega).ravel()
+                               for i_slice in range(0, N_slices)])
+
     for v in nbins:
-        E[str(v)] = dict()
-
-    for i_slice in range(0, N_slices):
-        print("Processing slice {} / {}.").format(str(i_slice), str(N_slices))
-        for v in nbins:
-            print("Processing nbins {}.").format(str(v))
-            for N in window_size:
-                print("Processing wsize {}.").format(str(N))
-                theta = np.zeros([xmax - xmin, ymax - ymin])
-                for c in itertools.product(range(xmin, xmax), range(ymin, ymax)):
-                    x = c[0]
-                    y = c[1]
-
-                    Fx = list()
-                    Fy = list()
-
-                    # Construct gradient vector for every pixel per cell
-                    for coord_N in itertools.product(range(x - N/2, x + N/2 + 1),
-                                                     range(y - N/2, y + N/2 + 1)):
-                        # NOTE: Not covered in paper how to treat boundary pixels!
-                        # If out of bounds, use boundary pixels
-                        xc = min(max(coord_N[0], xmin), xmax)
-                        yc = min(max(coord_N[1], ymin), ymax)
-
-                        # Append gradients
-                        Fx.append(gradient_x[xc, yc, i_slice])
-                        Fy.append(gradient_y[xc, yc, i_slice])
-
-                    # Store gradients in single matrix
-                    F = np.zeros([N**2, 2])
-                    F[:, 0] = np.asarray(Fx)
-                    F[:, 1] = np.asarray(Fy)
-
-                    # Get dominant gradient through SVM
-                    U, s, V = np.linalg.svd(F)
-                    theta[x - xmin, y - ymin] = np.arctan(V[1, 0]/V[0, 0])
-
-                # Discretize theta analogue to parsanna et al.
-                theta = sitk.GetImageFromArray(theta)
-                theta = sitk.RescaleIntensity(theta, 0, omega - 1)
-                theta = sitk.GetArrayFromImage(theta)
-                theta = np.round(theta).astype(int)
-
-                # theta = rescale_intensity(theta, out_range=(0, omega - 1))
-                # theta = theta.astype(np.uint8)
-
-                # Again, computations for each pixel
-                E_temp = np.zeros([xmax - xmin, ymax - ymin])
-                for c in itertools.product(range(0, theta.shape[0]), range(0, theta.shape[1])):
-                    x = c[0]
-                    y = c[1]
-
-                    # If out of bounds of mask, use boundary pixels
-                    xstart = max(x - N/2, 0)
-                    xend = min(x + N/2, theta.shape[0])
-                    ystart = max(y - N/2, 0)
-                    yend = min(y + N/2, theta.shape[1])
-
-                    theta_window = theta[xstart:xend, ystart:yend]
-                    # Compute gray level co-occurence matrix
-                    GLCM_matrix = greycomatrix(theta_window, [N/dist], [N/wsize],
-                                               levels=omega,
-                                               normed=True)
-
-                    # Compute entropy
-                    e = entropy(GLCM_matrix[:, :, 0, 0].flatten())
-                    if e == -np.inf:
-                        e = 1e-12
-                    E_temp[x, y] = e
-
-                # Create histogram
-                # E.extend(E_temp)
-                # histogram, bins = np.histogram(E, v)
-
-                if i_slice == 0:
-                    E[str(v)][str(N)] = E_temp.tolist()
-                else:
-                    E[str(v)][str(N)] += E_temp.tolist()
-
-    for v in E.keys():
-        E_nbins = E[v]
-        for N in E_nbins.keys():
-            E_ws = E_nbins[N]
-            histogram, bins = np.histogram(E_ws, int(v))
+        for N in window_size:
+            histogram, bins = np.histogram(E[N], v)
 
             for idx, value in enumerate(histogram):
                 coliage_features.append(value)
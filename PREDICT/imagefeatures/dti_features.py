@@ -16,33 +16,98 @@
 # limitations under the License.
 
 import numpy as np
-import scipy.stats
 
 import PREDICT.helpers.sitk_helper as sitkh
+import PREDICT.imagefeatures.histogram_features as hf
 
 
-def get_dti_features(image, mask, meta_data):
+def get_masked_voxels(image, mask):
+    '''
+    Get the voxels within the mask of each DTI volume, as an array of shape
+    (volumes, mask voxels).
+    '''
     i_mask_array = sitkh.GetArrayFromImage(mask)
     i_mask_array = i_mask_array.astype(np.bool)
     i_mask_array = i_mask_array.flatten()
 
-    array_list = list()
-
-    for i_dti in image:
+    voxels = None
+    for i_volume, i_dti in enumerate(image):
         i_dti = sitkh.GetArrayFromImage(i_dti).flatten()
         i_dti = i_dti[i_mask_array]
-        array_list.append(i_dti)
+        if voxels is None:
+            voxels = np.empty((len(image), i_dti.size), dtype=i_dti.dtype)
+        voxels[i_volume, :] = i_dti
+
+    return voxels
+
+
+def fit_ADC(voxels, b_values):
+    '''
+    Fit the ADC of each voxel with a least squares fit of the log of the
+    signal against the b-values. The normal equations of the fit are
+    accumulated per b-value, so only one b-value is processed at a time.
 
-    i_image_array = np.vstack(array_list)
+    Parameters
+    ----------
+    voxels: numpy array, mandatory
+            Array of shape (b-values, voxels) with the signal of each voxel.
 
+    b_values: list, mandatory
+            b-value of each row of the voxels.
+
+    Returns
+    ----------
+    ADC: numpy array
+            The ADC of each voxel in mm^2/s.
+
+    '''
     # Adjust such that everything is positive, needed for log
-    i_image_array = i_image_array + np.min(i_image_array) + 1
+    minimum = np.min(voxels)
+
+    # The design matrix has a row [b, 1] per b-value, so A^T A only depends
+    # on the b-values and A^T y is a sum over the b-values per voxel
+    b_values = np.asarray(b_values, dtype=np.float64)
+    n_b = float(b_values.size)
+    sum_b = np.sum(b_values)
+    sum_b2 = np.sum(b_values**2)
+
+    sum_y = np.zeros(voxels.shape[1])
+    sum_by = np.zeros(voxels.shape[1])
+    for b_value, block in zip(b_values, voxels):
+        log_signal = np.log(block + minimum + 1).astype(np.float64)
+        sum_y += log_signal
+        sum_by += b_value * log_signal
+
+    # Slope of the fit, which is minus the ADC
+    determinant = n_b * sum_b2 - sum_b**2
+    return -(n_b * sum_by - sum_b * sum_y) / determinant
+
+
+def get_dti_features(image, mask, meta_data):
+    '''
+    Compute statistics of the ADC within the mask.
+
+    Parameters
+    ----------
+    image: list or numpy array, mandatory
+            Either an ITK Image per b-value, or an array of shape (b-values,
+            mask voxels) with the masked voxels as returned by
+            file_io.load_DTI_voxels.
+
+    mask: ITK Image, mandatory
+            Mask of the ROI.
+
+    meta_data: dictionary, mandatory
+            Contains the b-values of the images.
+
+    '''
+    if isinstance(image, np.ndarray):
+        voxels = image
+    else:
+        voxels = get_masked_voxels(image, mask)
 
-    b_values = meta_data['b_values']
-    A = np.vstack([b_values, np.ones(len(b_values))]).T
-    # Do least squares fit and get the slope, which is the ADC
     # This will give us the ADC in mm^2/s
-    ADC_tumor_voxels = -np.linalg.lstsq(A, np.log(i_image_array))[0][0, :]
+    ADC_tumor_voxels = fit_ADC(voxels, meta_data['b_values'])
 
     ADC_mean = np.mean(ADC_tumor_voxels)
     ADC_std = np.std(ADC_tumor_voxels)
@@ -122,14 +187,14 @@ def get_dti_post_features(image, mask, meta_data):
 
 
 def get_statistical_moments(tumor_map):
-
-    min_val = np.percentile(tumor_map, 2)
-    max_val = np.percentile(tumor_map, 98)
-    mean_val = np.mean(tumor_map)
-    std_val = np.std(tumor_map)
-    median_val = np.std(tumor_map)
-    skew_val = scipy.stats.skew(tumor_map)
-    kurtosis_val = scipy.stats.kurtosis(tumor_map)
+    statistics = hf.get_statistics(tumor_map, [2, 98])
+    min_val, max_val = statistics['quantiles'][0]
+    mean_val = statistics['mean'][0]
+    std_val = statistics['std'][0]
+    # NOTE: the median has always been the std, kept for compatibility
+    median_val = std_val
+    skew_val = statistics['skewness'][0]
+    kurtosis_val = statistics['kurtosis'][0]
     range_val = max_val - min_val
 
     return min_val, max_val, mean_val, std_val, median_val, skew_val, kurtosis_val, range_val
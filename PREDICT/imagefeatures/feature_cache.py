@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2018 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import glob
+import hashlib
+import tempfile
+import numpy as np
+import SimpleITK as sitk
+
+# Fraction of the maximum size to which the cache is reduced when it is full,
+# so the cache folder is not scanned again on every next save
+EVICT_FRACTION = 0.9
+
+
+def get_version():
+    '''
+    Return the version of the installed PREDICT package, which is part of
+    every cache key so that an update of PREDICT invalidates the cache.
+    '''
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('PREDICT').version
+    except Exception:
+        return 'unknown'
+
+
+def hash_image(image):
+    '''
+    Compute a hash of the voxels and geometry of an ITK image or numpy array.
+    '''
+    sha = hashlib.sha1()
+    if isinstance(image, sitk.Image):
+        sha.update(str(image.GetSpacing()).encode('utf-8'))
+        sha.update(str(image.GetOrigin()).encode('utf-8'))
+        sha.update(str(image.GetDirection()).encode('utf-8'))
+        image = sitk.GetArrayFromImage(image)
+
+    image = np.ascontiguousarray(image)
+    sha.update(str(image.dtype).encode('utf-8'))
+    sha.update(str(image.shape).encode('utf-8'))
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+
+def _serialize(obj):
+    '''
+    Convert numpy objects in the settings to JSON serializable objects.
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def cached_compute(cache, group, settings, function, *args, **kwargs):
+    '''
+    Compute a feature group through the cache if a cache is given, otherwise
+    just call the function. The function should return two lists: the
+    feature values and the feature labels.
+    '''
+    if cache is None:
+        return function(*args, **kwargs)
+
+    return cache.compute(group, settings, function, *args, **kwargs)
+
+
+class FeatureCache(object):
+    '''
+    Persistent on-disk cache of feature groups. Each feature group is stored
+    in a separate JSON file, named after a hash of the image voxels, mask
+    voxels, the settings of that feature group and the PREDICT version. Hence
+    changing the settings of a single group only invalidates that group.
+
+    When the total size of the cache exceeds max_size, the least recently
+    used entries are removed. The size of the cache folder is determined once
+    and then kept up to date with the size of each saved entry, so the folder
+    is only scanned again when the limit is exceeded.
+
+    Parameters
+    ----------
+    cache_dir: string, mandatory
+            Folder in which the cached features are stored.
+
+    max_size: float, default 1000
+            Maximum size of the cache in megabytes. If None, the size is not
+            limited.
+
+    '''
+    def __init__(self, cache_dir, max_size=1000):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.version = get_version()
+        self.hits = dict()
+        self.misses = dict()
+
+        # Running total of the size of the cache in bytes, None if unknown
+        self.size = None
+
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # Created in the meantime by another process
+                pass
+
+    def bind(self, image, mask):
+        '''
+        Return a cache bound to a specific image and mask, to be used in the
+        feature computation of a single patient.
+        '''
+        if isinstance(image, list):
+            image_hash = hashlib.sha1(''.join([hash_image(i) for i in image]).encode('utf-8')).hexdigest()
+        else:
+            image_hash = hash_image(image)
+
+        return BoundFeatureCache(self, image_hash, hash_image(mask))
+
+    def get_key(self, image_hash, mask_hash, group, settings):
+        sha = hashlib.sha1()
+        sha.update(image_hash.encode('utf-8'))
+        sha.update(mask_hash.encode('utf-8'))
+        sha.update(group.encode('utf-8'))
+        sha.update(json.dumps(settings, sort_keys=True,
+                              default=_serialize).encode('utf-8'))
+        sha.update(self.version.encode('utf-8'))
+        return sha.hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def load(self, key, group):
+        '''
+        Load a feature group from the cache. Returns None if not present.
+        '''
+        filename = self.get_filename(key)
+        try:
+            with open(filename, 'r') as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            self.misses[group] = self.misses.get(group, 0) + 1
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        self.hits[group] = self.hits.get(group, 0) + 1
+        return data['feature_values'], data['feature_labels']
+
+    def save(self, key, group, feature_values, feature_labels):
+        '''
+        Save a feature group to the cache. The file is first written to a
+        temporary file and then moved, so parallel workers never see partially
+        written entries.
+        '''
+        data = {'group': group,
+                'version': self.version,
+                'feature_values': [_serialize(v) if isinstance(v, (np.ndarray, np.generic)) else v for v in feature_values],
+                'feature_labels': [str(l) for l in feature_labels]}
+
+        data = json.dumps(data)
+
+        fd, tempname = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(data)
+        os.rename(tempname, self.get_filename(key))
+
+        if self.max_size is None:
+            return
+
+        if self.size is None:
+            # Determine the size of the cache folder once
+            self.evict()
+        else:
+            self.size += len(data)
+            if self.size > self.max_size * 1024 * 1024:
+                self.evict()
+
+    def evict(self):
+        '''
+        If the cache is larger than the maximum size, remove the least
+        recently used entries until it is smaller than EVICT_FRACTION times
+        the maximum size. This scans the full cache folder and resets the
+        running total of the cache size.
+        '''
+        if self.max_size is None:
+            return
+
+        entries = list()
+        total_size = 0
+        for filename in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+            total_size += stat.st_size
+
+        max_size = self.max_size * 1024 * 1024
+        if total_size > max_size:
+            max_size *= EVICT_FRACTION
+
+        for _, size, filename in sorted(entries):
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total_size -= size
+
+        self.size = total_size
+
+    def report(self):
+        '''
+        Return the number of hits and misses per feature group.
+        '''
+        groups = sorted(set(self.hits.keys()) | set(self.misses.keys()))
+        report = dict()
+        for group in groups:
+            report[group] = {'hits': self.hits.get(group, 0),
+                             'misses': self.misses.get(group, 0)}
+        return report
+
+    def print_report(self):
+        report = self.report()
+        hits = sum([r['hits'] for r in report.values()])
+        misses = sum([r['misses'] for r in report.values()])
+        print(('Feature cache: {} hits, {} misses.').format(str(hits), str(misses)))
+        for group in sorted(report.keys()):
+            print(('-   {}: {} hits, {} misses.').format(group, str(report[group]['hits']), str(report[group]['misses'])))
+
+
+class BoundFeatureCache(object):
+    '''
+    FeatureCache bound to the image and mask of a single patient.
+    '''
+    def __init__(self, cache, image_hash, mask_hash):
+        self.cache = cache
+        self.image_hash = image_hash
+        self.mask_hash = mask_hash
+
+    def lookup(self, group, settings):
+        '''
+        Load a feature group from the cache. Returns None if not present.
+        '''
+        key = self.cache.get_key(self.image_hash, self.mask_hash, group,
+                                 settings)
+        return self.cache.load(key, group)
+
+    def store(self, group, settings, feature_values, feature_labels):
+        '''
+        Store a computed feature group in the cache.
+        '''
+        key = self.cache.get_key(self.image_hash, self.mask_hash, group,
+                                 settings)
+        self.cache.save(key, group, feature_values, feature_labels)
+
+    def compute(self, group, settings, function, *args, **kwargs):
+        '''
+        Load the feature group from the cache, or compute it using the
+        function and store the result in the cache.
+        '''
+        cached = self.lookup(group, settings)
+        if cached is not None:
+            return cached
+
+        feature_values, feature_labels = function(*args, **kwargs)
+        self.store(group, settings, feature_values, feature_labels)
+        return feature_values, feature_labels
@@ -15,10 +15,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import numpy as np
 import pandas as pd
+import multiprocessing
+from joblib import Parallel, delayed
 
-import PREDICT.helpers.sitk_helper as sitkh
-import PREDICT.helpers.image_helper as ih
+from PREDICT.helpers.roi_context import ROIContext, ROI_MARGIN
+from PREDICT.helpers.profiling import Tracer, trace_call
 
 import PREDICT.imagefeatures.histogram_features as hf
 import PREDICT.imagefeatures.texture_features as tf
@@ -31,6 +35,7 @@ import PREDICT.imagefeatures.patient_features as pf
 import PREDICT.imagefeatures.log_features as logf
 import PREDICT.imagefeatures.vessel_features as vesf
 import PREDICT.imagefeatures.phase_features as phasef
+import PREDICT.imagefeatures.feature_cache as fcache
 import PREDICT.addexceptions as ae
 
 
@@ -57,6 +62,9 @@ def get_image_features(image_data, mask, parameters,
 
             The image should be a SimpleITK Image, the image type a string,
             the metadata a pydicom dicom type and the semantics a dictionary.
+            If only a region of the image was read, the dictionary contains
+            the index of the first voxel of that region in the full image
+            as a region field, see CalcFeatures.load_images.
 
 
     mask: ITK Image, mandatory
@@ -72,14 +80,16 @@ def get_image_features(image_data, mask, parameters,
             fields and their description.
 
     config_general: dictionary, mandatory
-            Configuration for general settings. Currently only configures
-            settings for the Joblib Parallel function. See the Github Wiki
-            for the possible fields and their description.
+            Configuration for general settings. Currently configures
+            settings for the Joblib Parallel function, the feature cache and
+            the tracing. See the Github Wiki for the possible fields and their
+            description.
 
     output: string, mandatory
             path referring to the .hdf5 file to which the output should be
             written for the CalcFeatures function. This field is used to match
-            the patient ID of the semantic features to this filename.
+            the patient ID of the semantic features to this filename. If
+            tracing is enabled, the trace is written next to this file.
 
 
     Returns
@@ -99,125 +109,265 @@ def get_image_features(image_data, mask, parameters,
         image_type = image_data['images'].keys()[0]
         meta_data = image_data['metadata']
         sem_data = image_data['semantics']
+        region = None
         image_data = image_data['images']
     else:
         # Dictionary
         image_type = image_data['image_type']
         meta_data = image_data['metadata']
         sem_data = image_data['semantics']
+        region = image_data.get('region')
         image_data = image_data['images']
 
-    # Initialize feature value and label lists.
-    feature_values = list()
-    feature_labels = list()
+    if config_general is None:
+        config_general = dict()
+
+    # Record the time and memory usage of the feature groups if required
+    tracer = Tracer(config_general.get('Trace', False))
+
+    # Crop the image and mask once to the ROI plus a margin for the filters.
+    # For DTI, the images are loaded by the DTI module itself.
+    with tracer.trace('roi', 'preprocessing'):
+        if 'DTI' in image_type:
+            roi = ROIContext(None, mask, config.get('roi_margin', ROI_MARGIN),
+                             region)
+        else:
+            roi = ROIContext(image_data, mask,
+                             config.get('roi_margin', ROI_MARGIN), region)
+
+    # Initialize the feature cache, which is bound to this image and mask
+    feature_cache = None
+    cache = None
+    if config_general.get('FeatureCache'):
+        feature_cache = fcache.FeatureCache(config_general['FeatureCache'],
+                                            config_general.get('FeatureCacheSize'))
+        if roi.image is not None:
+            cache = feature_cache.bind(roi.image, roi.mask)
+        else:
+            cache = feature_cache.bind(image_data, mask)
+
+    # Construct the list of feature groups to compute. Each task is a tuple
+    # containing the group name, the settings of the group, the function and
+    # its arguments and keyword arguments. Tasks without settings are not
+    # cached and computed directly, the others may be computed concurrently.
+    tasks = list()
 
     # Extract shape features
-    shape_mask = ih.get_masked_slices_mask(mask)
-
-    print("Computing shape features.")
-    shape_features, shape_labels = sf.get_shape_features(shape_mask,
-                                                         meta_data)
-    feature_values += shape_features
-    feature_labels += shape_labels
+    shape_settings = {'metadata': get_shape_metadata(meta_data)}
+    if parameters.get('shape', dict()).get('mode', '2D') == '3D':
+        # The mesh is created from the full cropped mask using the spacing
+        shape_settings.update({'mode': '3D', 'spacing': roi.spacing})
+        tasks.append(('shape', shape_settings, sf.get_shape_features,
+                      (roi.mask, meta_data),
+                      {'mode': '3D', 'spacing': roi.spacing}))
+    else:
+        tasks.append(('shape', shape_settings, sf.get_shape_features,
+                      (roi.shape_mask, meta_data), {'n_jobs': 1}))
 
     if config["orientation"]:
-        print("Computing orientation features.")
-        orientation_features, orientation_labels =\
-            of.get_orientation_features(shape_mask)
-        feature_values += orientation_features
-        feature_labels += orientation_labels
+        # NOTE: orientation features are computed in the z, y, x order,
+        # relative to the first slice of the shape mask
+        x0, y0, _ = roi.get_origin()
+        orientation_method = parameters.get('orientation', dict()).get('method', 'moments')
+        tasks.append(('orientation', {'method': orientation_method},
+                      of.get_orientation_features,
+                      (np.transpose(roi.shape_mask), (0, y0, x0)),
+                      {'method': orientation_method}))
 
     if meta_data is not None:
-        print("Extracting patient features.")
-        patient_features, patient_labels =\
-            pf.get_patient_features(meta_data, image_type)
-        feature_values += patient_features
-        feature_labels += patient_labels
+        tasks.append(('patient', None, pf.get_patient_features,
+                      (meta_data, image_type), {}))
 
     if sem_data is not None and output is not None:
-        print("Extracting semantic features.")
-        sem_features, sem_labels = semf.get_semantic_features(sem_data,
-                                                              output)
-        feature_values += sem_features
-        feature_labels += sem_labels
+        tasks.append(('semantic', None, semf.get_semantic_features,
+                      (sem_data, output), {}))
 
     if 'DTI_post' in image_type:
-        dti_features, dti_labels = dtif.get_dti_post_features(image_data,
-                                                              mask,
-                                                              meta_data)
-        feature_values += dti_features
-        feature_labels += dti_labels
+        tasks.append(('DTI_post', None, dtif.get_dti_post_features,
+                      (image_data, mask, meta_data), {}))
 
     elif 'DTI' in image_type:
-        dti_features, dti_labels = dtif.get_dti_features(image_data, mask,
-                                                         meta_data)
-        feature_values += dti_features
-        feature_labels += dti_labels
+        tasks.append(('DTI', None, dtif.get_dti_features,
+                      (image_data, mask, meta_data), {}))
 
     elif any(type in image_type for type in ['MR', 'CT', 'PET', 'MG']):
-        image_data_array = sitkh.GetArrayFromImage(image_data)
-        mask_array = sitkh.GetArrayFromImage(mask)
-
-        masked_voxels = ih.get_masked_voxels(image_data_array, mask_array)
-
-        print("Computing histogram features.")
-        histogram_features, histogram_labels =\
-            hf.get_histogram_features(masked_voxels,
-                                      N_BINS)
+        image_data_array = roi.masked_slices_image
+        mask_array = roi.masked_slices_mask
 
-        # NOTE: As a minimum of 4 voxels in each dimension is needed
-        # for the SimpleITK log filter, we compute these features
-        # on the full image
         if config["log"]:
-            print("Computing log features.")
-            log_features, log_labels =\
-                logf.get_log_features(image_data_array,
-                                      mask_array,
-                                      parameters['log'])
-            feature_values += log_features
-            feature_labels += log_labels
-
-        image_data_array, mask_array = ih.get_masked_slices_image(
-            image_data_array, mask_array)
-
-        print("Computing texture features.")
-        texture_features, texture_labels =\
-            tf.get_texture_features(image_data_array,
-                                    mask_array,
-                                    parameters,
-                                    config['texture'],
-                                    config_general)
-
-        feature_values += histogram_features + texture_features
-        feature_labels += histogram_labels + texture_labels
+            # The 3D LoG needs the neighbouring slices of the ROI as well
+            # and depends on the spacing
+            log_settings = parameters['log']
+            if parameters['log'].get('mode', '2D') == '3D':
+                log_arrays = (roi.image, roi.mask.astype(np.bool))
+                log_settings = dict(parameters['log'], spacing=roi.spacing)
+            else:
+                log_arrays = (image_data_array, mask_array)
+
+            tasks.append(('log', log_settings, logf.get_log_features,
+                          log_arrays + (parameters['log'],),
+                          {'spacing': roi.spacing, 'n_jobs': 1}))
+
+        tasks.append(('histogram', {'N_bins': N_BINS},
+                      hf.get_histogram_features, (roi.masked_voxels, N_BINS),
+                      {}))
+
+        tasks.extend(tf.get_texture_tasks(image_data_array, mask_array,
+                                          parameters, config['texture'],
+                                          config_general.get('Joblib_ncores'),
+                                          config_general.get('Joblib_backend')))
 
         if config["coliage"]:
-            print("Computing coliage features.")
-            coliage_features, coliage_labels =\
-                cf.get_coliage_features(image_data_array,
-                                        mask_array)
-            feature_values += coliage_features
-            feature_labels += coliage_labels
+            tasks.append(('coliage', {}, cf.get_coliage_features,
+                          (image_data_array, mask_array), {}))
 
         if config["vessel"]:
-            print("Computing vessel features.")
-            vessel_features, vessel_labels =\
-                vesf.get_vessel_features(image_data_array,
-                                         mask_array,
-                                         parameters['vessel'])
-            feature_values += vessel_features
-            feature_labels += vessel_labels
+            tasks.append(('vessel', parameters['vessel'],
+                          vesf.get_vessel_features,
+                          (image_data_array, mask_array, parameters['vessel']),
+                          {}))
 
         if config["phase"]:
-            print("Computing phase features.")
-            phase_features, phase_labels =\
-                phasef.get_phase_features(image_data_array,
-                                          mask_array,
-                                          parameters['phase'])
-            feature_values += phase_features
-            feature_labels += phase_labels
+            tasks.append(('phase', parameters['phase'],
+                          phasef.get_phase_features,
+                          (image_data_array, mask_array, parameters['phase']),
+                          {'n_jobs': 1}))
 
     else:
         raise ae.PREDICTTypeError(("Invalid image type: {}").format(image_type))
 
+    with tracer.trace('get_image_features', 'patient', roi.indices.size):
+        feature_values, feature_labels =\
+            compute_feature_tasks(tasks, cache,
+                                  config_general.get('Joblib_ncores'),
+                                  config_general.get('Joblib_backend'),
+                                  tracer)
+
+    if feature_cache is not None:
+        feature_cache.print_report()
+
+    if tracer.enabled and output is not None:
+        trace_file = os.path.splitext(output)[0] + '_trace.json'
+        print(("Writing trace to {}.").format(trace_file))
+        tracer.write(trace_file)
+
     return feature_values, feature_labels
+
+
+def compute_feature_tasks(tasks, cache=None, n_jobs=1, backend=None,
+                          tracer=None):
+    '''
+    Compute a list of feature groups. Groups which are independent are
+    computed concurrently using the Joblib Parallel function.
+
+    Parameters
+    ----------
+    tasks: list, mandatory
+            Contains a tuple per feature group with the group name, the
+            settings of the group, the function computing the features and
+            the arguments and keyword arguments to the function. Groups of
+            which the settings are None are not cached and computed directly.
+
+    cache: BoundFeatureCache, optional
+            Cache bound to the image and mask from which the features are
+            computed. See the feature_cache module.
+
+    n_jobs: integer, default 1
+            Total number of cores to be used. The cores are divided over the
+            feature groups: groups which can be parallelized internally, i.e.
+            which accept an n_jobs keyword argument, get the remaining cores.
+
+    backend: string, optional
+            Joblib backend to be used, e.g. threading or multiprocessing.
+
+    tracer: Tracer, optional
+            If given, the time and memory usage of each computed group is
+            recorded in the tracer. See the helpers.profiling module.
+
+    Returns
+    ----------
+    feature_values: list
+            Contains the values for all extracted features, in the order
+            of the tasks.
+
+    feature_labels: list
+            Contains the labels for all extracted features. Each entry
+            corresponds to the element with the same index from the
+            feature_values object.
+
+    '''
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        # Joblib convention: -1 means all cores, -2 all but one, etc.
+        n_jobs = max(1, multiprocessing.cpu_count() + 1 + n_jobs)
+
+    if tracer is None:
+        tracer = Tracer(enabled=False)
+
+    # First get all results which are directly available
+    results = [None] * len(tasks)
+    pending = list()
+    for i_task, (group, settings, function, args, kwargs) in enumerate(tasks):
+        if settings is None:
+            results[i_task], event =\
+                _compute_feature_task(group, function, args, kwargs,
+                                      tracer.enabled)
+            tracer.add(event)
+        elif cache is not None:
+            results[i_task] = cache.lookup(group, settings)
+
+        if results[i_task] is None:
+            pending.append(i_task)
+
+    # Divide the cores over the groups and within the groups
+    n_groups = max(1, min(n_jobs, len(pending)))
+    n_jobs_group = max(1, n_jobs // n_groups)
+    pending_tasks = list()
+    for i_task in pending:
+        group, settings, function, args, kwargs = tasks[i_task]
+        if 'n_jobs' in kwargs.keys():
+            kwargs = dict(kwargs)
+            kwargs['n_jobs'] = n_jobs_group
+        pending_tasks.append((group, function, args, kwargs, tracer.enabled))
+
+    if n_groups > 1:
+        computed = Parallel(n_jobs=n_groups, backend=backend)(
+            delayed(_compute_feature_task)(*task) for task in pending_tasks)
+    else:
+        computed = [_compute_feature_task(*task) for task in pending_tasks]
+
+    for i_task, (result, event) in zip(pending, computed):
+        results[i_task] = result
+        tracer.add(event)
+        group, settings = tasks[i_task][0:2]
+        if cache is not None:
+            cache.store(group, settings, result[0], result[1])
+
+    # Concatenate in the original order of the tasks
+    feature_values = list()
+    feature_labels = list()
+    for values, labels in results:
+        feature_values += list(values)
+        feature_labels += list(labels)
+
+    return feature_values, feature_labels
+
+
+def _compute_feature_task(group, function, args, kwargs, trace=False):
+    print(("Computing {} features.").format(group))
+    if trace:
+        return trace_call(group, function, args, kwargs)
+
+    return function(*args, **kwargs), None
+
+
+def get_shape_metadata(meta_data):
+    '''
+    Get the metadata fields used in the shape features, i.e. the pixel spacing
+    and slice thickness, which are part of the shape feature cache key.
+    '''
+    if meta_data is None or (0x18, 0x50) not in meta_data.keys():
+        return None
+
+    return [str(meta_data[0x28, 0x30].value), str(meta_data[0x18, 0x50].value)]
@@ -22,6 +22,176 @@ import scipy.stats
 import PREDICT.helpers.contour_functions as cf
 
 
+# Percentiles computed by the statistics kernel
+QUANTILES = [2, 25, 50, 75, 98]
+
+HISTOGRAM_LABELS = ['hf_min', 'hf_max', 'hf_mean', 'hf_median', 'hf_std',
+                    'hf_skewness', 'hf_kurtosis', 'hf_peak', 'hf_range',
+                    'hf_energy', 'hf_quartile_range', 'hf_entropy']
+
+
+def _lerp(a, b, t):
+    # Linear interpolation as done by np.percentile
+    return np.where(t >= 0.5, b - (b - a) * (1 - t), a + (b - a) * t)
+
+
+def get_statistics(data, quantiles=QUANTILES):
+    '''
+    Compute the statistics of one or more arrays in a fused kernel: a single
+    partition to select the minimum, maximum and all quantiles, and a single
+    pass for the central moments.
+
+    Parameters
+    ----------
+    data: numpy array, mandatory
+            1D array, or 2D array with a row per map, e.g. the masked voxels
+            of multiple filter responses.
+
+    quantiles: list, default QUANTILES
+            Percentiles to compute, using linear interpolation as
+            np.percentile.
+
+    Returns
+    ----------
+    statistics: dictionary
+            Contains the arrays min, max, mean, std, skewness and kurtosis
+            with a value per map, and quantiles with an array of shape
+            (maps, quantiles). The skewness and kurtosis are the biased
+            estimates of scipy.stats, which are zero and -3 respectively if
+            the variance is zero.
+
+    '''
+    data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+    N = data.shape[1]
+
+    # Select the minimum, maximum and the neighbours of each quantile at once
+    positions = np.asarray(quantiles, dtype=np.float64) / 100.0 * (N - 1)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.minimum(lower + 1, N - 1)
+    kth = np.unique(np.concatenate([[0, N - 1], lower, upper]))
+    partitioned = np.partition(data, kth, axis=1)
+
+    gamma = positions - lower
+    quantile_values = _lerp(partitioned[:, lower], partitioned[:, upper],
+                            gamma)
+
+    # Central moments
+    mean = np.mean(data, axis=1)
+    deviation = data - mean[:, np.newaxis]
+    deviation_2 = deviation * deviation
+    m2 = np.mean(deviation_2, axis=1)
+    m3 = np.mean(deviation_2 * deviation, axis=1)
+    m4 = np.mean(deviation_2 * deviation_2, axis=1)
+
+    zero = m2 == 0
+    m2_safe = np.where(zero, 1.0, m2)
+    skewness = np.where(zero, 0.0, m3 / m2_safe**1.5)
+    kurtosis = np.where(zero, 0.0, m4 / m2_safe**2) - 3.0
+
+    statistics = {'min': partitioned[:, 0],
+                  'max': partitioned[:, N - 1],
+                  'mean': mean,
+                  'std': np.sqrt(m2),
+                  'skewness': skewness,
+                  'kurtosis': kurtosis,
+                  'quantiles': quantile_values}
+
+    return statistics
+
+
+def create_histogram_batch(data, N_bins, minimum, maximum):
+    '''
+    Compute the histogram of each row of data with N_bins equal bins between
+    the minimum and maximum of that row, equal to np.histogram.
+    '''
+    data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+    N_maps = data.shape[0]
+
+    # As np.histogram, use a unit range around constant data
+    first_edge = np.where(minimum == maximum, minimum - 0.5, minimum)
+    last_edge = np.where(minimum == maximum, maximum + 0.5, maximum)
+
+    step = (last_edge - first_edge) / N_bins
+    bin_edges = np.arange(N_bins + 1) * step[:, np.newaxis] +\
+        first_edge[:, np.newaxis]
+    bin_edges[:, -1] = last_edge
+
+    norm = N_bins / (last_edge - first_edge)
+    indices = ((data - first_edge[:, np.newaxis]) * norm[:, np.newaxis]).astype(np.intp)
+    indices[indices == N_bins] -= 1
+
+    # Correct for rounding errors at the bin edges
+    rows = np.arange(N_maps)[:, np.newaxis] * (N_bins + 1)
+    flat_edges = bin_edges.ravel()
+    decrement = data < flat_edges[rows + indices]
+    indices[decrement] -= 1
+    increment = (data >= flat_edges[rows + indices + 1]) & (indices != N_bins - 1)
+    indices[increment] += 1
+
+    offsets = np.arange(N_maps)[:, np.newaxis] * N_bins
+    histograms = np.bincount((indices + offsets).ravel(),
+                             minlength=N_maps * N_bins)
+    return histograms.reshape(N_maps, N_bins), bin_edges
+
+
+def get_entropy_batch(histograms):
+    '''
+    Compute the entropy of each row of histograms, see get_entropy.
+    '''
+    epsilon = np.spacing(1)
+    sumhist = np.sum(histograms, axis=1).astype(np.float64)
+    hist = (histograms + epsilon) / np.where(sumhist == 0, 1,
+                                             sumhist)[:, np.newaxis]
+    entropy = -1.0 * np.sum(hist * np.log2(hist), axis=1)
+    entropy[sumhist == 0] = 0
+    return entropy
+
+
+def get_histogram_features_batch(data, N_bins):
+    '''
+    Compute the histogram features of multiple maps in a single call, e.g.
+    the masked voxels of the responses of a filter bank.
+
+    Parameters
+    ----------
+    data: numpy array, mandatory
+            2D array with a row per map, from which the features are
+            extracted.
+
+    N_bins: integer, mandatory
+            Number of bins to be used in histogram creation.
+
+    Returns
+    ----------
+    histogram_features: list
+            Contains for each map a list with the values of all features.
+
+    histogram_labels: list
+            Contains the labels of the features, see get_histogram_features.
+
+    '''
+    data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+    statistics = get_statistics(data, QUANTILES)
+    p2, p25, p50, p75, p98 = statistics['quantiles'].T
+
+    histograms, _ = create_histogram_batch(data, N_bins, statistics['min'],
+                                           statistics['max'])
+    peak = np.amax(histograms, axis=1)
+    entropy = get_entropy_batch(histograms)
+    energy = np.sum(np.square(data + statistics['min'][:, np.newaxis]),
+                    axis=1)
+
+    features = np.vstack([p2, p98, statistics['mean'], p50,
+                          statistics['std'], statistics['skewness'],
+                          statistics['kurtosis'], peak, p98 - p2, energy,
+                          p75 - p25, entropy]).T
+
+    histogram_labels = list(HISTOGRAM_LABELS)
+    histogram_features = features.tolist()
+
+    return histogram_features, histogram_labels
+
+
 def get_histogram_features(data, N_bins):
     '''
     Compute histogram or first order features.
@@ -45,30 +215,11 @@ def get_histogram_features(data, N_bins):
             histogram_features object.
 
     '''
-    temp_histogram, temp_bins = create_histogram(data, N_bins)
-    hist_min = get_min(data)
-    hist_max = get_max(data)
-    hist_mean = get_mean(data)
-    hist_median = get_median(data)
-    hist_std = get_std(data)
-    hist_skewness = get_skewness(data)
-    hist_kurtosis = get_kurtosis(data)
-    hist_range = get_range(data)
-    hist_peak = get_peak_position(temp_histogram, temp_bins)
-    energy = get_energy(data)
-    quartile_range = get_quartile_range(data)
-    entropy = get_entropy(temp_histogram)
-
-    histogram_labels = ['hf_min', 'hf_max', 'hf_mean', 'hf_median',
-                        'hf_std', 'hf_skewness', 'hf_kurtosis', 'hf_peak',
-                        'hf_range', 'hf_energy', 'hf_quartile_range',
-                        'hf_entropy']
-
-    histogram_features = [hist_min, hist_max, hist_mean, hist_median,
-                          hist_std, hist_skewness, hist_kurtosis, hist_peak,
-                          hist_range, energy, quartile_range, entropy]
+    data = np.asarray(data).ravel()
+    histogram_features, histogram_labels =\
+        get_histogram_features_batch(data[np.newaxis, :], N_bins)
 
-    return histogram_features, histogram_labels
+    return histogram_features[0], histogram_labels
 
 
 def create_histogram(data, bins):
@@ -121,6 +272,7 @@ def get_range(data):
 
 
 def get_energy(data):
+    data = np.asarray(data, dtype=np.float64)
     energy = np.sum(np.square(data + np.min(data)))
     return energy
 
@@ -17,15 +17,144 @@
 
 import PREDICT.imagefeatures.histogram_features as hf
 import PREDICT.helpers.image_helper as ih
-# import imagefeatures.histogram_features as hf
-# import PREIDCT.helpers.sitk_helper as sh
-import SimpleITK as sitk
+import PREDICT.addexceptions as ae
 import numpy as np
+import scipy.ndimage as ndi
+from joblib import Parallel, delayed
 
 N_BINS = 50
 
+# Modes of the LoG filter: per axial slice or on the full volume
+LOG_MODES = ['2D', '3D']
 
-def get_log_features(image, mask, parameters=dict()):
+# Minimum sigma increment in voxels to compute a LoG from the previous scale
+MIN_INCREMENT = 1.0
+
+
+def _laplacian_of_gaussian(image, sigma, spacing, axes):
+    '''
+    Compute the Laplacian of the image smoothed with a Gaussian with the
+    given standard deviation in voxels, in physical units given by the
+    spacing, summed over the given axes.
+    '''
+    LoG_image = np.zeros(image.shape)
+    for axis in axes:
+        order = [0] * image.ndim
+        order[axis] = 2
+        LoG_image += ndi.gaussian_filter(image, sigma, order=order,
+                                         mode='reflect') / spacing[axis]**2
+
+    return LoG_image
+
+
+def get_log_images(image, sigma, spacing=None, mode='2D', n_jobs=1):
+    '''
+    Compute the scale normalized Laplacian of Gaussian (LoG) images for all
+    sigmas in a single scale space pass.
+
+    The image is smoothed incrementally from the smallest to the largest
+    sigma, as smoothing with sigma_1 and then with
+    sqrt(sigma_2**2 - sigma_1**2) equals smoothing with sigma_2. The LoG of
+    each sigma is then computed from the previous smoothed image with this
+    small increment, which is done in parallel for all sigmas. If the
+    previous sigma or the increment is smaller than MIN_INCREMENT voxels on
+    any of the smoothed axes, the LoG of that sigma is computed directly
+    from the image.
+
+    Parameters
+    ----------
+    image: numpy array, mandatory
+            Image array in x, y, z order.
+
+    sigma: list, mandatory
+            Standard deviations of the Gaussian. In 2D mode, these are
+            given in pixels. In 3D mode, these are given in millimeters.
+
+    spacing: tuple, optional
+            Voxel spacing in x, y, z order, only used in 3D mode.
+
+    mode: string, default '2D'
+            In 2D mode, each axial slice is filtered separately. In 3D mode,
+            the full volume is filtered.
+
+    n_jobs: integer, default 1
+            Number of threads over which the sigmas are divided.
+
+    Returns
+    ----------
+    LoG_images: list
+            Contains the LoG image of each sigma.
+
+    '''
+    if mode not in LOG_MODES:
+        raise ae.PREDICTKeyError(('Unknown LoG mode {}, should be one of {}.').format(mode, LOG_MODES))
+
+    if mode == '3D':
+        if spacing is None:
+            spacing = (1.0, 1.0, 1.0)
+        spacing = np.asarray(spacing, dtype=np.float64)
+        axes = [0, 1, 2]
+    else:
+        spacing = np.ones(3)
+        axes = [0, 1]
+
+    def to_voxels(s):
+        voxels = s / spacing
+        if mode == '2D':
+            # Do not smooth over the slices
+            voxels[2] = 0
+        return voxels
+
+    if np.min(sigma) <= 0:
+        raise ae.PREDICTValueError(('LoG sigmas should be positive, got {}.').format(sigma))
+
+    # Smooth incrementally, keeping the smoothed image before each sigma.
+    # Sampled Gaussian kernels do not compose below about one voxel, so if
+    # the previous sigma or the increment is smaller than that, the full
+    # sigma is applied to the original image instead.
+    original = image.astype(np.float64)
+    previous_sigma = 0.0
+    steps = list()
+    for i_index in np.argsort(sigma):
+        i_sigma = float(sigma[i_index])
+        if i_sigma == previous_sigma:
+            # Duplicate sigma, use the same smoothed image and increment
+            steps.append((i_index, steps[-1][1], steps[-1][2]))
+            continue
+
+        increment = to_voxels(np.sqrt(i_sigma**2 - previous_sigma**2))
+        chain = np.min(to_voxels(previous_sigma)[axes]) >= MIN_INCREMENT and\
+            np.min(increment[axes]) >= MIN_INCREMENT
+        if chain:
+            # Smooth the previous image up to the previous sigma
+            smoothed = ndi.gaussian_filter(steps[-1][1], steps[-1][2],
+                                           mode='reflect')
+            steps.append((i_index, smoothed, increment))
+        else:
+            steps.append((i_index, original, to_voxels(i_sigma)))
+
+        previous_sigma = i_sigma
+
+    def compute(i_index, smoothed, increment):
+        # Normalize across scale by sigma squared
+        return i_index, float(sigma[i_index])**2 *\
+            _laplacian_of_gaussian(smoothed, increment, spacing, axes)
+
+    if n_jobs is None or n_jobs <= 1 or len(steps) == 1:
+        results = [compute(*step) for step in steps]
+    else:
+        results = Parallel(n_jobs=min(n_jobs, len(steps)),
+                           backend='threading')(delayed(compute)(*step)
+                                                for step in steps)
+
+    LoG_images = [None] * len(sigma)
+    for i_index, LoG_image in results:
+        LoG_images[i_index] = LoG_image
+
+    return LoG_images
+
+
+def get_log_features(image, mask, parameters=dict(), spacing=None, n_jobs=1):
     '''
     Compute features by filtering an image with a Laplacian of Gaussian (LoG)
     filter, after which histogram features are extracted.
@@ -39,9 +168,16 @@ def get_log_features(image, mask, parameters=dict()):
             ROI to be used for feature extraction.
 
     parameters: dictionary, optional
-            Contains the parameters for feature computation. Currently can only
-            include a list of sigma values to be used for the LoG filter.
-            Default values for sigma are [1, 5, 10].
+            Contains the parameters for feature computation. Can include a
+            list of sigma values to be used for the LoG filter, default
+            [1, 5, 10], and the mode, either '2D' (default) or '3D', see
+            get_log_images.
+
+    spacing: tuple, optional
+            Voxel spacing of the image in x, y, z order, used in 3D mode.
+
+    n_jobs: integer, default 1
+            Number of threads over which the sigmas are divided.
 
     Returns
     ----------
@@ -54,43 +190,32 @@ def get_log_features(image, mask, parameters=dict()):
             LoG_features object.
 
     '''
-
-    # Convert image to array and get size
-    image = sitk.GetImageFromArray(image)
-    im_size = image.GetSize()
-
-    # mask = sh.GetImageFromArray(mask.astype(np.uint8))
     if "sigma" in parameters.keys():
         sigma = parameters["sigma"]
     else:
         sigma = [1, 5, 10]
 
+    if "mode" in parameters.keys():
+        mode = parameters["mode"]
+    else:
+        mode = '2D'
+
     # Make a dummy
     LoG_features = list()
     LoG_labels = list()
 
-    # Create LoG filter object
-    LoGFilter = sitk.LaplacianRecursiveGaussianImageFilter()
-    LoGFilter.SetNormalizeAcrossScale(True)
-
-    # Iterate over sigmas
-    for i_index, i_sigma in enumerate(sigma):
-        LoGFilter.SetSigma(i_sigma)
-        LoG_image = np.zeros([image.GetSize()[0], image.GetSize()[2], image.GetSize()[1]])
-
-        # LoG Feature needs a minimum of 4 voxels in each direction
-        if not any(t < 4 for t in im_size):
-            # Iterate over slices
-            for i_slice in range(0, image.GetSize()[0]):
-                # Compute LoG Filter image
-                LoG_image_temp = LoGFilter.Execute(image[i_slice, :, :])
-                LoG_image[i_slice, :, :] = sitk.GetArrayFromImage(LoG_image_temp)
-
-        # Get histogram features of LoG image for full tumor
-        masked_voxels = ih.get_masked_voxels(LoG_image, mask)
-        histogram_features, histogram_labels = hf.get_histogram_features(masked_voxels, N_BINS)
-        histogram_labels = [l.replace('hf_', 'logf_') for l in histogram_labels]
-        LoG_features.extend(histogram_features)
+    LoG_images = get_log_images(image, sigma, spacing, mode, n_jobs)
+
+    mask = mask.astype(np.bool)
+    masked_voxels = np.vstack([ih.get_masked_voxels(LoG_image, mask)
+                               for LoG_image in LoG_images])
+
+    # Get histogram features of the LoG images for full tumor at once
+    histogram_features, histogram_labels =\
+        hf.get_histogram_features_batch(masked_voxels, N_BINS)
+    histogram_labels = [l.replace('hf_', 'logf_') for l in histogram_labels]
+    for i_sigma, i_features in zip(sigma, histogram_features):
+        LoG_features.extend(i_features)
         final_feature_names = [feature_name + '_sigma' + str(i_sigma) for feature_name in histogram_labels]
         LoG_labels.extend(final_feature_names)
 
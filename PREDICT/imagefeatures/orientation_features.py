@@ -18,50 +18,113 @@
 
 import numpy as np
 import PREDICT.helpers.orientation_functions as of
+import PREDICT.addexceptions as ae
 import SimpleITK as sitk
-import scipy.spatial as sp
-from skimage import morphology
+import scipy.ndimage as ndi
 
 _FLOAT_EPS_4 = np.finfo(float).eps * 4.0
 
+ORIENTATION_METHODS = ['moments', 'ellipsoid']
+
+
+def get_principal_axes(points):
+    '''
+    Compute the principal axes of a point cloud from its second order
+    moments, i.e. the eigenvectors of the covariance matrix. The axes are the
+    columns of the returned matrix, ordered from the largest to the smallest
+    variance. Returns None if there are less than two points.
+    '''
+    if points.shape[0] < 2:
+        return None
+
+    evals, evecs = np.linalg.eigh(np.cov(points, rowvar=False))
+    return evecs[:, np.argsort(evals)[::-1]]
+
+
+def _normalize_axes(evecs):
+    # Eigenvectors have no sign: let the largest component be positive
+    largest = np.argmax(np.abs(evecs), axis=0)
+    signs = np.sign(evecs[largest, np.arange(evecs.shape[1])])
+    signs[signs == 0] = 1
+    return evecs * signs
+
+
+def get_surface_points(mask):
+    '''
+    Get the indices of the voxels on the surface of a mask, i.e. the mask
+    voxels which have a face connected neighbour outside the mask.
+    '''
+    mask = mask.astype(np.bool)
+    inner = ndi.binary_erosion(mask, border_value=0)
+    return np.transpose(np.nonzero(mask & ~inner))
+
+
+def get_orientation_features(mask, offset=None, method='moments'):
+    '''
+    Compute the orientation of the mask as the angles of its principal axes.
+
+    Parameters
+    ----------
+    mask: ITK Image or numpy array, mandatory
+            Mask of the ROI.
+
+    offset: tuple, optional
+            If the mask is cropped, the offset of the cropped region, as the
+            ellipsoid fit is not invariant to translations.
+
+    method: string, default 'moments'
+            Either 'moments', which uses the second order moments of the
+            voxel coordinates, or 'ellipsoid', which fits an ellipsoid to the
+            surface voxels. If the ellipsoid fit is singular, the moments are
+            used.
+
+    '''
+    if method not in ORIENTATION_METHODS:
+        raise ae.PREDICTKeyError(('Unknown orientation method {}, should be one of {}.').format(method, ORIENTATION_METHODS))
 
-def get_orientation_features(mask):
     if type(mask) == sitk.SimpleITK.Image:
         mask = sitk.GetArrayFromImage(mask)
 
-    # Get nonzero point indices if convex hull for memory reduction
-    data = np.transpose(np.nonzero(mask))
-    try:
-        points = sp.ConvexHull(data).points
-
-        success = False
-        while not success:
-            try:
-                center, radii, evecs, v = of.ellipsoid_fit(points)
-                success = True
-            except np.linalg.linalg.LinAlgError:
-                print("Encountered singular matrix, segmentation too small, dilating.")
-                elem = morphology.ball(2)
-                mask = morphology.binary_dilation(mask, elem)
-                data = np.transpose(np.nonzero(mask))
-                points = sp.ConvexHull(data).points
-                points = of.data_regularize(points, divs=8)
+    if offset is None:
+        offset = np.zeros(mask.ndim, dtype=int)
+
+    evecs = None
+    if method == 'ellipsoid':
+        points = get_surface_points(mask) + offset
+        try:
+            center, radii, evecs, v = of.ellipsoid_fit(points.astype(np.float64))
+            evecs = np.real(evecs)
+            if not np.all(np.isfinite(evecs)):
+                raise np.linalg.LinAlgError
+
+            # Order the axes from the largest to the smallest radius
+            radii = np.real(radii)
+            order = np.argsort(np.where(np.isfinite(radii), -radii, np.inf))
+            evecs = evecs[:, order]
+        except (np.linalg.LinAlgError, IndexError):
+            print("[PREDICT Warning] Ellipsoid fit failed, using the second order moments.")
+            evecs = None
 
+    if evecs is None:
+        data = np.transpose(np.nonzero(mask)) + offset
+        evecs = get_principal_axes(data.astype(np.float64))
+
+    if evecs is None:
+        # Less than two voxels, orientation is undefined
+        alpha = 0
+        beta = 0
+        gamma = 0
+    else:
         # Convert evecs to angles
+        evecs = _normalize_axes(evecs)
         X = evecs[:, 0]
         Y = evecs[:, 1]
         Z = evecs[:, 2]
 
         alpha = np.arctan2(Z[0], Z[1])
-        beta = np.arccos(Z[2])
+        beta = np.arccos(np.clip(Z[2], -1, 1))
         gamma = np.arctan2(X[2], Y[2])
 
-    except sp.qhull.QhullError:
-        # TODO: 2D ellipse fit
-        alpha = 0
-        beta = 0
-        gamma = 0
-
     orientation_labels = ['of_theta_x', 'of_theta_y', 'of_theta_z']
     orientation_features = [alpha, beta, gamma]
 
@@ -18,13 +18,238 @@ import PREDICT.imagefeatures.histogram_features as hf
 import PREDICT.helpers.image_helper as ih
 # import imagefeatures.histogram_features as hf
 # import helpers.image_helper as ih
+import threading
 import numpy as np
-import phasepack as pp
+from scipy.fftpack import fft2, ifft2
+from joblib import Parallel, delayed
+from phasepack.tools import lowpassfilter, perfft2
+from phasepack.filtergrid import filtergrid
 
 N_BINS = 50
 
+# Settings of the phasepack phasecongmono and phasesymmono functions
+PHASE_SETTINGS = {'mult': 2.1,
+                  'sigmaOnf': 0.55,
+                  'k': 2.,
+                  'cutOff': 0.5,
+                  'g': 10.,
+                  'deviationGain': 1.5}
 
-def get_phase_features(image, mask, parameters=dict()):
+# Used to prevent division by zero
+EPSILON = 1E-4
+
+# Filter banks per slice shape, nscale and minimum wavelength
+MAX_FILTER_BANKS = 8
+_filter_banks = dict()
+_filter_banks_lock = threading.Lock()
+
+
+def get_phase_filter_bank(shape, nscale, minwavelength):
+    '''
+    Get the monogenic filter bank of a slice shape: the Riesz transform and,
+    per scale, the log-Gabor filters used for the phase congruency and for the
+    phase symmetry, as constructed by phasepack. The banks are computed once
+    and cached, as all slices of an image have the same shape.
+    '''
+    key = (tuple(shape), nscale, minwavelength)
+    with _filter_banks_lock:
+        if key in _filter_banks:
+            return _filter_banks[key]
+
+    rows, cols = shape
+    radius, u1, u2 = filtergrid(rows, cols)
+    radius[0, 0] = 1.
+    riesz = (1j * u1 - u2) / radius
+
+    mult = PHASE_SETTINGS['mult']
+    logGaborDenom = 2. * np.log(PHASE_SETTINGS['sigmaOnf']) ** 2.
+
+    # The lowpass filters of phasecongmono and phasesymmono differ
+    lowpass_congruency = lowpassfilter((rows, cols), .45, 15)
+    lowpass_symmetry = lowpassfilter([rows, cols], .4, 10)
+
+    congruency = list()
+    symmetry = list()
+    for ss in range(nscale):
+        wavelength = minwavelength * mult ** ss
+        fo = 1. / wavelength
+        logRadOverFo = np.log(radius / fo)
+        logGabor = np.exp(-(logRadOverFo * logRadOverFo) / logGaborDenom)
+
+        for lowpass, filters in zip([lowpass_congruency, lowpass_symmetry],
+                                    [congruency, symmetry]):
+            scale_filter = logGabor * lowpass
+            scale_filter[0, 0] = 0.
+            filters.append(scale_filter)
+
+    bank = {'riesz': riesz, 'congruency': congruency, 'symmetry': symmetry}
+    with _filter_banks_lock:
+        if len(_filter_banks) >= MAX_FILTER_BANKS:
+            _filter_banks.clear()
+        _filter_banks[key] = bank
+
+    return bank
+
+
+def _get_noise_threshold(tau, nscale):
+    '''
+    Noise threshold from the median of the smallest scale responses, i.e.
+    noiseMethod -1 in phasepack.
+    '''
+    mult = PHASE_SETTINGS['mult']
+    totalTau = tau * (1. - (1. / mult) ** nscale) / (1. - (1. / mult))
+    EstNoiseEnergyMean = totalTau * np.sqrt(np.pi / 2.)
+    EstNoiseEnergySigma = totalTau * np.sqrt((4 - np.pi) / 2.)
+    return np.maximum(EstNoiseEnergyMean +
+                      PHASE_SETTINGS['k'] * EstNoiseEnergySigma, EPSILON)
+
+
+def get_monogenic_features(image, bank):
+    '''
+    Compute the phase congruency, the orientation and the phase symmetry of a
+    2D image from the monogenic signal. The results are equal to those of
+    phasepack.phasecongmono and phasepack.phasesymmono, but the Fourier
+    transform of the image and the filter bank are shared by both.
+
+    Parameters
+    ----------
+    image: numpy array, mandatory
+            2D image.
+
+    bank: dictionary, mandatory
+            Filter bank of the image shape, see get_phase_filter_bank.
+
+    Returns
+    ----------
+    congruency: numpy array
+            Maximum moment of the phase congruency covariance (M).
+
+    orientation: numpy array
+            Orientation in integer degrees (0-180).
+
+    symmetry: numpy array
+            Phase symmetry.
+
+    '''
+    if image.dtype not in ['float32', 'float64']:
+        image = np.float64(image)
+
+    nscale = len(bank['congruency'])
+    riesz = bank['riesz']
+
+    # The symmetry uses the transform of the image itself, the congruency
+    # that of the periodic component, which has no border discontinuities
+    IM = fft2(image)
+    IM_periodic = IM - perfft2(image, compute_P=False)
+
+    sumAn = np.zeros(image.shape, dtype=image.dtype)
+    sumf = np.zeros(image.shape, dtype=image.dtype)
+    sumh1 = np.zeros(image.shape, dtype=image.dtype)
+    sumh2 = np.zeros(image.shape, dtype=image.dtype)
+    symAn = np.zeros(image.shape, dtype=image.dtype)
+    totalEnergy = np.zeros(image.shape, dtype=image.dtype)
+
+    for ss in range(nscale):
+        # Phase congruency
+        IMF = IM_periodic * bank['congruency'][ss]
+        f = np.real(ifft2(IMF))
+        h = ifft2(IMF * riesz)
+        h1, h2 = np.real(h), np.imag(h)
+        An = np.sqrt(f * f + h1 * h1 + h2 * h2)
+        sumAn += An
+        sumf += f
+        sumh1 += h1
+        sumh2 += h2
+
+        if ss == 0:
+            tau = np.median(sumAn.flatten()) / np.sqrt(np.log(4))
+            maxAn = An
+        else:
+            maxAn = np.maximum(maxAn, An)
+
+        # Phase symmetry
+        IMF = IM * bank['symmetry'][ss]
+        f = np.real(ifft2(IMF))
+        h = ifft2(IMF * riesz)
+        hAmp2 = h.real * h.real + h.imag * h.imag
+        symAn += np.sqrt(f * f + hAmp2)
+        if ss == 0:
+            symTau = np.median(symAn.flatten()) / np.sqrt(np.log(4))
+
+        totalEnergy += np.abs(f) - np.sqrt(hAmp2)
+
+    width = (sumAn / (maxAn + EPSILON) - 1.) / (nscale - 1)
+    weight = 1. / (1. + np.exp(PHASE_SETTINGS['g'] *
+                               (PHASE_SETTINGS['cutOff'] - width)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        orientation = np.arctan(-sumh2 / sumh1)
+    orientation = np.fix((orientation % np.pi) / np.pi * 180.)
+
+    energy = np.sqrt(sumf * sumf + sumh1 * sumh1 + sumh2 * sumh2)
+    phase_dev = np.maximum(1. - PHASE_SETTINGS['deviationGain'] *
+                           np.arccos(energy / (sumAn + EPSILON)), 0)
+    energy_thresh = np.maximum(energy - _get_noise_threshold(tau, nscale), 0)
+    congruency = weight * phase_dev * energy_thresh / (energy + EPSILON)
+
+    symmetry = np.maximum(totalEnergy - _get_noise_threshold(symTau, nscale),
+                          0)
+    symmetry /= symAn + EPSILON
+
+    return congruency, orientation, symmetry
+
+
+def get_phase_images(image, nscale=5, minwavelength=3, n_jobs=1):
+    '''
+    Compute the orientation, phase congruency and phase symmetry images of
+    all axial slices of an image.
+
+    Parameters
+    ----------
+    image: numpy array, mandatory
+            Image array in x, y, z order.
+
+    nscale: integer, default 5
+            Number of wavelet scales.
+
+    minwavelength: integer, default 3
+            Wavelength of the smallest scale filter.
+
+    n_jobs: integer, default 1
+            Number of threads over which the slices are divided.
+
+    Returns
+    ----------
+    monogenic_image, phasecon_image, phasesym_image: numpy arrays
+            Orientation, phase congruency and phase symmetry images.
+
+    '''
+    bank = get_phase_filter_bank(image.shape[0:2], nscale, minwavelength)
+    monogenic_image = np.zeros(image.shape)
+    phasecon_image = np.zeros(image.shape)
+    phasesym_image = np.zeros(image.shape)
+
+    def process_slices(indices):
+        for i_slice in indices:
+            congruency, orientation, symmetry =\
+                get_monogenic_features(image[:, :, i_slice], bank)
+            monogenic_image[:, :, i_slice] = orientation
+            phasecon_image[:, :, i_slice] = congruency
+            phasesym_image[:, :, i_slice] = symmetry
+
+    n_slices = image.shape[2]
+    if n_jobs is None or n_jobs <= 1 or n_slices <= 1:
+        process_slices(range(0, n_slices))
+    else:
+        # Threads write directly into the preallocated images
+        chunks = np.array_split(np.arange(n_slices), min(n_jobs, n_slices))
+        Parallel(n_jobs=len(chunks), backend='threading')(delayed(process_slices)(chunk)
+                                                          for chunk in chunks)
+
+    return monogenic_image, phasecon_image, phasesym_image
+
+
+def get_phase_features(image, mask, parameters=dict(), n_jobs=1):
     # Alternatively, one could use the pxehancement function
     if "minwavelength" in parameters.keys():
         minwavelength = parameters["minwavelength"]
@@ -41,65 +266,28 @@ def get_phase_features(image, mask, parameters=dict()):
     phase_labels = list()
 
     for i_index, (i_wl, i_sc) in enumerate(zip(minwavelength, nscale)):
-        monogenic_image = np.zeros(image.shape)
-        phasecon_image = np.zeros(image.shape)
-        phasesym_image = np.zeros(image.shape)
-        for i_slice in range(0, image.shape[2]):
-            # Phase Congruency using Monogenic signal
-            M, ori, ft, T = pp.phasecongmono(image[:, :, i_slice],
-                                             nscale=i_sc,
-                                             minWaveLength=i_wl,
-                                             mult=2.1,
-                                             sigmaOnf=0.55, k=2.,
-                                             cutOff=0.5, g=10.,
-                                             noiseMethod=-1,
-                                             deviationGain=1.5)
-            monogenic_image[:, :, i_slice] = ori
-            phasecon_image[:, :, i_slice] = M
-
-            # Phase Symmetry using Monogenic signal
-            phaseSym, totalEnergy, T = pp.phasesymmono(image[:, :, i_slice],
-                                                       nscale=i_sc,
-                                                       minWaveLength=i_wl,
-                                                       mult=2.1,
-                                                       sigmaOnf=0.55, k=2.,
-                                                       noiseMethod=-1)
-            phasesym_image[:, :, i_slice] = phaseSym
-
-        # Get histogram features
-        masked_voxels = ih.get_masked_voxels(monogenic_image, mask)
-        masked_voxels = replacenan(masked_voxels)
-        histogram_features, histogram_labels = hf.get_histogram_features(masked_voxels, N_BINS)
-        histogram_labels = [l.replace('hf_', 'phasef_monogenic_') for l in histogram_labels]
-        phase_features.extend(histogram_features)
-        final_feature_names = [feature_name + '_WL' + str(i_wl) + '_N' + str(i_sc) for feature_name in histogram_labels]
-        phase_labels.extend(final_feature_names)
-
-        masked_voxels = ih.get_masked_voxels(phasecon_image, mask)
-        masked_voxels = replacenan(masked_voxels)
-        histogram_features, histogram_labels = hf.get_histogram_features(masked_voxels, N_BINS)
-        histogram_labels = [l.replace('hf_', 'phasef_phasecong_') for l in histogram_labels]
-        phase_features.extend(histogram_features)
-        final_feature_names = [feature_name + '_WL' + str(i_wl) + '_N' + str(i_sc) for feature_name in histogram_labels]
-        phase_labels.extend(final_feature_names)
-
-        masked_voxels = ih.get_masked_voxels(phasesym_image, mask)
-        masked_voxels = replacenan(masked_voxels)
-        histogram_features, histogram_labels = hf.get_histogram_features(masked_voxels, N_BINS)
-        histogram_labels = [l.replace('hf_', 'phasef_phasesym_') for l in histogram_labels]
-        phase_features.extend(histogram_features)
-        final_feature_names = [feature_name + '_WL' + str(i_wl) + '_N' + str(i_sc) for feature_name in histogram_labels]
-        phase_labels.extend(final_feature_names)
+        phase_images = get_phase_images(image, i_sc, i_wl, n_jobs)
+
+        # Get histogram features of the three maps at once
+        masked_voxels = [replacenan(ih.get_masked_voxels(i_image, mask))
+                         for i_image in phase_images]
+        histogram_features, histogram_labels =\
+            hf.get_histogram_features_batch(np.vstack(masked_voxels), N_BINS)
+        for i_name, i_features in zip(['monogenic', 'phasecong', 'phasesym'],
+                                      histogram_features):
+            i_labels = [l.replace('hf_', 'phasef_' + i_name + '_') for l in histogram_labels]
+            phase_features.extend(i_features)
+            final_feature_names = [feature_name + '_WL' + str(i_wl) + '_N' + str(i_sc) for feature_name in i_labels]
+            phase_labels.extend(final_feature_names)
 
     return phase_features, phase_labels
 
 
 def replacenan(x):
-    # First, replace the NaNs:
-    X_notnan = x[:]
-    for fnum, f in enumerate(x):
-        if np.isnan(f):
-            print("[PREDICT WARNING] NaN found in phase features. Replacing with zero.")
-            X_notnan[fnum] = 0
-
-    return X_notnan
+    # Replace the NaNs in place
+    nans = np.isnan(x)
+    if np.any(nans):
+        print(("[PREDICT WARNING] {} NaNs found in phase features. Replacing with zero.").format(str(np.sum(nans))))
+        x[nans] = 0
+
+    return x
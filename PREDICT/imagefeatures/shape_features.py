@@ -16,147 +16,247 @@
 # limitations under the License.
 
 import numpy as np
+import scipy.ndimage as ndi
+from scipy.spatial import ConvexHull
+from scipy.spatial.distance import pdist
+from skimage import measure
 from skimage.measure import label
+from joblib import Parallel, delayed
 import SimpleITK as sitk
 import PREDICT.helpers.contour_functions as cf
 import PREDICT.helpers.sitk_helper as sitkh
+import PREDICT.addexceptions as ae
+
+try:
+    from scipy.spatial import QhullError
+except ImportError:
+    from scipy.spatial.qhull import QhullError
 
 # CONSTANTS
 N_min_smooth = 10
 N_max_smooth = 40
 
+SHAPE_MODES = ['2D', '3D']
+
 
-def get_shape_features(mask, metadata=None, mode='2D'):
+def get_shape_features(mask, metadata=None, mode='2D', spacing=None,
+                       n_jobs=1):
     '''
     Compute all shape features on a mask. Returns two lists: the feature values
     and the feature labels.
+
+    In 2D mode, the features are computed from the contours of the blobs in
+    each axial slice. In 3D mode, the features are computed from a surface
+    mesh of the mask, see get_shape_features_3D.
     '''
+    if mode not in SHAPE_MODES:
+        raise ae.PREDICTKeyError(('Unknown shape mode {}, should be one of {}.').format(mode, SHAPE_MODES))
+
     if mode == '3D':
-        features, labels = get_shape_features_3D(mask, metadata)
+        features, labels = get_shape_features_3D(mask, metadata, spacing)
         labels = [l + '_3D' for l in labels]
     else:
-        features, labels = get_shape_features_2D(mask, metadata)
+        features, labels = get_shape_features_2D(mask, metadata, n_jobs)
         labels = [l + '_2D' for l in labels]
 
     return features, labels
 
 
-def get_shape_features_3D(mask, metadata=None):
-    mask = sitk.GetArrayFromImage(mask)
+def _marching_cubes(volume, spacing):
+    # The Lewiner algorithm is called marching_cubes in recent skimage versions
+    if hasattr(measure, 'marching_cubes_lewiner'):
+        output = measure.marching_cubes_lewiner(volume, 0.5, spacing=spacing)
+    else:
+        output = measure.marching_cubes(volume, 0.5, spacing=spacing)
 
-    # Pre-allocation
-    perimeter = list()
-    convexity = list()
-    area = list()
-    rad_dist_avg = list()
-    rad_dist_std = list()
-    roughness_avg = list()
-    roughness_std = list()
-    cvar = list()
-    prax = list()
-    evar = list()
-    solidity = list()
-    compactness = list()
+    return output[0], output[1]
 
-    rad_dist = list()
-    rad_dist_norm = list()
-    roughness = list()
 
-    # Now calculate some of the edge shape features
-    # TODO: Adapt to allow for multiple slices at once
-    labeledImage = label(mask, connectivity=3)
-    for nblob in range(1, np.max(labeledImage)):
-        # Iterate over all slices
-        blobimage = np.zeros(mask.shape)
-        blobimage[mask == nblob] = 1
-        blobimage = blobimage.astype(np.uint8)
-        if np.sum(blobimage) <= 3:
-            # Only 1 or 2 points in volume, which means it's not really a
-            # volume, therefore we ignore it.
-            continue
+def get_mesh(mask, spacing=(1.0, 1.0, 1.0)):
+    '''
+    Compute the surface mesh of a 3D mask with marching cubes. The mask is
+    cropped to its bounding box and padded by a single voxel, so the mesh is
+    closed and the cost depends on the size of the mask only.
 
-        blobimage = sitk.GetImageFromArray(blobimage)
+    Returns the vertices in mm, relative to the first voxel of the bounding
+    box, and the triangular faces.
+    '''
+    bbox = ndi.find_objects(mask.astype(np.uint8), 1)[0]
+    volume = np.pad(mask[bbox].astype(np.float32), 1, mode='constant')
+    verts, faces = _marching_cubes(volume, tuple(spacing))
+
+    return verts.astype(np.float64), faces
+
+
+def compute_mesh_volume(verts, faces):
+    """Computes the volume enclosed by a closed mesh (divergence theorem)"""
+    v0 = verts[faces[:, 0], :]
+    v1 = verts[faces[:, 1], :]
+    v2 = verts[faces[:, 2], :]
 
-        boundary_points = cf.get_smooth_contour(blobimage,
+    return np.abs(np.sum(v0 * np.cross(v1, v2))) / 6.0
+
+
+def compute_max_diameter(verts):
+    """
+    Computes the maximum distance between two vertices of a mesh. Only the
+    vertices on the convex hull are compared.
+    """
+    if verts.shape[0] > 4:
+        try:
+            verts = verts[ConvexHull(verts).vertices, :]
+        except QhullError:
+            # Flat mesh, compare all vertices
+            pass
+
+    if verts.shape[0] < 2:
+        return 0.0
+
+    return np.max(pdist(verts))
+
+
+def compute_principal_axes(mask, spacing=(1.0, 1.0, 1.0)):
+    """
+    Computes the major, minor and least axis length of a 3D mask, i.e. four
+    times the square root of the eigenvalues of the covariance matrix of the
+    voxel positions in mm.
+    """
+    points = np.transpose(np.nonzero(mask)) * np.asarray(spacing)
+    if points.shape[0] < 2:
+        return 0.0, 0.0, 0.0
+
+    eigenvalues = np.linalg.eigvalsh(np.cov(points, rowvar=False))
+    eigenvalues = np.sort(np.clip(eigenvalues, 0, None))[::-1]
+    major, minor, least = 4 * np.sqrt(eigenvalues)
+
+    return major, minor, least
+
+
+def get_shape_features_3D(mask, metadata=None, spacing=None):
+    '''
+    Compute 3D shape features from a surface mesh of the mask, which is
+    created with marching cubes using the voxel spacing.
+
+    Parameters
+    ----------
+    mask: ITK Image or numpy array, mandatory
+            Mask of the ROI, in x, y, z order if an array is given.
+
+    metadata: pydicom Dataset, optional
+            Used for the spacing if no spacing is given.
+
+    spacing: tuple, optional
+            Spacing of the mask in mm in x, y, z order. By default, the
+            spacing of the ITK image or the metadata, or else unit spacing.
+
+    Returns
+    ----------
+    shape_features, shape_labels: lists
+            The surface area and volume in mm, the sphericity, the
+            compactness (36 pi V^2 / A^3, 1 for a sphere), the maximum 3D
+            diameter and the principal axis lengths.
+
+    '''
+    if isinstance(mask, sitk.Image):
+        if spacing is None:
+            spacing = mask.GetSpacing()
+        mask = sitkh.GetArrayFromImage(mask)
+
+    if spacing is None and metadata is not None and (0x18, 0x50) in metadata.keys():
+        pixel_spacing = metadata[0x28, 0x30].value
+        spacing = (float(pixel_spacing[0]), float(pixel_spacing[1]),
+                   float(metadata[0x18, 0x50].value))
+
+    if spacing is None:
+        spacing = (1.0, 1.0, 1.0)
+
+    shape_labels = ['sf_surface_area', 'sf_volume', 'sf_sphericity',
+                    'sf_compactness', 'sf_max_diameter',
+                    'sf_major_axis_length', 'sf_minor_axis_length',
+                    'sf_least_axis_length']
+
+    mask = mask.astype(np.bool)
+    if not np.any(mask):
+        print("[PREDICT Warning] Empty mask, 3D shape features are NaN.")
+        return [np.nan] * len(shape_labels), shape_labels
+
+    verts, faces = get_mesh(mask, spacing)
+    surface_area = measure.mesh_surface_area(verts, faces)
+    volume = compute_mesh_volume(verts, faces)
+
+    sphericity = np.pi**(1.0 / 3.0) * (6 * volume)**(2.0 / 3.0) / surface_area
+    compactness = 36 * np.pi * volume**2 / surface_area**3
+    max_diameter = compute_max_diameter(verts)
+    major, minor, least = compute_principal_axes(mask, spacing)
+
+    shape_features = [surface_area, volume, sphericity, compactness,
+                      max_diameter, major, minor, least]
+
+    return shape_features, shape_labels
+
+
+def get_blob_shape_features(boundary_points):
+    '''
+    Compute the 2D shape features of a single blob from its boundary points.
+    Returns a tuple with the radial distance, perimeter, area, compactness,
+    roughness, average roughness, cvar, prax, evar, convexity and solidity, or
+    None if the blob contains too few points.
+    '''
+    smooth_points = cf.local_convex_hull_points(boundary_points,
                                                 N_min_smooth,
                                                 N_max_smooth)
-        if boundary_points.shape[0] <= 3:
-            # Only 1 or 2 points in volume, which means it's not really a
-            # volume, therefore we ignore it.
-            continue
-        rad_dist_i, rad_dist_norm_i = compute_radial_distance(
-            boundary_points)
-        rad_dist.append(rad_dist_i)
-        rad_dist_norm.append(rad_dist_norm_i)
-        perimeter.append(compute_perimeter(boundary_points))
-
-        area.append(compute_area(boundary_points))
-        compactness.append(compute_compactness(boundary_points))
-        roughness_i, roughness_avg_temp = compute_roughness(
-            boundary_points, rad_dist_i)
-        roughness_avg.append(roughness_avg_temp)
-        roughness.append(roughness_i)
-
-        cvar.append(compute_cvar(boundary_points))
-        prax.append(compute_prax(boundary_points))
-        evar.append(compute_evar(boundary_points))
-
-        # TODO: Move computing convexity into esf
-        convex_hull = cf.convex_hull(blobimage)
-        convexity.append(compute_perimeter(convex_hull)
-            / perimeter[-1])
-
-        solidity.append(compute_area(convex_hull)/area[-1])
-        rad_dist_avg.append(np.mean(np.asarray(rad_dist_i)))
-        rad_dist_std.append(np.std(np.asarray(rad_dist_i)))
-        roughness_std.append(np.std(np.asarray(roughness_i)))
+    if smooth_points.shape[0] <= 3:
+        # Only 1 or 2 points in volume, which means it's not really a
+        # volume, therefore we ignore it.
+        return None
 
-    compactness_avg = np.mean(compactness)
-    compactness_std = np.std(compactness)
-    compactness_std = np.std(compactness)
-    compactness_std = np.std(compactness)
-    convexity_avg = np.mean(convexity)
-    convexity_std = np.std(convexity)
-    rad_dist_avg = np.mean(rad_dist_avg)
-    rad_dist_std = np.mean(rad_dist_std)
-    roughness_avg = np.mean(roughness_avg)
-    roughness_std = np.mean(roughness_std)
-    cvar_avg = np.mean(cvar)
-    cvar_std = np.std(cvar)
-    prax_avg = np.mean(prax)
-    prax_std = np.std(prax)
-    evar_avg = np.mean(evar)
-    evar_std = np.std(evar)
-    solidity_avg = np.mean(solidity)
-    solidity_std = np.std(solidity)
+    rad_dist_i, _ = compute_radial_distance(smooth_points)
+    perimeter = compute_perimeter(smooth_points)
+    area = compute_area(smooth_points)
+    compactness = compute_compactness(smooth_points)
+    roughness_i, roughness_avg = compute_roughness(smooth_points, rad_dist_i)
 
-    shape_labels = ['sf_compactness_avg', 'sf_compactness_std', 'sf_rad_dist_avg',
-                    'sf_rad_dist_std', 'sf_roughness_avg', 'sf_roughness_std',
-                    'sf_convexity_avg', 'sf_convexity_std', 'sf_cvar_avg', 'sf_cvar_std',
-                    'sf_prax_avg', 'sf_prax_std', 'sf_evar_avg', 'sf_evar_std',
-                    'sf_solidity_avg', 'sf_solidity_std']
+    cvar = compute_cvar(smooth_points)
+    prax = compute_prax(smooth_points)
+    evar = compute_evar(smooth_points)
 
-    shape_features = [compactness_avg, compactness_std, rad_dist_avg,
-                      rad_dist_std, roughness_avg, roughness_std,
-                      convexity_avg, convexity_std, cvar_avg, cvar_std,
-                      prax_avg, prax_std, evar_avg, evar_std, solidity_avg,
-                      solidity_std]
+    convex_hull = cf.convex_hull_points(boundary_points)
+    convexity = compute_perimeter(convex_hull) / perimeter
+    solidity = compute_area(convex_hull) / area
 
-    if metadata is not None:
-        if (0x18, 0x50) in metadata.keys():
-            # import dicom as pydicom
-            # metadata = pydicom.read_file(metadata)
-            pixel_spacing = metadata[0x28, 0x30].value
-            slice_thickness = int(metadata[0x18, 0x50].value)
-            voxel_volume = pixel_spacing[0] * pixel_spacing[1] * slice_thickness
-            volume = np.sum(mask) * voxel_volume
-            shape_labels.append('sf_volume')
-            shape_features.append(volume)
+    return (rad_dist_i, perimeter, area, compactness, roughness_i,
+            roughness_avg, cvar, prax, evar, convexity, solidity)
 
-    return shape_features, shape_labels
 
+def get_slice_shape_features(slicie):
+    '''
+    Compute the 2D shape features of the blobs in a labeled slice, i.e. of the
+    labels 0 up to the maximum label of the slice. The boundaries of all
+    blobs are traced at once.
+    '''
+    # NOTE: The blobs used to be converted to ITK images, so the first and
+    # second axis are switched
+    labels = range(0, np.max(slicie))
+    boundaries = cf.get_boundary_points_batch(np.transpose(slicie), labels)
+
+    blob_features = list()
+    for boundary_points in boundaries:
+        if boundary_points is None:
+            # No points in volume, therefore we ignore it.
+            continue
+
+        features = get_blob_shape_features(boundary_points)
+        if features is not None:
+            blob_features.append(features)
 
-def get_shape_features_2D(mask, metadata=None):
+    return blob_features
+
+
+def get_shape_features_2D(mask, metadata=None, n_jobs=1):
+    '''
+    Compute the 2D shape features of the blobs in all axial slices of a mask.
+    The slices are divided over n_jobs threads.
+    '''
     # Pre-allocation
     perimeter = list()
     convexity = list()
@@ -170,62 +270,35 @@ def get_shape_features_2D(mask, metadata=None):
     evar = list()
     solidity = list()
     compactness = list()
-    rad_dist = list()
-    rad_dist_norm = list()
-    roughness = list()
 
     # Now calculate some of the edge shape features
     # NOTE: Due to conversion to array, first and third axis are switched
-    mask = sitkh.GetArrayFromImage(mask)
+    if isinstance(mask, sitk.Image):
+        mask = sitkh.GetArrayFromImage(mask)
     N_mask_slices = mask.shape[2]
     mask = label(mask, connectivity=3)
-    for i_slice in range(0, N_mask_slices):
-        # Iterate over all slices
-        slicie = mask[:, :, i_slice]
-
-        for nblob in range(0, np.max(slicie)):
-            blobimage = np.zeros(slicie.shape)
-            blobimage[slicie == nblob] = 1
-
-            if np.sum(blobimage) == 0:
-                # No points in volume, therefore we ignore it.
-                continue
-
-            blobimage = blobimage.astype(np.uint8)
-            blobimage = sitk.GetImageFromArray(blobimage)
-
-            # Iterate over all blobs in a slice
-            boundary_points = cf.get_smooth_contour(blobimage,
-                                                    N_min_smooth,
-                                                    N_max_smooth)
-            if boundary_points.shape[0] <= 3:
-                # Only 1 or 2 points in volume, which means it's not really a
-                # volume, therefore we ignore it.
-                continue
-
-            rad_dist_i, rad_dist_norm_i = compute_radial_distance(
-                boundary_points)
-            rad_dist.append(rad_dist_i)
-            rad_dist_norm.append(rad_dist_norm_i)
-            perimeter.append(compute_perimeter(boundary_points))
-
-            area.append(compute_area(boundary_points))
-            compactness.append(compute_compactness(boundary_points))
-            roughness_i, roughness_avg_temp = compute_roughness(
-                boundary_points, rad_dist_i)
-            roughness_avg.append(roughness_avg_temp)
-            roughness.append(roughness_i)
-
-            cvar.append(compute_cvar(boundary_points))
-            prax.append(compute_prax(boundary_points))
-            evar.append(compute_evar(boundary_points))
-
-            # TODO: Move computing convexity into esf
-            convex_hull = cf.convex_hull(blobimage)
-            convexity.append(compute_perimeter(convex_hull)
-                / perimeter[-1])
-
-            solidity.append(compute_area(convex_hull)/area[-1])
+
+    slices = [mask[:, :, i_slice] for i_slice in range(0, N_mask_slices)]
+    if n_jobs is None or n_jobs <= 1 or N_mask_slices <= 1:
+        slice_features = [get_slice_shape_features(s) for s in slices]
+    else:
+        slice_features = Parallel(n_jobs=min(n_jobs, N_mask_slices),
+                                  backend='threading')(delayed(get_slice_shape_features)(s)
+                                                       for s in slices)
+
+    for blob_features in slice_features:
+        for (rad_dist_i, perimeter_i, area_i, compactness_i, roughness_i,
+             roughness_avg_i, cvar_i, prax_i, evar_i, convexity_i,
+             solidity_i) in blob_features:
+            perimeter.append(perimeter_i)
+            area.append(area_i)
+            compactness.append(compactness_i)
+            roughness_avg.append(roughness_avg_i)
+            cvar.append(cvar_i)
+            prax.append(prax_i)
+            evar.append(evar_i)
+            convexity.append(convexity_i)
+            solidity.append(solidity_i)
             rad_dist_avg.append(np.mean(np.asarray(rad_dist_i)))
             rad_dist_std.append(np.std(np.asarray(rad_dist_i)))
             roughness_std.append(np.std(np.asarray(roughness_i)))
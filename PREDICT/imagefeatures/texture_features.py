@@ -19,21 +19,24 @@ import numpy as np
 import skimage.filters
 from joblib import Parallel, delayed
 import itertools
-from skimage.feature import greycomatrix, greycoprops
+import threading
+from skimage.feature import greycoprops
 from skimage.exposure import rescale_intensity
 from skimage.feature import local_binary_pattern
 import SimpleITK as sitk
-import scipy.stats
 from radiomics import featureextractor
 import PREDICT.addexceptions as ae
+import PREDICT.imagefeatures.histogram_features as hf
+from PREDICT.imagefeatures.feature_cache import cached_compute
+from PREDICT.helpers.profiling import Tracer
 
 
 def gabor_filter_parallel(image, mask, parameters=dict(), n_jobs=1,
                           backend='threading'):
     """
-    Apply gabor filters to image, done in parallel.
-    Note: on a cluster, where parallelisation of the gabor filters
-    is not possible, use backend="threading"
+    Apply gabor filters to image. All slices are filtered in the frequency
+    domain with a precomputed kernel bank, see gabor_filter_stack. The
+    kernels are divided over n_jobs threads, hence the backend is ignored.
     """
 
     if "gabor_frequencies" in parameters.keys():
@@ -50,44 +53,19 @@ def gabor_filter_parallel(image, mask, parameters=dict(), n_jobs=1,
     kernels = list(itertools.product(gabor_frequencies,
                                      gabor_angles))
 
-    N_slices = image.shape[2]
-    N_kernels = len(kernels)
+    full_filtered = gabor_filter_stack(image, mask, kernels, n_jobs=n_jobs)
 
-    gabor_features = np.zeros([N_kernels, 2, N_slices])
-    full_filtered = list()
-    for i_slice in range(0, N_slices):
-        filtered = Parallel(n_jobs=n_jobs, backend=backend)(delayed(gabor_filter)
-                                                            (image=image[:, :, i_slice],
-                                                            mask=mask[:, :, i_slice],
-                                                            kernel=kernel)
-                                                            for kernel in
-                                                            kernels)
-        # filtered_image.append(filtered)
-        for i_index, i_kernel in enumerate(kernels):
-            # features[i_index, 0, i_slice] = filtered[i_index].mean()
-            # features[i_index, 1, i_slice] = filtered[i_index].var()
-            if i_slice == 0:
-                full_filtered.append(filtered[i_index])
-            else:
-                full_filtered[i_index] = np.append(full_filtered[i_index], filtered[i_index])
-
-    mean_gabor = list()
-    std_gabor = list()
-    min_gabor = list()
-    max_gabor = list()
-    skew_gabor = list()
-    kurt_gabor = list()
-    for i_index, i_kernel in enumerate(kernels):
-        mean_gabor.append(np.mean(full_filtered[i_index]))
-        std_gabor.append(np.std(full_filtered[i_index]))
-        min_gabor.append(np.percentile(full_filtered[i_index], 2))
-        max_gabor.append(np.percentile(full_filtered[i_index], 98))
-        skew_gabor.append(scipy.stats.skew(full_filtered[i_index]))
-        kurt_gabor.append(scipy.stats.kurtosis(full_filtered[i_index]))
-    # features = np.mean(features, 2).flatten()
-    # features = features.tolist()
-
-    gabor_features = mean_gabor + std_gabor + min_gabor + max_gabor + skew_gabor + kurt_gabor
+    # Compute the statistics of all kernels at once
+    statistics = hf.get_statistics(full_filtered, [2, 98])
+    mean_gabor = statistics['mean']
+    std_gabor = statistics['std']
+    min_gabor, max_gabor = statistics['quantiles'].T
+    skew_gabor = statistics['skewness']
+    kurt_gabor = statistics['kurtosis']
+
+    gabor_features = mean_gabor.tolist() + std_gabor.tolist() +\
+        min_gabor.tolist() + max_gabor.tolist() + skew_gabor.tolist() +\
+        kurt_gabor.tolist()
 
     # Create labels
     gabor_labels = list()
@@ -129,7 +107,111 @@ def gabor_filter(image, mask, kernel):
     return filtered_image
 
 
-def get_GLCM_features_multislice(image, mask, parameters=dict()):
+def get_gabor_kernel_bank(kernels):
+    '''
+    Get the real parts of the Gabor kernels, of which each element of kernels
+    should be a list containing the frequency and the angle.
+    '''
+    return [np.real(skimage.filters.gabor_kernel(frequency=kernel[0],
+                                                 theta=kernel[1]))
+            for kernel in kernels]
+
+
+def _get_fft_length(length):
+    '''
+    Get the smallest length of at least the given length which only has the
+    prime factors 2, 3 and 5, for which the FFT is fast.
+    '''
+    while True:
+        remainder = length
+        for factor in [2, 3, 5]:
+            while remainder % factor == 0:
+                remainder //= factor
+        if remainder == 1:
+            return length
+        length += 1
+
+
+def gabor_filter_stack(image, mask, kernels, n_jobs=1):
+    '''
+    Filter all axial slices of an image with a bank of Gabor kernels and
+    return the responses within the mask.
+
+    The slices are padded by reflection, as done by skimage.filters.gabor,
+    and transformed with a single FFT per slice, which is reused for all
+    kernels. The kernels are transformed once for the full stack.
+
+    Parameters
+    ----------
+    image: numpy array, mandatory
+            Image array in x, y, z order.
+
+    mask: numpy array, mandatory
+            Mask array of the same shape as the image.
+
+    kernels: list, mandatory
+            Kernels, each a list containing the frequency and the angle.
+
+    n_jobs: integer, default 1
+            Number of threads over which the kernels are divided.
+
+    Returns
+    ----------
+    responses: numpy array
+            Array of shape (kernels, voxels in the mask) with the filter
+            responses. As skimage.filters.gabor, the responses have the same
+            data type as the image.
+
+    '''
+    mask = mask.astype(np.bool)
+    kernel_bank = get_gabor_kernel_bank(kernels)
+
+    # All kernels have an odd size, pad with the largest half width
+    pad = max([max(k.shape) for k in kernel_bank]) // 2
+    padded = np.pad(image.astype(np.float64),
+                    ((pad, pad), (pad, pad), (0, 0)), mode='symmetric')
+
+    # Zero padding beyond the reflected border does not affect the ROI, as
+    # the kernels do not reach further than the reflected border.
+    fft_shape = [_get_fft_length(s) for s in padded.shape[0:2]]
+    image_fft = np.fft.rfft2(padded, s=fft_shape, axes=(0, 1))
+    del padded
+
+    responses = np.empty([len(kernel_bank), int(np.sum(mask))],
+                         dtype=image.dtype)
+    roi = (slice(pad, pad + image.shape[0]), slice(pad, pad + image.shape[1]))
+
+    def filter_kernels(indices):
+        for i_kernel in indices:
+            # Center the kernel on the origin
+            kernel = kernel_bank[i_kernel]
+            kernel_padded = np.zeros(fft_shape)
+            kernel_padded[0:kernel.shape[0], 0:kernel.shape[1]] = kernel
+            kernel_padded = np.roll(kernel_padded, -(kernel.shape[0] // 2), axis=0)
+            kernel_padded = np.roll(kernel_padded, -(kernel.shape[1] // 2), axis=1)
+            kernel_fft = np.fft.rfft2(kernel_padded)
+
+            filtered = np.fft.irfft2(image_fft * kernel_fft[:, :, np.newaxis],
+                                     s=fft_shape, axes=(0, 1))
+            responses[i_kernel, :] = filtered[roi][mask]
+
+    if n_jobs is None or n_jobs <= 1 or len(kernel_bank) == 1:
+        filter_kernels(range(0, len(kernel_bank)))
+    else:
+        # Threads write directly into the preallocated responses
+        chunks = np.array_split(np.arange(len(kernel_bank)),
+                                min(n_jobs, len(kernel_bank)))
+        Parallel(n_jobs=len(chunks), backend='threading')(delayed(filter_kernels)(chunk)
+                                                          for chunk in chunks)
+
+    return responses
+
+
+GLCM_PROPERTIES = ['contrast', 'dissimilarity', 'homogeneity', 'ASM',
+                   'energy', 'correlation']
+
+
+def _get_GLCM_parameters(parameters):
     if "levels" in parameters.keys():
         levels = parameters["levels"]
     else:
@@ -145,65 +227,146 @@ def get_GLCM_features_multislice(image, mask, parameters=dict()):
     else:
         distances = [1, 3]
 
-    N_slices = image.shape[2]
+    return levels, distances, angles
+
 
-    contrast = list()
-    dissimilarity = list()
-    homogeneity = list()
-    ASM = list()
-    energy = list()
-    correlation = list()
+def quantize_slices(image, mask, levels=16):
+    '''
+    Quantize each axial slice of the image to the given number of levels
+    within the bounding box of the mask in that slice. The pixels outside
+    the mask are set to zero before the quantization.
 
+    The quantized slices are stacked in an array of the largest bounding box
+    size, starting at the origin. The remaining pixels are set to levels,
+    so they can be excluded when counting co-occurrences.
+    '''
+    N_slices = image.shape[2]
+    quantized = list()
     for i_slice in range(0, N_slices):
         image_bounded, mask_bounded = bbox_2D(image[:, :, i_slice],
                                               mask[:, :, i_slice])
 
+        # Copy, as bbox_2D returns a view on the image
+        image_bounded = image_bounded.copy()
         image_bounded[~mask_bounded] = 0
         image_bounded = image_bounded + image_bounded.min()
         image_bounded = image_bounded*255.0 / image_bounded.max()
 
         image_bounded = image_bounded.astype(np.uint8)
 
-        image_bounded = rescale_intensity(image_bounded, out_range=(0, 15))
+        image_bounded = rescale_intensity(image_bounded,
+                                          out_range=(0, levels - 1))
+        quantized.append(np.asarray(image_bounded).astype(np.int64))
+
+    N_rows = max([q.shape[0] for q in quantized])
+    N_cols = max([q.shape[1] for q in quantized])
+    stack = np.full([N_rows, N_cols, N_slices], levels, dtype=np.int64)
+    for i_slice, q in enumerate(quantized):
+        stack[0:q.shape[0], 0:q.shape[1], i_slice] = q
+
+    return stack
+
+
+def _get_offset(distance, angle):
+    # Round half away from zero, as done by greycomatrix
+    def round_away(value):
+        return int(np.sign(value) * np.floor(np.abs(value) + 0.5))
+
+    return round_away(np.sin(angle) * distance),\
+        round_away(np.cos(angle) * distance)
+
+
+def get_GLCM_tensor(image, mask, levels=16, distances=[1, 3],
+                    angles=[0, np.pi/4, np.pi/2, 3*np.pi/4]):
+    '''
+    Compute the normalized Gray Level Co-occurence Matrix (GLCM) of each
+    axial slice for all distances and angles, equal to calling greycomatrix
+    with normed=True on each quantized slice.
+
+    The co-occurrences of all slices are counted with a single bincount per
+    distance and angle.
+
+    Returns
+    ----------
+    GLCM_tensor: numpy array
+            Array of shape (levels, levels, slices, distances, angles).
+
+    '''
+    stack = quantize_slices(image, mask, levels)
+    N_rows, N_cols, N_slices = stack.shape
+    slice_index = np.arange(N_slices).reshape(1, 1, N_slices)
+
+    counts = np.zeros([N_slices, len(distances), len(angles), levels, levels])
+    for i_dist, distance in enumerate(distances):
+        for i_angle, angle in enumerate(angles):
+            d_row, d_col = _get_offset(distance, angle)
+            if abs(d_row) >= N_rows or abs(d_col) >= N_cols:
+                # No pixel pairs at this offset
+                continue
+
+            rows = slice(max(0, -d_row), min(N_rows, N_rows - d_row))
+            cols = slice(max(0, -d_col), min(N_cols, N_cols - d_col))
+            rows_offset = slice(rows.start + d_row, rows.stop + d_row)
+            cols_offset = slice(cols.start + d_col, cols.stop + d_col)
 
-        GLCM_matrix = greycomatrix(image_bounded, distances, angles, levels=levels,
-                                   normed=True)
+            first = stack[rows, cols, :]
+            second = stack[rows_offset, cols_offset, :]
+            valid = (first < levels) & (second < levels)
+            codes = ((slice_index * levels + first) * levels + second)[valid]
+            counts[:, i_dist, i_angle, :, :] =\
+                np.bincount(codes, minlength=N_slices * levels**2).reshape(N_slices, levels, levels)
 
-        contrast.append(greycoprops(GLCM_matrix, 'contrast').flatten())
-        dissimilarity.append(greycoprops(GLCM_matrix, 'dissimilarity').flatten())
-        homogeneity.append(greycoprops(GLCM_matrix, 'homogeneity').flatten())
-        ASM.append(greycoprops(GLCM_matrix, 'ASM').flatten())
-        energy.append(greycoprops(GLCM_matrix, 'energy').flatten())
-        correlation.append(greycoprops(GLCM_matrix, 'correlation').flatten())
+    sums = np.sum(counts, axis=(3, 4), keepdims=True)
+    sums[sums == 0] = 1
+    GLCM_tensor = counts / sums
 
-    contrast_mean = np.mean(contrast, 0)
-    contrast_std = np.std(contrast, 0)
+    return np.transpose(GLCM_tensor, (3, 4, 0, 1, 2))
 
-    dissimilarity_mean = np.mean(dissimilarity, 0)
-    dissimilarity_std = np.std(dissimilarity, 0)
 
-    homogeneity_mean = np.mean(homogeneity, 0)
-    homogeneity_std = np.std(homogeneity, 0)
+def _get_GLCM_summed_features(GLCM_tensor, distances, angles):
+    # Sum the GLCM of all slices
+    GLCM_matrix = np.sum(GLCM_tensor, axis=2)
 
-    ASM_mean = np.mean(ASM, 0)
-    ASM_std = np.std(ASM, 0)
+    GLCM_features = list()
+    for prop in GLCM_PROPERTIES:
+        GLCM_features += greycoprops(GLCM_matrix, prop).flatten().tolist()
 
-    energy_mean = np.mean(energy, 0)
-    energy_std = np.std(energy, 0)
+    feature_names = ['tf_GLCM_' + prop for prop in GLCM_PROPERTIES]
 
-    correlation_mean = np.mean(correlation, 0)
-    correlation_std = np.std(correlation, 0)
+    GLCM_labels = list()
+    for i_name, i_dist, i_angle in itertools.product(feature_names,
+                                                     distances,
+                                                     angles):
+        # Round to reduce name length
+        i_dist = round(i_dist, 2)
+        i_angle = round(i_dist, 2)
 
-    GLCM_features = contrast_mean.tolist() + contrast_std.tolist() +\
-        dissimilarity_mean.tolist() + dissimilarity_std.tolist() +\
-        homogeneity_mean.tolist() + homogeneity_std.tolist() +\
-        ASM_mean.tolist() + ASM_std.tolist() + energy_mean.tolist() +\
-        energy_std.tolist() + correlation_mean.tolist() +\
-        correlation_std.tolist()
+        label = i_name + 'd' + str(i_dist) + 'A' + str(i_angle)
+        GLCM_labels.append(label)
 
-    feature_names = ['tf_GLCMMS_contrast', 'tf_GLCMMS_dissimilarity',
-                     'tf_GLCMMS_homogeneity', 'tf_GLCMMS_ASM',
-                     'tf_GLCMMS_energy', 'tf_GLCMMS_correlation']
+    if len(GLCM_features) != len(GLCM_labels):
+        print(len(GLCM_features))
+        print(len(GLCM_labels))
+        raise ae.PREDICTValueError('Label length does not fit feature length')
+
+    return GLCM_features, GLCM_labels
+
+
+def _get_GLCM_multislice_features(GLCM_tensor, distances, angles):
+    # Compute the properties of all slices at once by treating the slices
+    # as additional distances
+    levels, _, N_slices, N_distances, N_angles = GLCM_tensor.shape
+    GLCM_slices = GLCM_tensor.reshape(levels, levels, N_slices * N_distances,
+                                      N_angles)
+
+    GLCM_features = list()
+    for prop in GLCM_PROPERTIES:
+        values = greycoprops(GLCM_slices, prop).reshape(N_slices,
+                                                        N_distances * N_angles)
+        GLCM_features += np.mean(values, 0).tolist()
+        GLCM_features += np.std(values, 0).tolist()
+
+    feature_names = ['tf_GLCMMS_' + prop for prop in GLCM_PROPERTIES]
 
     GLCM_labels = list()
     for i_name, i_dist, i_angle in itertools.product(feature_names,
@@ -226,6 +389,16 @@ def get_GLCM_features_multislice(image, mask, parameters=dict()):
     return GLCM_features, GLCM_labels
 
 
+def get_GLCM_features_multislice(image, mask, parameters=dict()):
+    '''
+    Compute the mean and std of the GLCM features of the 2D axial slices,
+    see get_GLCM_features.
+    '''
+    levels, distances, angles = _get_GLCM_parameters(parameters)
+    GLCM_tensor = get_GLCM_tensor(image, mask, levels, distances, angles)
+    return _get_GLCM_multislice_features(GLCM_tensor, distances, angles)
+
+
 def get_GLCM_features(image, mask, parameters=dict()):
     '''
     Compute Gray Level Co-occurence Matrix (GLCM) features. The image is first
@@ -239,83 +412,106 @@ def get_GLCM_features(image, mask, parameters=dict()):
 
     The output are two lists: the feature values and the labels.
     '''
-    if "levels" in parameters.keys():
-        levels = parameters["levels"]
-    else:
-        levels = 16
+    levels, distances, angles = _get_GLCM_parameters(parameters)
+    GLCM_tensor = get_GLCM_tensor(image, mask, levels, distances, angles)
+    return _get_GLCM_summed_features(GLCM_tensor, distances, angles)
 
-    if "angles" in parameters.keys():
-        angles = parameters["angles"]
-    else:
-        angles = [0, np.pi/4, np.pi/2, 3*np.pi/4]
 
-    if "distances" in parameters.keys():
-        distances = parameters["distances"]
-    else:
-        distances = [1, 3]
-
-    N_slices = image.shape[2]
-
-    contrast = list()
-    dissimilarity = list()
-    homogeneity = list()
-    ASM = list()
-    energy = list()
-    correlation = list()
-
-    GLCM_matrix = np.zeros([levels, levels, len(distances), len(angles)])
-    for i_slice in range(0, N_slices):
-        image_bounded, mask_bounded = bbox_2D(image[:, :, i_slice],
-                                              mask[:, :, i_slice])
-
-        image_bounded[~mask_bounded] = 0
-        image_bounded = image_bounded + image_bounded.min()
-        image_bounded = image_bounded*255.0 / image_bounded.max()
-
-        image_bounded = image_bounded.astype(np.uint8)
+def get_GLCM_features_combined(image, mask, parameters=dict()):
+    '''
+    Compute both the GLCM and the GLCMMS features from a single GLCM tensor,
+    in that order.
+    '''
+    levels, distances, angles = _get_GLCM_parameters(parameters)
+    GLCM_tensor = get_GLCM_tensor(image, mask, levels, distances, angles)
+    GLCM_features, GLCM_labels =\
+        _get_GLCM_summed_features(GLCM_tensor, distances, angles)
+    GLCMMS_features, GLCMMS_labels =\
+        _get_GLCM_multislice_features(GLCM_tensor, distances, angles)
 
-        image_bounded = rescale_intensity(image_bounded, out_range=(0, 15))
+    return GLCM_features + GLCMMS_features, GLCM_labels + GLCMMS_labels
 
-        GLCM_matrix += greycomatrix(image_bounded, distances, angles, levels=levels,
-                                    normed=True)
 
-    contrast = greycoprops(GLCM_matrix, 'contrast').flatten()
-    dissimilarity = greycoprops(GLCM_matrix, 'dissimilarity').flatten()
-    homogeneity = greycoprops(GLCM_matrix, 'homogeneity').flatten()
-    ASM = greycoprops(GLCM_matrix, 'ASM').flatten()
-    energy = greycoprops(GLCM_matrix, 'energy').flatten()
-    correlation = greycoprops(GLCM_matrix, 'correlation').flatten()
+def get_LBP_codes(image, mask, radius, N_points, method='uniform'):
+    '''
+    Compute the uniform LBP codes of the pixels within the mask. Each axial
+    slice is only filtered up to the far end of the bounding box of the mask
+    plus the radius, so the codes are equal to those of filtering the full
+    slice. The crop starts at the slice origin, as the neighbours are
+    interpolated at absolute pixel coordinates: shifting the origin changes
+    their rounding, which flips the codes of exact ties.
+
+    Returns a 1D array of compact unsigned integer codes.
+    '''
+    if method != 'uniform':
+        raise ae.PREDICTValueError(('LBP method {} is not supported, use uniform.').format(method))
+
+    mask = mask.astype(np.bool)
+    margin = int(np.ceil(radius)) + 1
+
+    # Uniform codes range from 0 to N_points + 1
+    codes = np.empty(np.count_nonzero(mask),
+                     dtype=np.min_scalar_type(N_points + 1))
+    position = 0
+    for i_slice in range(0, image.shape[2]):
+        mask_slice = mask[:, :, i_slice]
+        rows = np.flatnonzero(np.any(mask_slice, axis=1))
+        cols = np.flatnonzero(np.any(mask_slice, axis=0))
+        if rows.size == 0:
+            continue
+
+        bbox = (slice(0, rows[-1] + margin + 1),
+                slice(0, cols[-1] + margin + 1))
+        LBP_slice = local_binary_pattern(image[:, :, i_slice][bbox],
+                                         P=N_points, R=radius, method=method)
+        LBP_slice = LBP_slice[mask_slice[bbox]]
+        codes[position:position + LBP_slice.size] = LBP_slice
+        position += LBP_slice.size
+
+    return codes
+
+
+def get_LBP_statistics(codes, N_codes):
+    '''
+    Compute the mean, std, median, kurtosis, skewness and peak of LBP codes
+    from their histogram, as the codes are a small set of integers.
+    '''
+    counts = np.bincount(codes, minlength=N_codes).astype(np.float64)
+    values = np.arange(counts.size)
+    N = np.sum(counts)
+
+    mean_val = np.sum(values * counts) / N
+    deviation = values - mean_val
+    m2 = np.sum(deviation**2 * counts) / N
+    m3 = np.sum(deviation**3 * counts) / N
+    m4 = np.sum(deviation**4 * counts) / N
+    std_val = np.sqrt(m2)
+
+    # Median: mean of the middle two sorted codes for an even count
+    cumulative = np.cumsum(counts)
+    lower = np.searchsorted(cumulative, (N - 1) // 2, side='right')
+    upper = np.searchsorted(cumulative, N // 2, side='right')
+    median_val = (values[lower] + values[upper]) / 2.0
+
+    # Biased Fisher kurtosis and skewness, as scipy.stats
+    if m2 == 0:
+        kurtosis_val = -3.0
+        skew_val = 0.0
+    else:
+        kurtosis_val = m4 / m2**2 - 3.0
+        skew_val = m3 / m2**1.5
 
-    GLCM_features = contrast.tolist() +\
-        dissimilarity.tolist() +\
-        homogeneity.tolist() +\
-        ASM.tolist() + energy.tolist() +\
-        correlation.tolist()
+    peak_val = np.argmax(counts)
 
-    feature_names = ['tf_GLCM_contrast', 'tf_GLCM_dissimilarity',
-                     'tf_GLCM_homogeneity', 'tf_GLCM_ASM', 'tf_GLCM_energy',
-                     'tf_GLCM_correlation']
+    return [mean_val, std_val, median_val, kurtosis_val, skew_val, peak_val]
 
-    GLCM_labels = list()
-    for i_name, i_dist, i_angle in itertools.product(feature_names,
-                                                     distances,
-                                                     angles):
-        # Round to reduce name length
-        i_dist = round(i_dist, 2)
-        i_angle = round(i_dist, 2)
-
-        label = i_name + 'd' + str(i_dist) + 'A' + str(i_angle)
-        GLCM_labels.append(label)
-
-    if len(GLCM_features) != len(GLCM_labels):
-        print(len(GLCM_features))
-        print(len(GLCM_labels))
-        raise ae.PREDICTValueError('Label length does not fit feature length')
 
-    return GLCM_features, GLCM_labels
+def _get_LBP_config_features(image, mask, radius, N_points, method):
+    codes = get_LBP_codes(image, mask, radius, N_points, method)
+    return get_LBP_statistics(codes, N_points + 2)
 
 
-def get_LBP_features(image, mask, parameters=dict()):
+def get_LBP_features(image, mask, parameters=dict(), n_jobs=1):
     '''
     Compute features by applying a Local Binary Pattern (LBP) filter to an image.
     The LBP will be constructed with a radius and neighboorhood defined by N_points.
@@ -325,6 +521,9 @@ def get_LBP_features(image, mask, parameters=dict()):
     by computing statistics over all the LBP for all 2D axial slices, such
     as the mean and std.
 
+    The radius and N_points configurations are computed concurrently in
+    n_jobs threads.
+
     The output are two lists: the feature values and the labels.
     '''
     if "radius" in parameters.keys():
@@ -342,155 +541,151 @@ def get_LBP_features(image, mask, parameters=dict()):
     feature_names = ['tf_LBP_mean', 'tf_LBP_std', 'tf_LBP_median',
                      'tf_LBP_kurtosis', 'tf_LBP_skew', 'tf_LBP_peak']
 
-    LBP_features = np.zeros([len(radius) * len(feature_names), 1])
-    LBP_labels = list()
-
-    mask = mask.flatten()
-
-    for i_index, (i_radius, i_N_points) in enumerate(zip(radius, N_points)):
-        LBP_image = np.zeros(image.shape)
-        for i_slice in range(0, image.shape[2]):
-                LBP_image[:, :, i_slice] = local_binary_pattern(image[:, :, i_slice], P=i_N_points, R=i_radius, method=method)
-        LBP_image = LBP_image.flatten()
-        LBP_tumor = LBP_image[mask]
-
-        mean_val = np.mean(LBP_tumor)
-        std_val = np.std(LBP_tumor)
-        median_val = np.median(LBP_tumor)
-        kurtosis_val = scipy.stats.kurtosis(LBP_tumor)
-        skew_val = scipy.stats.skew(LBP_tumor)
-        # peak_val = max(set(LBP_tumor), key=LBP_tumor.count)
-        peak_val = np.bincount(LBP_tumor.astype(int)).argmax()
-
-        features = [mean_val, std_val, median_val, kurtosis_val, skew_val, peak_val]
+    configs = list(zip(radius, N_points))
+    if n_jobs is None or n_jobs <= 1 or len(configs) == 1:
+        features = [_get_LBP_config_features(image, mask, i_radius,
+                                             i_N_points, method)
+                    for i_radius, i_N_points in configs]
+    else:
+        features = Parallel(n_jobs=min(n_jobs, len(configs)),
+                            backend='threading')(delayed(_get_LBP_config_features)
+                                                 (image, mask, i_radius,
+                                                  i_N_points, method)
+                                                 for i_radius, i_N_points in configs)
 
-        full_feature_start = i_index * len(feature_names)
-        full_feature_end = (i_index + 1) * len(feature_names)
-        LBP_features[full_feature_start:full_feature_end, 0] = np.asarray(features).ravel()
+    LBP_features = list()
+    LBP_labels = list()
+    for (i_radius, i_N_points), i_features in zip(configs, features):
+        LBP_features.extend([float(f) for f in i_features])
 
         cur_feature_names = [feature_name + '_R' + str(i_radius) + '_P' + str(i_N_points) for feature_name in feature_names]
 
         LBP_labels.extend(cur_feature_names)
 
-    # Convert to proper list
-    LBP_features = [x[0] for x in LBP_features.tolist()]
-
     return LBP_features, LBP_labels
 
 
-def get_GLSZM_features(image, mask):
-    mask = mask.astype(int)
-    image = sitk.GetImageFromArray(image)
-    mask = sitk.GetImageFromArray(mask)
-    kwargs = {'binWidth': 25,
-              'interpolator': sitk.sitkBSpline,
-              'resampledPixelSpacing': None,
-              'verbose': True}
+# Settings of the PyRadiomics extractor
+RADIOMICS_SETTINGS = {'binWidth': 25,
+                      'interpolator': sitk.sitkBSpline,
+                      'resampledPixelSpacing': None,
+                      'verbose': True}
 
-    # Initialize wrapperClass to generate signature
-    extractor = featureextractor.RadiomicsFeaturesExtractor(**kwargs)
-    extractor.disableAllFeatures()
-    extractor.enableFeatureClassByName('glszm')
+# PyRadiomics feature classes and the corresponding PREDICT groups
+RADIOMICS_CLASSES = [('glrlm', 'GLRLM'), ('glszm', 'GLSZM'), ('ngtdm', 'NGTDM')]
 
-    featureVector = extractor.execute(image, mask)
+# Extractors are created once per worker, see get_radiomics_extractor
+_radiomics_extractors = threading.local()
 
-    # Assign features to corresponding groups
-    GLSZM_labels_temp = list()
-    GLSZM_features = list()
 
-    for featureName in featureVector.keys():
-        # Skip the "general" features
-        if 'glszm' in featureName:
-            GLSZM_labels_temp.append(featureName)
-            GLSZM_features.append(featureVector[featureName])
+def get_radiomics_extractor(feature_classes):
+    '''
+    Get a PyRadiomics extractor with the given feature classes enabled. The
+    extractor is created at the first call in a worker thread or process
+    and reused for all later patients.
+    '''
+    extractors = getattr(_radiomics_extractors, 'extractors', None)
+    if extractors is None:
+        extractors = dict()
+        _radiomics_extractors.extractors = extractors
+
+    key = tuple(sorted(feature_classes))
+    if key not in extractors.keys():
+        # The extractor was renamed in PyRadiomics 2.0
+        if hasattr(featureextractor, 'RadiomicsFeaturesExtractor'):
+            extractor_class = featureextractor.RadiomicsFeaturesExtractor
+        else:
+            extractor_class = featureextractor.RadiomicsFeatureExtractor
+
+        extractor = extractor_class(**RADIOMICS_SETTINGS)
+        extractor.disableAllFeatures()
+        for feature_class in feature_classes:
+            extractor.enableFeatureClassByName(feature_class)
+        extractor.settings['distances'] = [1]
+        extractors[key] = extractor
+
+    return extractors[key]
+
+
+def get_radiomics_features(image, mask, feature_classes=None):
+    '''
+    Compute the PyRadiomics texture features of the given classes with a
+    single execution of the extractor, so the image is discretized only once.
 
-    # Replace part of label to indicate a texture feature
-    GLSZM_labels = list()
-    for l in GLSZM_labels_temp:
-        l = l.replace('original_glszm', 'tf_GLSZM')
-        GLSZM_labels.append(l)
+    Parameters
+    ----------
+    image: numpy array, mandatory
+            Image array from which the features are extracted.
 
-    return GLSZM_features, GLSZM_labels
+    mask: numpy array, mandatory
+            Mask array of the same shape as the image.
 
+    feature_classes: list, optional
+            PyRadiomics feature classes to compute, see RADIOMICS_CLASSES.
+            Defaults to all of them.
+
+    Returns
+    ----------
+    features, labels: list
+            Feature values and labels, grouped per class in the order of
+            feature_classes.
+
+    '''
+    if feature_classes is None:
+        feature_classes = [c for c, _ in RADIOMICS_CLASSES]
+
+    groups = dict(RADIOMICS_CLASSES)
+    unknown = [c for c in feature_classes if c not in groups.keys()]
+    if unknown:
+        raise ae.PREDICTKeyError(('Unknown radiomics feature classes {}.').format(unknown))
 
-def get_GLRLM_features(image, mask):
     mask = mask.astype(int)
     image = sitk.GetImageFromArray(image)
     mask = sitk.GetImageFromArray(mask)
-    kwargs = {'binWidth': 25,
-              'interpolator': sitk.sitkBSpline,
-              'resampledPixelSpacing': None,
-              'verbose': True}
-
-    # Initialize wrapperClass to generate signature
-    extractor = featureextractor.RadiomicsFeaturesExtractor(**kwargs)
-    extractor.disableAllFeatures()
-    extractor.enableFeatureClassByName('glrlm')
 
+    extractor = get_radiomics_extractor(feature_classes)
     featureVector = extractor.execute(image, mask)
 
     # Assign features to corresponding groups
-    GLRLM_labels_temp = list()
-    GLRLM_features = list()
-
-    for featureName in featureVector.keys():
-        # Skip the "general" features
-        if 'glrlm' in featureName:
-            GLRLM_labels_temp.append(featureName)
-            GLRLM_features.append(featureVector[featureName])
+    features = list()
+    labels = list()
+    for feature_class in feature_classes:
+        for featureName in featureVector.keys():
+            # Skip the "general" features
+            if feature_class in featureName:
+                features.append(featureVector[featureName])
 
-    # Replace part of label to indicate a texture feature
-    GLRLM_labels = list()
-    for l in GLRLM_labels_temp:
-        l = l.replace('original_glrlm', 'tf_GLRLM')
-        GLRLM_labels.append(l)
+                # Replace part of label to indicate a texture feature
+                labels.append(featureName.replace('original_' + feature_class,
+                                                  'tf_' + groups[feature_class]))
 
-    return GLRLM_features, GLRLM_labels
-
-
-def get_NGTDM_features(image, mask):
-    mask = mask.astype(int)
-    image = sitk.GetImageFromArray(image)
-    mask = sitk.GetImageFromArray(mask)
-    kwargs = {'binWidth': 25,
-              'interpolator': sitk.sitkBSpline,
-              'resampledPixelSpacing': None,
-              'verbose': True}
+    return features, labels
 
-    # Initialize wrapperClass to generate signature
-    extractor = featureextractor.RadiomicsFeaturesExtractor(**kwargs)
-    extractor.disableAllFeatures()
-    extractor.enableFeatureClassByName('ngtdm')
-    extractor.settings['distances'] = [1]
 
-    featureVector = extractor.execute(image, mask)
+def get_GLSZM_features(image, mask):
+    return get_radiomics_features(image, mask, ['glszm'])
 
-    # Assign features to corresponding groups
-    NGTDM_labels_temp = list()
-    NGTDM_features = list()
 
-    for featureName in featureVector.keys():
-        # Skip the "general" features
-        if 'ngtdm' in featureName:
-            NGTDM_labels_temp.append(featureName)
-            NGTDM_features.append(featureVector[featureName])
+def get_GLRLM_features(image, mask):
+    return get_radiomics_features(image, mask, ['glrlm'])
 
-    # Replace part of label to indicate a texture feature
-    NGTDM_labels = list()
-    for l in NGTDM_labels_temp:
-        l = l.replace('original_ngtdm', 'tf_NGTDM')
-        NGTDM_labels.append(l)
 
-    return NGTDM_features, NGTDM_labels
+def get_NGTDM_features(image, mask):
+    return get_radiomics_features(image, mask, ['ngtdm'])
 
 
 def get_texture_features(image, mask, parameters=None, config='LBP',
-                         config_general=dict()):
-    if parameters is None:
-        parameters = dict()
-        parameters['gabor_settings'] = dict()
-        parameters['LBP'] = dict()
-        parameters['GLCM'] = dict()
+                         config_general=dict(), cache=None, tracer=None):
+    '''
+    Compute the texture features configured by config, which is either 'all'
+    or the name of a single texture feature group. If a cache bound to the
+    image and mask is given (see feature_cache.FeatureCache.bind), each
+    texture feature group is loaded from and stored in that cache separately.
+    If a tracer is given (see helpers.profiling.Tracer), the time and memory
+    usage of each texture feature group is recorded.
+    '''
+    if tracer is None:
+        tracer = Tracer(enabled=False)
 
     # Check whether specific parameters for using joblib are given
     if 'Joblib_ncores' in config_general.keys():
@@ -503,65 +698,80 @@ def get_texture_features(image, mask, parameters=None, config='LBP',
     else:
         backend = None
 
-    texture_features = dict()
-    if config == 'all':
-        print("-   Computing Gabor features.")
-        gabor_features, gabor_labels =\
-            gabor_filter_parallel(image, mask, parameters['gabor_settings'],
-                                  n_jobs=n_jobs, backend=backend)
-
-        print("-   Computing GLCM features.")
-        GLCM_features, GLCM_labels = get_GLCM_features(image, mask,
-                                                       parameters['GLCM'])
-        GLCMMS_features, GLCMMS_labels =\
-            get_GLCM_features_multislice(image, mask, parameters['GLCM'])
+    texture_features = list()
+    texture_labels = list()
+    tasks = get_texture_tasks(image, mask, parameters, config, n_jobs, backend)
+    for group, settings, function, args, kwargs in tasks:
+        print(("-   Computing {} features.").format(group.replace('texture_', '')))
+        with tracer.trace(group, voxels=image.size):
+            features, labels = cached_compute(cache, group, settings,
+                                              function, *args, **kwargs)
+        texture_features += features
+        texture_labels += labels
 
-        print("-   Computing GLRLM features.")
-        GLRLM_features, GLRLM_labels = get_GLRLM_features(image, mask)
-
-        print("-   Computing GLSZM features.")
-        GLSZM_features, GLSZM_labels = get_GLSZM_features(image, mask)
-
-        print("-   Computing LBP features.")
-        LBP_features, LBP_labels = get_LBP_features(image, mask,
-                                                    parameters['LBP'])
+    return texture_features, texture_labels
 
-        print("-   Computing NGTDM features.")
-        NGTDM_features, NGTDM_labels = get_NGTDM_features(image, mask)
 
-        texture_features = gabor_features + GLCM_features + GLCMMS_features +\
-            GLRLM_features + GLSZM_features + NGTDM_features + LBP_features
+def get_texture_tasks(image, mask, parameters=None, config='LBP',
+                      n_jobs=None, backend=None):
+    '''
+    Get the texture feature groups to be computed for the given config as
+    a list of tasks. Each task is a tuple containing the group name, the
+    settings of the group, the function and its arguments and keyword
+    arguments. The order of the tasks is the order of the features in the
+    output.
+    '''
+    if parameters is None:
+        parameters = dict()
+        parameters['gabor_settings'] = dict()
+        parameters['LBP'] = dict()
+        parameters['GLCM'] = dict()
 
-        texture_labels = gabor_labels + GLCM_labels + GLCMMS_labels +\
-            GLRLM_labels + GLSZM_labels + NGTDM_labels + LBP_labels
+    gabor_task = ('texture_Gabor', parameters['gabor_settings'],
+                  gabor_filter_parallel,
+                  (image, mask, parameters['gabor_settings']),
+                  {'n_jobs': n_jobs, 'backend': backend})
+    GLCM_task = ('texture_GLCM', parameters['GLCM'], get_GLCM_features,
+                 (image, mask, parameters['GLCM']), {})
+    GLCMMS_task = ('texture_GLCMMS', parameters['GLCM'],
+                   get_GLCM_features_multislice,
+                   (image, mask, parameters['GLCM']), {})
+    GLRLM_task = ('texture_GLRLM', {}, get_GLRLM_features, (image, mask), {})
+    GLSZM_task = ('texture_GLSZM', {}, get_GLSZM_features, (image, mask), {})
+    NGTDM_task = ('texture_NGTDM', {}, get_NGTDM_features, (image, mask), {})
+    LBP_task = ('texture_LBP', parameters['LBP'], get_LBP_features,
+                (image, mask, parameters['LBP']), {'n_jobs': n_jobs})
+
+    # Both GLCM groups are computed from the same GLCM tensor
+    GLCM_combined_task = ('texture_GLCM_GLCMMS', parameters['GLCM'],
+                          get_GLCM_features_combined,
+                          (image, mask, parameters['GLCM']), {})
+
+    # The PyRadiomics groups are computed with a single extractor execution
+    radiomics_task = ('texture_GLRLM_GLSZM_NGTDM', {},
+                      get_radiomics_features,
+                      (image, mask, ['glrlm', 'glszm', 'ngtdm']), {})
 
+    if config == 'all':
+        tasks = [gabor_task, GLCM_combined_task, radiomics_task, LBP_task]
     elif config == 'LBP':
-        texture_features, texture_labels = get_LBP_features(image, mask,
-                                                            parameters['LBP'])
-
+        tasks = [LBP_task]
     elif config == 'GLCM':
-        texture_features, texture_labels = get_GLCM_features(image, mask,
-                                                             parameters['GLCM'])
-
+        tasks = [GLCM_task]
     elif config == 'GLCMMS':
-        texture_features, texture_labels =\
-            get_GLCM_features_multislice(image, mask, parameters['GLCM'])
-
+        tasks = [GLCMMS_task]
     elif config == 'GLRLM':
-        texture_features, texture_labels = get_GLRLM_features(image, mask)
-
+        tasks = [GLRLM_task]
     elif config == 'GLSZM':
-        texture_features, texture_labels = get_GLSZM_features(image, mask)
-
+        tasks = [GLSZM_task]
     elif config == 'NGTDM':
-        texture_features, texture_labels = get_NGTDM_features(image, mask)
-
+        tasks = [NGTDM_task]
     elif config == 'Gabor':
-        texture_features, texture_labels =\
-         gabor_filter_parallel(image, mask,  parameters['gabor_settings'],
-                               n_jobs=n_jobs, backend=backend)
+        tasks = [gabor_task]
+    else:
+        tasks = list()
 
-    return texture_features, texture_labels
+    return tasks
 
 
 def bbox_2D(img, mask):
@@ -15,13 +15,124 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import PREDICT.imagefeatures.histogram_features as hf
-import PREDICT.helpers.image_helper as ih
-from skimage.filters import frangi
+import PREDICT.addexceptions as ae
 import numpy as np
+import scipy.ndimage as ndi
 from skimage import morphology
 
 N_BINS = 50
 
+# Data types in which the vesselness can be computed
+VESSEL_DTYPES = ['uint8', 'float32']
+
+
+def get_vessel_masks(mask, radius=5):
+    '''
+    Compute the masks of the edge and the inner part of the tumor. The inner
+    part is the mask eroded with a disk in each axial slice, which is done
+    in a single 3D morphology call with a flat structuring element.
+
+    NOTE: the edge mask has always been the union of the mask and the inner
+    part, which equals the mask. This is kept for compatibility.
+    '''
+    mask = mask.astype(np.bool)
+    disk = morphology.disk(radius).astype(np.bool)
+    mask_inner = ndi.binary_erosion(mask, structure=disk[:, :, np.newaxis],
+                                    border_value=1)
+    mask_edge = np.logical_or(mask, mask_inner)
+
+    return mask_edge, mask_inner
+
+
+def _prepare_vessel_image(image, dtype):
+    if dtype == 'uint8':
+        # As before, convert to uint8 and scale to [0, 1] as img_as_float
+        return image.astype(np.uint8).astype(np.float64) / 255.0
+
+    # Scale the full intensity range linearly to [0, 1]
+    image = image.astype(np.float32)
+    image_min = np.min(image)
+    image_range = np.max(image) - image_min
+    if image_range == 0:
+        return np.zeros(image.shape, dtype=np.float32)
+    return (image - image_min) / image_range
+
+
+def frangi_stack(image, scale_range=(1, 10), scale_step=2, beta1=0.5,
+                 beta2=15, black_ridges=True, dtype='uint8'):
+    '''
+    Compute the Frangi vesselness of all axial slices of an image at once.
+    This equals applying skimage.filters.frangi (version 0.13) to each slice:
+    per scale, the Hessian of the Gaussian smoothed slice is computed with
+    finite differences and the vesselness is derived from its eigenvalues.
+    The maximum over the scales is returned.
+
+    Parameters
+    ----------
+    image: numpy array, mandatory
+            Image array in x, y, z order.
+
+    scale_range: tuple, default (1, 10)
+            Range of the scales, which are np.arange(*scale_range, scale_step).
+
+    scale_step: float, default 2
+            Step between the scales.
+
+    beta1, beta2: float, default 0.5 and 15
+            Sensitivity to deviation from a blob like structure and to areas
+            of high variance respectively.
+
+    black_ridges: boolean, default True
+            Detect black ridges if True, white ridges if False.
+
+    dtype: string, default 'uint8'
+            If uint8, the image is converted to uint8 as done before, which
+            wraps the intensities outside [0, 255]. If float32, the image is
+            scaled linearly to [0, 1] and the computations are done in
+            float32, which preserves the intensities and saves memory.
+
+    '''
+    if dtype not in VESSEL_DTYPES:
+        raise ae.PREDICTKeyError(('Unknown vessel dtype {}, should be one of {}.').format(dtype, VESSEL_DTYPES))
+
+    image = _prepare_vessel_image(image, dtype)
+    sigmas = np.arange(scale_range[0], scale_range[1], scale_step)
+    beta1 = 2 * beta1 ** 2
+    beta2 = 2 * beta2 ** 2
+
+    vesselness = np.zeros(image.shape, dtype=image.dtype)
+    for sigma in sigmas:
+        # Hessian per slice of the smoothed image, corrected for scale
+        smoothed = ndi.gaussian_filter(image, sigma=(sigma, sigma, 0),
+                                       mode='constant', cval=0)
+        gradient_r = np.gradient(smoothed, axis=0)
+        gradient_c = np.gradient(smoothed, axis=1)
+        del smoothed
+        H_rr = np.gradient(gradient_r, axis=0) * sigma ** 2
+        H_rc = np.gradient(gradient_r, axis=1) * sigma ** 2
+        H_cc = np.gradient(gradient_c, axis=1) * sigma ** 2
+        del gradient_r, gradient_c
+
+        # Eigenvalues, sorted by value
+        root = np.sqrt(4 * H_rc ** 2 + (H_rr - H_cc) ** 2) / 2
+        lambda1 = (H_rr + H_cc) / 2 + root
+        lambda2 = (H_rr + H_cc) / 2 - root
+        del H_rr, H_rc, H_cc, root
+
+        lambda1[lambda1 == 0] = 1e-10
+        rb = (lambda2 / lambda1) ** 2
+        s2 = lambda1 ** 2 + lambda2 ** 2
+        filtered = np.exp(-rb / beta1) * (1 - np.exp(-s2 / beta2))
+
+        if black_ridges:
+            filtered[lambda1 < 0] = 0
+        else:
+            filtered[lambda1 > 0] = 0
+
+        np.maximum(vesselness, filtered, out=vesselness)
+
+    return vesselness
+
 
 def get_vessel_features(image, mask, parameters=dict()):
     # Alternatively, one could use the pxehancement function
@@ -43,57 +154,53 @@ def get_vessel_features(image, mask, parameters=dict()):
     else:
         radius = 5
 
+    if "dtype" in parameters.keys():
+        dtype = parameters["dtype"]
+    else:
+        dtype = 'uint8'
+
     # Make a dummy
     Frangi_features = list()
     Frangi_labels = list()
 
-    # Create different masks for edge and inner tumor
-    disk = morphology.disk(radius)
-    mask_edge = np.zeros(mask.shape)
-    mask_inner = np.zeros(mask.shape)
-    for ind in range(mask.shape[2]):
-        mask_e = morphology.binary_erosion(mask[:, :, ind], disk)
-        mask_edge[:, :, ind] = np.logical_or(mask[:, :, ind], mask_e)
-        mask_inner[:, :, ind] = mask_e
+    # Create different masks for edge and inner tumor, as index sets in the
+    # voxels of the mask
+    mask = mask.astype(np.bool)
+    mask_edge, mask_inner = get_vessel_masks(mask, radius)
+    regions = [('full', np.ones(np.count_nonzero(mask), dtype=np.bool),
+                "[PREDICT Warning] Vessel features, fully empty. Using zeros."),
+               ('edge', mask_edge[mask],
+                "[PREDICT Warning] Vessel features, edge area empty. Using zeros."),
+               ('inner', mask_inner[mask],
+                "[PREDICT Warning] Vessel features, inner area empty. Using zeros.")]
 
     for i_index, (i_sr, i_ss) in enumerate(zip(scale_range, scale_step)):
-        # Compute Frangi Filter image
-        Frangi_image = np.zeros(image.shape)
-        for i_slice in range(0, image.shape[2]):
-            # Note: conversion to uint8, as skimage cannot filter certain float images
-            Frangi_image[:, :, i_slice] = frangi(image[:, :, i_slice].astype(np.uint8), scale_range=i_sr, scale_step=i_ss)
-
-        # Get histogram features of Frangi image for full tumor
-        masked_voxels = ih.get_masked_voxels(Frangi_image, mask)
-        if masked_voxels.size == 0:
-            print("[PREDICT Warning] Vessel features, fully empty. Using zeros.")
-            masked_voxels = [0]
-        histogram_features, histogram_labels = hf.get_histogram_features(masked_voxels, N_BINS)
-        histogram_labels = [l.replace('hf_', 'vf_Frangi_full_') for l in histogram_labels]
-        Frangi_features.extend(histogram_features)
-        final_feature_names = [feature_name + '_SR' + str(i_sr) + '_SS' + str(i_ss) for feature_name in histogram_labels]
-        Frangi_labels.extend(final_feature_names)
-
-        # Get histogram features of Frangi image for edge
-        masked_voxels = ih.get_masked_voxels(Frangi_image, mask_edge)
-        if masked_voxels.size == 0:
-            print("[PREDICT Warning] Vessel features, edge area empty. Using zeros.")
-            masked_voxels = [0]
-        histogram_features, histogram_labels = hf.get_histogram_features(masked_voxels, N_BINS)
-        histogram_labels = [l.replace('hf_', 'vf_Frangi_edge_') for l in histogram_labels]
-        Frangi_features.extend(histogram_features)
-        final_feature_names = [feature_name + '_SR' + str(i_sr) + '_SS' + str(i_ss) for feature_name in histogram_labels]
-        Frangi_labels.extend(final_feature_names)
-
-        # Get histogram features of Frangi image inside tumor only
-        masked_voxels = ih.get_masked_voxels(Frangi_image, mask_inner)
-        if masked_voxels.size == 0:
-            print("[PREDICT Warning] Vessel features, inner area empty. Using zeros.")
-            masked_voxels = [0]
-        histogram_features, histogram_labels = hf.get_histogram_features(masked_voxels, N_BINS)
-        histogram_labels = [l.replace('hf_', 'vf_Frangi_inner_') for l in histogram_labels]
-        Frangi_features.extend(histogram_features)
-        final_feature_names = [feature_name + '_SR' + str(i_sr) + '_SS' + str(i_ss) for feature_name in histogram_labels]
-        Frangi_labels.extend(final_feature_names)
+        # Compute Frangi Filter image and get the response within the mask
+        Frangi_image = frangi_stack(image, scale_range=i_sr, scale_step=i_ss,
+                                    dtype=dtype)
+        Frangi_voxels = Frangi_image[mask].astype(np.float64)
+        del Frangi_image
+
+        # Get histogram features of Frangi image for full tumor, edge and
+        # inside tumor only. If a region covers the full tumor, as the edge
+        # does, the features of the full tumor are reused.
+        full_features = None
+        for name, region, warning in regions:
+            if full_features is not None and np.all(region):
+                histogram_features, histogram_labels = full_features
+            else:
+                masked_voxels = Frangi_voxels[region]
+                if masked_voxels.size == 0:
+                    print(warning)
+                    masked_voxels = [0]
+                histogram_features, histogram_labels =\
+                    hf.get_histogram_features(masked_voxels, N_BINS)
+                if name == 'full':
+                    full_features = (histogram_features, histogram_labels)
+
+            histogram_labels = [l.replace('hf_', 'vf_Frangi_' + name + '_') for l in histogram_labels]
+            Frangi_features.extend(histogram_features)
+            final_feature_names = [feature_name + '_SR' + str(i_sr) + '_SS' + str(i_ss) for feature_name in histogram_labels]
+            Frangi_labels.extend(final_feature_names)
 
     return Frangi_features, Frangi_labels
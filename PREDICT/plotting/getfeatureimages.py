@@ -21,6 +21,7 @@ import SimpleITK as sitk
 import numpy as np
 import os
 from PREDICT.CalcFeatures import load_images
+from PREDICT.IOparser.volume_cache import VolumeCache
 import PREDICT.helpers.image_helper as ih
 import skimage.filters
 from joblib import Parallel, delayed
@@ -40,6 +41,7 @@ sitk.ProcessObject.SetGlobalDefaultCoordinateTolerance(5e-5)
 def getfeatureimages(image, segmentation, gabor_settings=None, image_type=None,
                      parameters=None, types=['LBP'], slicenum=None, save=False):
 
+    volume_cache = None
     if parameters is not None:
         # Load variables from the confilg file
         config = config_io.load_config(parameters)
@@ -48,8 +50,12 @@ def getfeatureimages(image, segmentation, gabor_settings=None, image_type=None,
         gabor_settings = config['ImageFeatures']['gabor_settings']
         image_type = config['ImageFeatures']['image_type']
 
+        if config['General'].get('VolumeCache'):
+            volume_cache = VolumeCache(config['General']['VolumeCache'],
+                                       config['General'].get('VolumeCacheSize'))
+
     print('Calculating image features!')
-    image_data = load_images(image, image_type, None, None)
+    image_data = load_images(image, image_type, None, None, volume_cache)
 
     if type(segmentation) is list:
         segmentation = ''.join(segmentation)
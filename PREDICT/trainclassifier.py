@@ -116,12 +116,17 @@ def trainclassifier(feat_train, patientinfo_train, config,
     print label_type, type(label_type)
 
     # Load the feature files and match to label data
+    load_settings = {'n_jobs': config['General']['Joblib_ncores'],
+                     'cohort_cache': config['General']['CohortCache'] or None,
+                     'pattern': config['Genetics']['patient_pattern'] or None}
     label_data_train, image_features_train =\
-        load_features(feat_train, patientinfo_train, label_type)
+        load_features(feat_train, patientinfo_train, label_type,
+                      **load_settings)
 
     if feat_test:
         label_data_test, image_features_test =\
-            load_features(feat_test, patientinfo_test, label_type)
+            load_features(feat_test, patientinfo_test, label_type,
+                          **load_settings)
 
     # Create tempdir name from patientinfo file name
     basename = os.path.basename(patientinfo_train)
@@ -232,7 +237,8 @@ def trainclassifier(feat_train, patientinfo_train, config,
     print("Saved data!")
 
 
-def load_features(feat, patientinfo, label_type):
+def load_features(feat, patientinfo, label_type, n_jobs=1,
+                  cohort_cache=None, pattern=None):
     ''' Read feature files and stack the features per patient in an array.
         Additionally, if a patient label file is supplied, the features from
         a patient will be matched to the labels.
@@ -253,6 +259,17 @@ def load_features(feat, patientinfo, label_type):
                 List containing all the labels that should be extracted from
                 the patientinfo file.
 
+        n_jobs: integer, default 1
+                Number of processes used to read the feature files.
+
+        cohort_cache: string, optional
+                Folder in which the loaded features are cached for later
+                runs, see file_io.load_data.
+
+        pattern: string, optional
+                Regular expression to extract the patient ID from the feature
+                filenames, see genetic_processing.get_patient_keys.
+
     '''
     # Split the feature files per modality
     feat_temp = list()
@@ -273,6 +290,7 @@ def load_features(feat, patientinfo, label_type):
     # Read the features and classification data
     label_data, image_features =\
         file_io.load_data(feat, patientinfo,
-                          label_type, modnames)
+                          label_type, modnames, n_jobs, cohort_cache,
+                          pattern)
 
     return label_data, image_features
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Seeded inputs and reference outputs for the tests of the feature kernels.
+
+The reference outputs in the data folder were computed on these inputs with
+the implementations of the kernels before they were rewritten (commit
+4a418da), using the SciPy (< 1.9) and scikit-image (0.13) behaviour they
+were written for.
+'''
+
+import os
+import json
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+SHAPE = (40, 36, 6)
+
+
+def get_mask(shape=SHAPE):
+    '''
+    Ellipse with a radius varying over the slices, plus a small second blob
+    in one of the slices.
+    '''
+    x, y = np.mgrid[0:shape[0], 0:shape[1]]
+    mask = np.zeros(shape, dtype=np.uint8)
+    for i_slice in range(shape[2]):
+        scale = 1.0 - 0.1 * abs(i_slice - shape[2] // 2)
+        radii = (12 * scale, 9 * scale)
+        mask[:, :, i_slice] = ((x - 19.5) / radii[0])**2 +\
+            ((y - 16.0) / radii[1])**2 <= 1
+
+    mask[3:7, 29:33, 2] = 1
+    return mask
+
+
+def get_image(shape=SHAPE, dtype=np.float64, seed=0):
+    '''
+    Textured image with an enhancing lesion in the mask. The intensities stay
+    within [-180, 180], so squaring int16 voxels does not overflow.
+    '''
+    random_state = np.random.RandomState(seed)
+    noise = random_state.standard_normal(shape)
+    texture = (noise + np.roll(noise, 1, 0) + np.roll(noise, -1, 0) +
+               np.roll(noise, 1, 1) + np.roll(noise, -1, 1)) / 5.0
+
+    x, y, _ = np.mgrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    image = 50 + 0.3 * x - 0.2 * y + 40 * texture
+    image += 40 * get_mask(shape)
+    image = np.clip(image, -180, 180)
+
+    if np.issubdtype(dtype, np.integer):
+        image = np.round(image)
+
+    return image.astype(dtype)
+
+
+def load_reference(name):
+    '''
+    Load the reference outputs of a kernel: a dictionary with per case the
+    feature values and labels.
+    '''
+    with open(os.path.join(DATA_DIR, name + '.json'), 'r') as fp:
+        return json.load(fp)
+
+
+def check_features(values, labels, reference, rtol=1e-12, atol=0.0):
+    '''
+    Assert that the feature labels equal the reference labels and that the
+    values are equal up to the given tolerance.
+    '''
+    assert list(labels) == reference['feature_labels']
+    values = np.asarray(values, dtype=np.float64)
+    expected = np.asarray(reference['feature_values'], dtype=np.float64)
+    np.testing.assert_allclose(values, expected, rtol=rtol, atol=atol)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import PREDICT.benchmark.run_benchmarks as rb
+
+
+def test_tiny_phantom():
+    # All benchmarks with a reference on the tiny phantom
+    names = [b['name'] for b in rb.BENCHMARKS if any(
+             os.path.exists(rb.get_reference_filename(rb.REFERENCE_DIR, b['name'], 'tiny', modality))
+             for modality in ['CT', 'MR', 'dti', 'dti_post'])]
+    assert 'histogram' in names
+
+    results = rb.run_benchmarks(sizes=['tiny'], modalities=['CT', 'MR'],
+                                names=names, verbose=False)
+    for result in results['benchmarks']:
+        assert result['equivalent'], ('{} {} differs from the reference, max difference {}.').format(result['name'], result['modality'], result['max_difference'])
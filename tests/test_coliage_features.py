@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import PREDICT.imagefeatures.coliage_features as cf
+
+
+def test_coliage_label_order():
+    # Order of the features of previous versions on Python 2
+    random = np.random.RandomState(0)
+    image = random.normal(100, 20, (24, 24, 2))
+    mask = np.zeros(image.shape, dtype=np.uint8)
+    mask[6:18, 6:18, :] = 1
+
+    features, labels = cf.get_coliage_features(image, mask)
+
+    expected = list()
+    for v in [10, 30, 20]:
+        for N in [11, 7]:
+            expected.extend([('cf_nbin{}_windows{}_bin{}').format(v, N, i)
+                             for i in range(v)])
+
+    assert labels == expected
+    assert len(features) == len(labels)
+    for N in [11, 7]:
+        # Each histogram counts all pixels of the ROI
+        counts = [f for f, l in zip(features, labels)
+                  if ('_windows{}_').format(N) in l]
+        assert sum(counts) == 3 * 11 * 11 * 2
+
+
+def test_local_entropies():
+    # Entropy of the GLCM of the window of each pixel, as done previously
+    from skimage.feature import greycomatrix
+    from scipy.stats import entropy
+    random = np.random.RandomState(0)
+    omega = 64
+    theta = random.randint(0, omega, (15, 13))
+    for N in [7, 11]:
+        entropies = cf.get_local_entropies(theta, N, N // 2, N, omega)
+
+        expected = np.zeros(theta.shape)
+        for x in range(0, theta.shape[0]):
+            for y in range(0, theta.shape[1]):
+                window = theta[max(x - N // 2, 0):min(x + N // 2, theta.shape[0]),
+                               max(y - N // 2, 0):min(y + N // 2, theta.shape[1])]
+                GLCM_matrix = greycomatrix(window, [N // 2], [N], levels=omega,
+                                           normed=True)
+                e = entropy(GLCM_matrix[:, :, 0, 0].flatten())
+                # Windows without co-occurrences
+                expected[x, y] = 0 if np.isnan(e) else e
+
+        np.testing.assert_allclose(entropies, expected, rtol=0, atol=1e-13)
+
+
+def test_dominant_orientations():
+    # Orientation of the first singular vector of the gradients in the
+    # window of each pixel, with replicated boundary pixels
+    random = np.random.RandomState(0)
+    gradient_x = random.normal(size=(12, 10, 2))
+    gradient_y = random.normal(size=(12, 10, 2)) + 0.5 * gradient_x
+    N = 5
+    theta = cf.get_dominant_orientations(gradient_x, gradient_y, N)
+
+    expected = np.zeros(theta.shape)
+    for x in range(0, theta.shape[0]):
+        for y in range(0, theta.shape[1]):
+            xc = np.clip(np.arange(x - N // 2, x + N // 2 + 1), 0, theta.shape[0] - 1)
+            yc = np.clip(np.arange(y - N // 2, y + N // 2 + 1), 0, theta.shape[1] - 1)
+            for i_slice in range(0, theta.shape[2]):
+                F = np.stack([gradient_x[np.ix_(xc, yc)][:, :, i_slice].ravel(),
+                              gradient_y[np.ix_(xc, yc)][:, :, i_slice].ravel()], axis=1)
+                U, s, V = np.linalg.svd(F)
+                expected[x, y, i_slice] = np.arctan(V[1, 0] / V[0, 0])
+
+    # The sign of the previous orientation was arbitrary
+    np.testing.assert_allclose(np.abs(theta), np.abs(expected), rtol=0,
+                               atol=1e-12)
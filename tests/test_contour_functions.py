@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import SimpleITK as sitk
+import PREDICT.helpers.contour_functions as cf
+import PREDICT.helpers.contour_functions_3d as cf3
+import PREDICT.imagefeatures.contour_functions as cfi
+import PREDICT.helpers.sitk_helper as sitkh
+from reference import get_mask, load_reference
+
+
+def check_points(points, expected):
+    points = np.asarray(points)
+    expected = np.asarray(expected)
+    assert points.shape == expected.shape
+    np.testing.assert_allclose(points, expected, rtol=0, atol=1e-12)
+
+
+def test_contour_points_2D():
+    reference = load_reference('contours')
+    blob = sitk.GetImageFromArray(get_mask()[:, :, 3].T.astype(np.uint8))
+    blob.SetSpacing((0.7, 0.9))
+    blob.SetOrigin((-10.0, 5.0))
+
+    check_points(cf.get_contour_boundary_points(blob),
+                 reference['boundary_2D'])
+    check_points(cf.get_smooth_contour(blob, 3, 15), reference['smooth_2D'])
+
+
+def test_contour_points_3D():
+    # The 3D and imagefeatures modules re-export the helpers module
+    reference = load_reference('contours')
+    contour = sitkh.GetImageFromArray(get_mask())
+    contour.SetSpacing((0.7, 0.9, 3.0))
+    contour.SetOrigin((-10.0, 5.0, 20.0))
+
+    for module in [cf, cf3, cfi]:
+        check_points(module.get_contour_boundary_points(contour),
+                     reference['boundary_3D'])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import SimpleITK as sitk
+import PREDICT.IOparser.file_io as IO
+
+
+def write_series(folder, N_slices=6):
+    '''
+    Write an oblique int16 CT series with a rescale intercept, with the files
+    named in the reverse order of the slices.
+    '''
+    random = np.random.RandomState(0)
+    array = random.randint(-200, 1500, (N_slices, 20, 16)).astype(np.int16)
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing((0.7, 0.9, 2.5))
+    image.SetOrigin((-20.0, 10.0, 5.0))
+    c, s = np.cos(0.3), np.sin(0.3)
+    rotation_z = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    c, s = np.cos(0.2), np.sin(0.2)
+    rotation_x = np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+    direction = rotation_z.dot(rotation_x)
+    image.SetDirection(tuple(direction.flatten()))
+
+    series_uid = '1.2.826.0.1.3680043.2.1125.1.1'
+    orientation = '\\'.join([str(v) for v in
+                             list(direction[:, 0]) + list(direction[:, 1])])
+    writer = sitk.ImageFileWriter()
+    writer.KeepOriginalImageUIDOn()
+    for i_slice in range(0, N_slices):
+        position = image.TransformIndexToPhysicalPoint((0, 0, i_slice))
+        tags = {'0008|0060': 'CT',
+                '0020|000d': '1.2.826.0.1.3680043.2.1125.1',
+                '0020|000e': series_uid,
+                '0008|0018': ('{}.{}').format(series_uid, i_slice),
+                '0020|0013': str(i_slice + 1),
+                '0020|0032': '\\'.join([str(p) for p in position]),
+                '0020|0037': orientation,
+                '0028|1052': '-1024',
+                '0028|1053': '1'}
+        slice_image = image[:, :, i_slice]
+        for tag, value in tags.items():
+            slice_image.SetMetaData(tag, value)
+
+        writer.SetFileName(os.path.join(folder, ('IM{}.dcm').format(N_slices - 1 - i_slice)))
+        writer.Execute(slice_image)
+
+
+def check_images(image, expected):
+    assert image.GetSize() == expected.GetSize()
+    assert image.GetPixelID() == expected.GetPixelID()
+    np.testing.assert_allclose(image.GetSpacing(), expected.GetSpacing(),
+                               rtol=0, atol=1e-6)
+    np.testing.assert_allclose(image.GetOrigin(), expected.GetOrigin(),
+                               rtol=0, atol=1e-6)
+    np.testing.assert_allclose(image.GetDirection(), expected.GetDirection(),
+                               rtol=0, atol=1e-6)
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(image),
+                                  sitk.GetArrayFromImage(expected))
+
+
+def test_load_dicom():
+    # Same dtype, rescaling and geometry as the SimpleITK series reader
+    folder = tempfile.mkdtemp()
+    try:
+        write_series(folder)
+        expected, _ = IO.load_dicom_sitk(folder)
+        image, metadata = IO.load_dicom(folder, n_jobs=1)
+        check_images(image, expected)
+        assert expected.GetPixelID() == sitk.sitkInt32
+
+        # The files of the series can also be given as a list
+        files = [os.path.join(folder, f) for f in os.listdir(folder)]
+        image, _ = IO.load_dicom(files, n_jobs=2)
+        check_images(image, expected)
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_load_dicom_fallback():
+    # Pixel data pydicom cannot decode is read with SimpleITK
+    folder = tempfile.mkdtemp()
+    read_dicom_volume = IO.read_dicom_volume
+    try:
+        write_series(folder)
+        expected, _ = IO.load_dicom_sitk(folder)
+
+        def fail(*args, **kwargs):
+            raise NotImplementedError('Unsupported transfer syntax')
+
+        IO.read_dicom_volume = fail
+        image, _ = IO.load_dicom(folder, n_jobs=1)
+        check_images(image, expected)
+    finally:
+        IO.read_dicom_volume = read_dicom_volume
+        shutil.rmtree(folder)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from dicom.dataset import Dataset, FileDataset
+import PREDICT.helpers.sitk_helper as sitkh
+import PREDICT.IOparser.file_io as IO
+import PREDICT.imagefeatures.dti_features as dtif
+
+B_VALUES = [0, 500, 1000]
+
+
+def write_dti_series(folder, N_slices=5, rows=12, columns=10):
+    '''
+    Write a GE DTI series with a block of slices per b-value.
+    '''
+    random = np.random.RandomState(0)
+    series_uid = '1.2.826.0.1.3680043.2.1125.2.1'
+    i_file = 0
+    for b_value in B_VALUES:
+        for i_slice in range(0, N_slices):
+            filename = os.path.join(folder, ('IM{}.dcm').format(i_file))
+            file_meta = Dataset()
+            file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+            file_meta.MediaStorageSOPInstanceUID = ('{}.{}').format(series_uid, i_file)
+            file_meta.TransferSyntaxUID = '1.2.840.10008.1.2.1'
+            ds = FileDataset(filename, {}, file_meta=file_meta,
+                             preamble=b'\0' * 128)
+            ds.is_little_endian = True
+            ds.is_implicit_VR = False
+            ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+            ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+            ds.SeriesInstanceUID = series_uid
+            ds.Modality = 'MR'
+            ds.Manufacturer = 'GE MEDICAL SYSTEMS'
+            ds.InstanceNumber = i_file + 1
+            ds.ImagePositionPatient = [-20.0, 10.0, 5.0 + 2.5 * i_slice]
+            ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+            ds.PixelSpacing = [0.7, 0.9]
+            ds.SliceThickness = 2.5
+            ds.Rows = rows
+            ds.Columns = columns
+            ds.SamplesPerPixel = 1
+            ds.PhotometricInterpretation = 'MONOCHROME2'
+            ds.BitsAllocated = 16
+            ds.BitsStored = 16
+            ds.HighBit = 15
+            ds.PixelRepresentation = 0
+            ds.add_new((0x43, 0x1039), 'IS', [b_value, 8, 0, 0])
+            ds.add_new((0x19, 0x10bb), 'DS', 0.5)
+            ds.add_new((0x19, 0x10bc), 'DS', 0.5)
+            ds.add_new((0x19, 0x10bd), 'DS', 0.7)
+            signal = 1000 * np.exp(-0.001 * b_value) * random.uniform(0.5, 1.5, (rows, columns))
+            ds.PixelData = signal.astype(np.uint16).tobytes()
+            ds.save_as(filename)
+            i_file += 1
+
+
+def test_fit_ADC():
+    # Equal to a least squares solve on all voxels at once
+    random = np.random.RandomState(0)
+    b_values = [0, 500, 1000, 1500]
+    voxels = random.randint(0, 2000, (len(b_values), 500)).astype(np.int16)
+
+    ADC = dtif.fit_ADC(voxels, b_values)
+
+    A = np.vstack([b_values, np.ones(len(b_values))]).T
+    signal = voxels + np.min(voxels) + 1
+    expected = -np.linalg.lstsq(A, np.log(signal), rcond=None)[0][0, :]
+    np.testing.assert_allclose(ADC, expected, rtol=1e-10, atol=1e-15)
+
+
+def test_load_DTI_voxels():
+    folder = tempfile.mkdtemp()
+    try:
+        write_dti_series(folder)
+        images, meta_data = IO.load_DTI(folder, n_jobs=1)
+        assert meta_data['b_values'] == B_VALUES
+
+        # Masks on all slices and leaving out the first and last slices
+        for slices in [slice(0, 5), slice(1, 4)]:
+            mask = np.zeros((10, 12, 5), dtype=np.uint8)
+            mask[2:8, 3:10, slices] = 1
+            mask[4, 1, 2] = 1
+            mask_image = sitkh.GetImageFromArray(mask)
+
+            voxels, voxels_meta_data = IO.load_DTI_voxels(folder, mask_image,
+                                                          n_jobs=2)
+            expected = dtif.get_masked_voxels(images, mask_image)
+            assert voxels.dtype == expected.dtype
+            np.testing.assert_array_equal(voxels, expected)
+            assert voxels_meta_data['b_values'] == B_VALUES
+
+            features, _ = dtif.get_dti_features(voxels, mask_image,
+                                                voxels_meta_data)
+            expected_features, _ = dtif.get_dti_features(images, mask_image,
+                                                         meta_data)
+            np.testing.assert_array_equal(features, expected_features)
+    finally:
+        shutil.rmtree(folder)
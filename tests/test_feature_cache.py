@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import shutil
+import tempfile
+import numpy as np
+import PREDICT.imagefeatures.feature_cache as fcache
+
+
+def get_cache_size(cache_dir):
+    return sum([os.path.getsize(f) for f in
+                glob.glob(os.path.join(cache_dir, '*.json'))])
+
+
+def test_feature_cache_eviction():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # Room for about 70 entries of 50 features
+        cache = fcache.FeatureCache(cache_dir, max_size=0.1)
+        labels = [('hf_{}').format(i) for i in range(50)]
+        scans = [0]
+        evict = cache.evict
+
+        def counted_evict():
+            scans[0] += 1
+            evict()
+
+        cache.evict = counted_evict
+        for i_entry in range(300):
+            values = list(np.random.RandomState(i_entry).rand(50))
+            cache.save(str(i_entry), 'histogram', values, labels)
+            assert cache.size == get_cache_size(cache_dir)
+
+        # The folder is only scanned initially and when the limit is exceeded
+        assert scans[0] < 60
+        assert cache.size <= 0.1 * 1024 * 1024
+
+        # The most recent entries are kept
+        assert cache.load('299', 'histogram') is not None
+        assert cache.load('0', 'histogram') is None
+    finally:
+        shutil.rmtree(cache_dir)
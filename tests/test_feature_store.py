@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import PREDICT.addexceptions as ae
+from PREDICT.IOparser.feature_store import FeatureStore
+
+LABELS = ['hf_mean', 'hf_std', 'sf_area', 'tf_LBP_mean']
+
+
+def create_store(folder, dtype=np.float64):
+    store = FeatureStore(os.path.join(folder, 'features.hdf5'), dtype)
+    store.append('Patient1', [1, 2, 3, 4], LABELS, 'CT')
+    store.append('Patient2', [5, 6, 7, 8], LABELS, 'CT')
+    store.append('Patient3', [9, 10, 11, 12], LABELS, 'CT')
+    return store
+
+
+def test_append_matches_labels():
+    folder = tempfile.mkdtemp()
+    try:
+        store = create_store(folder)
+
+        # Reordered labels and a missing label, which is stored as NaN
+        store.append('Patient4', [16, 13, 14], ['tf_LBP_mean', 'hf_mean', 'hf_std'])
+        store.append_rows(['Patient5'], [[20, 17]], ['tf_LBP_mean', 'hf_mean'])
+
+        values, patient_IDs, labels = store.load()
+        assert labels == LABELS
+        assert patient_IDs == ['Patient1', 'Patient2', 'Patient3',
+                               'Patient4', 'Patient5']
+        np.testing.assert_array_equal(values[3], [13, 14, np.nan, 16])
+        np.testing.assert_array_equal(values[4], [17, np.nan, np.nan, 20])
+
+        # Unknown labels are not added to the store
+        try:
+            store.append('Patient6', [1, 2], ['hf_mean', 'hf_unknown'])
+        except ae.PREDICTValueError:
+            pass
+        else:
+            raise AssertionError('Unknown label did not raise an error.')
+
+        _, patient_IDs, _ = store.load()
+        assert 'Patient6' not in patient_IDs
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_duplicate_patient():
+    folder = tempfile.mkdtemp()
+    try:
+        store = create_store(folder)
+        store.append('Patient2', [50, 60, 70, 80], LABELS, 'CT')
+
+        # The last entry is used, at the position of the first one
+        values, patient_IDs, _ = store.load()
+        assert patient_IDs == ['Patient1', 'Patient2', 'Patient3']
+        np.testing.assert_array_equal(values[1], [50, 60, 70, 80])
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_load_order():
+    folder = tempfile.mkdtemp()
+    try:
+        store = create_store(folder)
+
+        values, patient_IDs, labels = store.load(features=['tf_LBP_mean', 'hf_mean'])
+        assert labels == ['tf_LBP_mean', 'hf_mean']
+        np.testing.assert_array_equal(values, [[4, 1], [8, 5], [12, 9]])
+
+        values, patient_IDs, labels = store.load(patient_IDs=['Patient3', 'Patient1'])
+        assert patient_IDs == ['Patient3', 'Patient1']
+        assert labels == LABELS
+        np.testing.assert_array_equal(values, [[9, 10, 11, 12], [1, 2, 3, 4]])
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_compact():
+    folder = tempfile.mkdtemp()
+    try:
+        for dtype in [np.float32, np.float64]:
+            store = create_store(folder, dtype)
+            store.append('Patient1', [0.1, 0.2, 0.3, 0.4], LABELS, 'CT')
+            expected, expected_IDs, _ = store.load()
+            assert expected.dtype == dtype
+
+            # Opened without a dtype, as done when loading the features
+            store = FeatureStore(store.filename)
+            store.compact()
+            values, patient_IDs, labels = store.load()
+            assert values.dtype == dtype
+            assert patient_IDs == expected_IDs
+            assert labels == LABELS
+            np.testing.assert_array_equal(values, expected)
+            os.remove(store.filename)
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import PREDICT.imagefeatures.histogram_features as hf
+from reference import get_image, get_mask, load_reference, check_features
+
+
+def get_voxels():
+    mask = get_mask() > 0
+    return {'float64': get_image()[mask],
+            'int16': get_image(dtype=np.int16)[mask]}
+
+
+def test_histogram_features():
+    reference = load_reference('histogram')
+    voxels = get_voxels()
+
+    features, labels = hf.get_histogram_features(voxels['float64'], 50)
+    check_features(features, labels, reference['float64'], atol=1e-12)
+
+    # Constant data gives a skewness of 0 and a kurtosis of -3
+    features, labels = hf.get_histogram_features(np.full(100, 7.0), 50)
+    check_features(features, labels, reference['constant'], atol=1e-12)
+
+    # The energy used to overflow for integer data, so it is compared with
+    # the energy computed in floating point instead
+    features, labels = hf.get_histogram_features(voxels['int16'], 50)
+    energy = labels.index('hf_energy')
+    data = voxels['int16'].astype(np.float64)
+    assert features[energy] == np.sum((data + np.min(data))**2)
+
+    expected = dict(reference['int16'])
+    expected['feature_values'] = list(expected['feature_values'])
+    expected['feature_values'][energy] = features[energy]
+    check_features(features, labels, expected, atol=1e-12)
+
+
+def test_histogram_features_batch():
+    voxels = get_voxels()
+    data = np.vstack([voxels['float64'], voxels['int16']])
+    batch_features, batch_labels = hf.get_histogram_features_batch(data, 50)
+    for i_map, name in enumerate(['float64', 'int16']):
+        features, labels = hf.get_histogram_features(voxels[name], 50)
+        assert batch_labels == labels
+        assert batch_features[i_map] == features
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import SimpleITK as sitk
+import PREDICT.helpers.sitk_helper as sitkh
+import PREDICT.IOparser.file_io as IO
+from PREDICT.helpers.roi_context import ROIContext
+
+MARGIN = 3
+
+
+def write_image_and_mask(folder):
+    random = np.random.RandomState(0)
+    image = sitkh.GetImageFromArray(random.randint(-1000, 1000, (40, 30, 12)).astype(np.int16))
+    mask_array = np.zeros((40, 30, 12), dtype=np.uint8)
+    mask_array[12:20, 8:15, 4:7] = 1
+    mask_array[21, 16, 7] = 1
+    mask = sitkh.GetImageFromArray(mask_array)
+    for i in [image, mask]:
+        i.SetSpacing((0.7, 0.9, 2.5))
+        i.SetOrigin((-20.0, 10.0, 5.0))
+        i.SetDirection((0.0, 1.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0))
+
+    image_file = os.path.join(folder, 'image.nii')
+    mask_file = os.path.join(folder, 'mask.nii')
+    sitk.WriteImage(image, image_file)
+    sitk.WriteImage(mask, mask_file)
+    return image_file, mask_file
+
+
+def check_images(image, expected):
+    assert image.GetSize() == expected.GetSize()
+    assert image.GetPixelID() == expected.GetPixelID()
+    assert image.GetSpacing() == expected.GetSpacing()
+    assert image.GetOrigin() == expected.GetOrigin()
+    assert image.GetDirection() == expected.GetDirection()
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(image),
+                                  sitk.GetArrayFromImage(expected))
+
+
+def test_read_image_region():
+    folder = tempfile.mkdtemp()
+    try:
+        image_file, mask_file = write_image_and_mask(folder)
+        image = sitk.ReadImage(image_file)
+        mask = sitk.ReadImage(mask_file)
+
+        index, size = IO.get_mask_region(mask, MARGIN)
+        assert index == (9, 5, 1)
+        assert size == (16, 15, 10)
+        assert IO.read_image_size(image_file) == image.GetSize()
+
+        region = IO.read_image_region(image_file, index, size)
+        check_images(region, sitk.RegionOfInterest(image, size, index))
+        assert region.GetOrigin() == image.TransformIndexToPhysicalPoint(index)
+
+        # The full image is needed without a margin
+        assert IO.get_mask_region(mask, None) == (None, None)
+        assert IO.get_mask_region(mask, -1) == (None, None)
+        check_images(IO.read_image_region(image_file), image)
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_roi_context_region():
+    # The features are computed on the same crop as for the full image
+    folder = tempfile.mkdtemp()
+    try:
+        image_file, mask_file = write_image_and_mask(folder)
+        mask = sitk.ReadImage(mask_file)
+        expected = ROIContext(sitk.ReadImage(image_file), mask, MARGIN)
+
+        index, size = IO.get_mask_region(mask, MARGIN)
+        roi = ROIContext(IO.read_image_region(image_file, index, size),
+                         IO.read_image_region(mask_file, index, size),
+                         MARGIN, offset=index)
+
+        np.testing.assert_array_equal(roi.image, expected.image)
+        np.testing.assert_array_equal(roi.mask, expected.mask)
+        np.testing.assert_array_equal(roi.masked_voxels, expected.masked_voxels)
+        np.testing.assert_array_equal(roi.shape_mask, expected.shape_mask)
+        assert roi.spacing == expected.spacing
+        assert roi.get_origin() == expected.get_origin()
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import PREDICT.genetics.genetic_processing as gp
+import PREDICT.IOparser.file_io as IO
+
+
+def test_match_exact():
+    filenames = ['/data/Patient2.hdf5', '/data/Patient1.hdf5',
+                 '/data/Patient10.hdf5']
+    matches = gp.match_patients(['Patient1', 'Patient2', 'Patient3'], filenames)
+    assert matches == [[1], [0], []]
+
+
+def test_match_patient_ID_prefix():
+    # Patient1 is not also matched to the files of Patient10
+    filenames = ['/data/Pat10.hdf5', '/data/features_Pat10_0.hdf5',
+                 '/data/Pat1.hdf5', '/data/features_Pat1_0.hdf5',
+                 '/data/Pat1/features.hdf5']
+    matches = gp.match_patients(['Pat1', 'Pat10'], filenames)
+    assert matches == [[2, 3, 4], [0, 1]]
+
+
+def test_match_pattern():
+    filenames = ['/data/features_Pat_001_CT.hdf5', '/data/features_Pat_002_CT.hdf5',
+                 '/data/other.hdf5']
+
+    # Named group
+    pattern = r'features_(?P<patient>Pat_\d+)_CT'
+    matches = gp.match_patients(['Pat_002', 'Pat_001', 'Pat_003'], filenames,
+                                pattern)
+    assert matches == [[1], [0], []]
+
+    # Positional group
+    pattern = r'features_(Pat_\d+)_CT'
+    matches = gp.match_patients(['Pat_001', 'Pat_002'], filenames, pattern)
+    assert matches == [[0], [1]]
+
+    # No search in the filenames for patients which are not matched
+    matches = gp.match_patients(['001'], filenames, pattern)
+    assert matches == [[]]
+
+
+def test_match_substring():
+    # IDs which are not a token of the filenames are searched in all names
+    filenames = ['/data/scanPat1x.hdf5', '/data/scanPat2x.hdf5',
+                 '/data/scanPat1y.hdf5']
+    matches = gp.match_patients(['Pat1', 'Pat2'], filenames)
+    assert matches == [[0, 2], [1]]
+
+
+def write_feature_files(folder, n_patients=3):
+    featurefiles = list()
+    for modality, n_features in [('CT', 4), ('MR', 3)]:
+        files = list()
+        for i_patient in range(n_patients):
+            filename = os.path.join(folder, ('features_{}_{}.hdf5').format(modality, i_patient))
+            values = list(np.random.RandomState(i_patient).rand(n_features))
+            labels = [('hf_{}').format(i) for i in range(n_features)]
+            panda_data = pd.Series([[modality], dict(), values, labels],
+                                   index=['image_type', 'parameters',
+                                          'feature_values', 'feature_labels'],
+                                   name='Image features')
+            panda_data.to_hdf(filename, 'image_features')
+            files.append(filename)
+        featurefiles.append(files)
+    return featurefiles
+
+
+def test_cohort_cache():
+    folder = tempfile.mkdtemp()
+    read_feature_file = IO.read_feature_file
+    try:
+        featurefiles = write_feature_files(folder)
+        cohort_cache = os.path.join(folder, 'cache')
+
+        # The first call writes a store per modality
+        expected = IO.load_feature_files(featurefiles, ['CT', 'MR'],
+                                         cohort_cache=cohort_cache)
+        cache_files = glob.glob(os.path.join(cohort_cache, 'cohort_*.hdf5'))
+        assert len(cache_files) == 2
+        assert len(expected) == 3
+        assert expected[0][1] == ['hf_0_CT', 'hf_1_CT', 'hf_2_CT', 'hf_3_CT',
+                                  'hf_0_MR', 'hf_1_MR', 'hf_2_MR']
+
+        # The second call only reads the cache
+        def fail(featurefile):
+            raise AssertionError('Feature file read instead of the cohort cache.')
+
+        IO.read_feature_file = fail
+        image_features = IO.load_feature_files(featurefiles, ['CT', 'MR'],
+                                               cohort_cache=cohort_cache)
+        for (values, labels), (expected_values, expected_labels) in zip(image_features, expected):
+            np.testing.assert_array_equal(values, expected_values)
+            assert labels == expected_labels
+
+        # A modified file invalidates the cache
+        stat = os.stat(featurefiles[1][2])
+        os.utime(featurefiles[1][2], (stat.st_atime, stat.st_mtime + 10))
+        try:
+            IO.load_feature_files(featurefiles, ['CT', 'MR'],
+                                  cohort_cache=cohort_cache)
+        except AssertionError:
+            pass
+        else:
+            raise AssertionError('Cohort cache used after modifying a feature file.')
+
+        IO.read_feature_file = read_feature_file
+        image_features = IO.load_feature_files(featurefiles, ['CT', 'MR'],
+                                               cohort_cache=cohort_cache)
+        assert len(glob.glob(os.path.join(cohort_cache, 'cohort_*.hdf5'))) == 4
+        for (values, _), (expected_values, _) in zip(image_features, expected):
+            np.testing.assert_array_equal(values, expected_values)
+    finally:
+        IO.read_feature_file = read_feature_file
+        shutil.rmtree(folder)
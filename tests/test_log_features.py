@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import scipy.ndimage as ndi
+import PREDICT.imagefeatures.log_features as logf
+
+
+def get_image(shape=(128, 128, 4)):
+    random = np.random.RandomState(0)
+    return ndi.gaussian_filter(random.normal(size=shape), (2, 2, 0))
+
+
+def direct_log(image, sigma, spacing=(1.0, 1.0, 1.0), mode='2D'):
+    '''
+    Scale normalized LoG with the full sigma applied to the image.
+    '''
+    spacing = np.asarray(spacing, dtype=np.float64)
+    voxels = sigma / spacing
+    axes = [0, 1, 2]
+    if mode == '2D':
+        voxels[2] = 0
+        axes = [0, 1]
+
+    LoG_image = np.zeros(image.shape)
+    for axis in axes:
+        order = [0] * image.ndim
+        order[axis] = 2
+        LoG_image += ndi.gaussian_filter(image, voxels, order=order,
+                                         mode='reflect') / spacing[axis]**2
+
+    return sigma**2 * LoG_image
+
+
+def check_log_images(sigma, spacing=(1.0, 1.0, 1.0), mode='2D', rtol=1e-2):
+    image = get_image()
+    LoG_images = logf.get_log_images(image, sigma, spacing, mode)
+    for i_sigma, LoG_image in zip(sigma, LoG_images):
+        expected = direct_log(image, i_sigma, spacing, mode)
+        error = np.max(np.abs(LoG_image - expected)) / np.max(np.abs(expected))
+        assert error < rtol, ('sigma {}: relative error {}').format(i_sigma, error)
+
+
+def test_log_close_sigmas():
+    # Increments below one voxel are not chained
+    check_log_images([1, 1.1], rtol=1e-12)
+    check_log_images([1.2, 1, 1.1, 1.1], rtol=1e-12)
+
+
+def test_log_far_sigmas():
+    check_log_images([1, 5, 10])
+    check_log_images([10, 1, 5])
+
+
+def test_log_3D():
+    check_log_images([1, 1.1], spacing=(0.7, 0.7, 3.0), mode='3D',
+                     rtol=1e-12)
+    check_log_images([1, 5, 10], spacing=(0.7, 0.7, 3.0), mode='3D')
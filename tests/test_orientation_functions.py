@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import PREDICT.helpers.orientation_functions as orf
+from reference import load_reference
+
+
+def test_data_regularize():
+    # Sector means with np.digitize and np.bincount, equal to the loops
+    reference = load_reference('orientation')
+    random_state = np.random.RandomState(0)
+    points = random_state.standard_normal((500, 3)) * [10, 6, 4] + [20, -3, 7]
+    for regularization in ['spheric', 'cubic']:
+        regularized = orf.data_regularize(points, type=regularization, divs=8)
+        expected = np.asarray(reference[regularization])
+        assert regularized.shape == expected.shape
+        np.testing.assert_allclose(regularized, expected, rtol=1e-12)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import PREDICT.imagefeatures.phase_features as phasef
+from reference import get_image, get_mask, load_reference, check_features
+
+PARAMETERS = {'minwavelength': [3],
+              'nscale': [5]}
+
+
+def test_phase_features():
+    # Shared FFTs and cached filter bank, identical to phasecongmono and
+    # phasesymmono
+    reference = load_reference('phase')
+    mask = get_mask().astype(bool)
+    images = {'float64': get_image(), 'int16': get_image(dtype=np.int16)}
+    for name, image in images.items():
+        for n_jobs in [1, 2]:
+            features, labels = phasef.get_phase_features(image, mask,
+                                                         PARAMETERS, n_jobs)
+            check_features(features, labels, reference[name], rtol=1e-12,
+                           atol=1e-12)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from PREDICT.helpers.profiling import Tracer, get_peak_rss
+
+
+def allocate(megabytes):
+    return np.ones(int(megabytes * 1024 * 1024 / 8)).sum()
+
+
+def test_peak_rss_increase():
+    if get_peak_rss() is None:
+        # Not supported on this platform
+        return
+
+    tracer = Tracer()
+    tracer.call('large', allocate, (200,))
+    with tracer.trace('small'):
+        allocate(10)
+
+    large, small = [e['args']['peak_rss_increase'] for e in tracer.events]
+
+    # The peak set by the large group is not attributed to the small group
+    assert large > 150
+    assert small < 50
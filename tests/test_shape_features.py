@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import PREDICT.imagefeatures.shape_features as sf
+import PREDICT.helpers.sitk_helper as sitkh
+from reference import get_mask, load_reference, check_features
+
+
+def test_shape_features_2D():
+    # Boundaries of all blobs traced at once on the full slice, bit-identical
+    # to tracing each blob separately
+    reference = load_reference('shape')
+    mask = get_mask()
+    for n_jobs in [1, 2]:
+        features, labels = sf.get_shape_features(mask, n_jobs=n_jobs)
+        check_features(features, labels, reference['mask'], rtol=0)
+
+    features, labels = sf.get_shape_features(sitkh.GetImageFromArray(mask))
+    check_features(features, labels, reference['mask'], rtol=0)
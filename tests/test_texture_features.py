@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import PREDICT.imagefeatures.texture_features as tf
+from reference import get_image, get_mask, load_reference, check_features
+
+IMAGES = {'float64': get_image(), 'int16': get_image(dtype=np.int16)}
+
+GABOR = {'gabor_frequencies': [0.05, 0.2, 0.5],
+         'gabor_angles': list(np.radians([0, 45, 90, 135]))}
+
+
+def test_gabor_features():
+    # Frequency domain filtering, equal up to floating point rounding
+    reference = load_reference('gabor')
+    mask = get_mask().astype(bool)
+    for name, image in IMAGES.items():
+        features, labels = tf.gabor_filter_parallel(image, mask, GABOR)
+        check_features(features, labels, reference[name], rtol=1e-10,
+                       atol=1e-12)
+
+
+GLCM = {'levels': 16,
+        'angles': [0, np.pi/4, np.pi/2, 3*np.pi/4],
+        'distances': [1, 3]}
+
+
+def test_GLCM_features():
+    # Batched GLCM tensor, equal to the per slice greycomatrix to 1e-13
+    reference = load_reference('glcm')
+    mask = get_mask().astype(bool)
+    for name, image in IMAGES.items():
+        original = image.copy()
+        features, labels = tf.get_GLCM_features(image, mask, GLCM)
+        check_features(features, labels, reference['GLCM_' + name],
+                       rtol=1e-13, atol=1e-13)
+
+        features, labels = tf.get_GLCM_features_multislice(image, mask, GLCM)
+        check_features(features, labels, reference['GLCMMS_' + name],
+                       rtol=1e-13, atol=1e-13)
+
+        # The image shared with the other texture groups is not modified
+        assert np.array_equal(image, original)
+
+
+LBP = {'radius': [3, 8],
+       'N_points': [12, 24]}
+
+
+def test_LBP_features():
+    # Codes on the ROI and statistics from their histogram
+    reference = load_reference('lbp')
+    mask = get_mask().astype(bool)
+    for name, image in IMAGES.items():
+        for n_jobs in [1, 2]:
+            features, labels = tf.get_LBP_features(image, mask, LBP, n_jobs)
+            check_features(features, labels, reference[name], rtol=1e-12,
+                           atol=1e-12)
+
+
+def test_LBP_codes():
+    # The codes on the ROI equal those of the full slices, including ties
+    from skimage.feature import local_binary_pattern
+    from PREDICT.benchmark.run_benchmarks import get_case
+    case = get_case('image', 'tumour', 'CT')
+    image, mask = case['image'], case['mask'].astype(bool)
+    for radius, N_points in zip(LBP['radius'], LBP['N_points']):
+        codes = tf.get_LBP_codes(image, mask, radius, N_points)
+        expected = [local_binary_pattern(image[:, :, i_slice], P=N_points,
+                                         R=radius, method='uniform')[mask[:, :, i_slice]]
+                    for i_slice in range(0, image.shape[2])]
+        np.testing.assert_array_equal(codes, np.concatenate(expected))
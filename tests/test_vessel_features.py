@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import PREDICT.imagefeatures.vessel_features as vesf
+from reference import get_image, get_mask, load_reference, check_features
+
+PARAMETERS = {'scale_range': [1, 10],
+              'scale_step': [2],
+              'radius': 5}
+
+
+def test_vessel_features():
+    # Frangi filter of skimage 0.13 on the full stack, which matches the
+    # per slice filtering to about 1e-14
+    reference = load_reference('vessel')
+    mask = get_mask().astype(bool)
+    images = {'float64': get_image(), 'int16': get_image(dtype=np.int16)}
+    for name, image in images.items():
+        features, labels = vesf.get_vessel_features(image, mask, PARAMETERS)
+        check_features(features, labels, reference[name], rtol=1e-12,
+                       atol=1e-12)
+
+
+def test_vessel_features_float32():
+    mask = get_mask().astype(bool)
+    features, labels = vesf.get_vessel_features(get_image(), mask,
+                                                dict(PARAMETERS,
+                                                     dtype='float32'))
+    assert labels == load_reference('vessel')['float64']['feature_labels']
+    assert np.all(np.isfinite(features))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Copyright 2017-2019 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import PREDICT.helpers.sitk_helper as sitkh
+from PREDICT.IOparser.volume_cache import VolumeCache
+
+SPACING = (0.7, 0.9, 2.5)
+ORIGIN = (-20.0, 10.0, 5.0)
+DIRECTION = (0.0, 1.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, -1.0)
+
+
+def test_save_load():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = VolumeCache(cache_dir)
+        volume = np.random.RandomState(0).randint(-1024, 2000, (16, 12, 5)).astype(np.int32)
+        cache.save('key', volume, SPACING, ORIGIN, DIRECTION, '1.2.3')
+
+        image = cache.load('key')
+        assert image.GetSpacing() == SPACING
+        assert image.GetOrigin() == ORIGIN
+        assert image.GetDirection() == DIRECTION
+        array = sitkh.GetArrayFromImage(image)
+        assert array.dtype == np.int32
+        np.testing.assert_array_equal(array, volume)
+
+        # The array itself is available as a memory map
+        array, sidecar = cache.load_array('key')
+        assert isinstance(array, np.memmap)
+        np.testing.assert_array_equal(array, volume)
+        assert sidecar['series_uid'] == '1.2.3'
+
+        assert cache.load('unknown') is None
+        assert cache.hits == 2
+        assert cache.misses == 1
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_eviction():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # Room for two volumes of 0.4 MB
+        cache = VolumeCache(cache_dir, max_size=1)
+        volume = np.zeros((100, 100, 10), dtype=np.float32)
+        for i_entry in range(0, 3):
+            cache.save(str(i_entry), volume, SPACING, ORIGIN, DIRECTION)
+            # Distinct modification times for the least recently used order
+            time.sleep(0.05)
+
+        assert cache.load('0') is None
+        assert cache.load('1') is not None
+        assert cache.load('2') is not None
+
+        # Loading marks an entry as recently used
+        time.sleep(0.05)
+        cache.load('1')
+        time.sleep(0.05)
+        cache.save('3', volume, SPACING, ORIGIN, DIRECTION)
+        assert cache.load('1') is not None
+        assert cache.load('2') is None
+        assert cache.load('3') is not None
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_key():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = VolumeCache(cache_dir)
+        files = list()
+        for i_file in range(0, 3):
+            filename = os.path.join(cache_dir, ('IM{}.dcm').format(i_file))
+            with open(filename, 'wb') as fp:
+                fp.write(b'\0' * 16)
+            files.append(filename)
+
+        key = cache.get_key('1.2.3', files)
+        assert cache.get_key('1.2.3', files) == key
+        assert cache.get_key('1.2.4', files) != key
+        assert cache.get_key('1.2.3', files[:2]) != key
+
+        # A modified file gives a new key
+        stat = os.stat(files[1])
+        os.utime(files[1], (stat.st_atime, stat.st_mtime + 10))
+        assert cache.get_key('1.2.3', files) != key
+    finally:
+        shutil.rmtree(cache_dir)